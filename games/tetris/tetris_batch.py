@@ -0,0 +1,246 @@
+"""
+Lockstep simulator: a lot of independent games played at the same time by the greedy agent, with NumPy.
+
+Every game has its own stream of pieces and its own weights. In every step all the games still playing
+place their next piece at once with array operations and the finished games are left out (masked),
+so a whole GA population can be evaluated in one process.
+
+It plays like TetrisAgent: same placements tried in the same order, same heuristics and same tie-breaking,
+but the pieces come from the streams instead of being random.
+
+The playfields are kept as (games, rows) row masks with some extra bits and rows around them:
+
+    index 0          : the floor, all bits set
+    index 1 .. rows  : the rows of the playfield, bit WALL_BITS is the column x=1
+    after the rows   : the ceiling, all bits set
+    WALL_BITS bits on both sides of every row are always set (the walls)
+
+so a piece going through a wall, the floor or the ceiling collides like with any other block.
+
+NumPy is required for this module.
+"""
+
+import numpy as np
+from tetris_agent import weight_names
+from tetris_engine import Ruleset, default_ruleset
+import tetris_numpy
+
+WALL_BITS = 3   # a piece never goes further than 2 blocks away from its center
+CEILING_ROWS = 4 # a piece is never higher than 4 rows
+
+class BatchTetrisSimulator:
+
+    def __init__(self, piece_streams :any, weights :list[dict], ruleset :Ruleset = None) -> None:
+        """
+        :param piece_streams: (games, pieces) array-like with the index of every shape in the ruleset (Ruleset.shapes),
+                              or a list of streams of the same length (see PieceSource.get_stream)
+        :param weights: one dict of weights per game, see TetrisAgent.calculate_heuristics
+        :param ruleset: the same one for all the games, by default the one of the config
+        """
+        if len(piece_streams) and isinstance(piece_streams[0], bytes):
+            piece_streams = [ np.frombuffer(stream, dtype=np.uint8) for stream in piece_streams ]
+        self.piece_streams = np.asarray(piece_streams, dtype=np.int64)
+        if self.piece_streams.ndim != 2:
+            raise ValueError("piece_streams must be (games, pieces)")
+        self.number_of_games, self.number_of_pieces = self.piece_streams.shape
+        if len(weights) != self.number_of_games:
+            raise ValueError(f"{len(weights)} weights for {self.number_of_games} games")
+
+        self.weights = {
+            name: np.array([ game_weights[name] for game_weights in weights ], dtype=np.float64)
+            for name in weight_names
+        }
+
+        self.ruleset = ruleset or default_ruleset
+        self.columns = self.ruleset.columns
+        self.rows = self.ruleset.rows
+        self.starting_x = self.ruleset.starting_x
+        self.starting_y = self.ruleset.starting_y
+        self.shapes = list(self.ruleset.shapes)
+        self.orientation_table = self.ruleset.orientation_table
+
+        self.dtype = tetris_numpy.get_row_mask_dtype(self.columns + 2 * WALL_BITS)
+        self.columns_mask = (1 << self.columns) - 1
+        self.full_row = self.dtype.type((1 << (self.columns + 2 * WALL_BITS)) - 1)
+        self.inner_row = self.dtype.type(self.columns_mask << WALL_BITS)
+        self.empty_row = self.dtype.type(self.full_row & ~self.inner_row)
+
+        self._compile_positions()
+        self._compile_candidates()
+        self.reset()
+
+    def _compile_candidates(self) -> None:
+        """
+        Same candidates and in the same order as TetrisAgent.get_placement_candidates:
+        not moving, one to the left, one to the right, two to the left... and for each one 0 to 3 left rotations.
+        We keep also the ones ending in the same place, the first valid one wins in case of a draw like in the agent.
+
+        candidate_required says which spawn positions (see _compile_positions) must be free to get there:
+        the rotations in the starting position and moving sideways at the spawn height
+        """
+        offsets = [0]
+        for movements in range(1, self.columns // 2 + 1):
+            offsets += [-movements, movements]
+
+        candidates_by_shape = []
+        for shape in self.shapes:
+            candidates = []
+            for offset in offsets:
+                for rotations in range(4):
+                    angles = [ (-90 * rotation) % 360 for rotation in range(1, rotations + 1) ]
+                    angle = angles[-1] if angles else 0
+                    center_x = self.starting_x + offset
+                    orientation = self.orientation_table[(shape, angle)]
+                    if not 1 <= center_x + orientation.min_relative_x <= center_x + orientation.max_relative_x <= self.columns:
+                        continue
+                    required = [ self._get_position_index(rotation_angle, self.starting_x) for rotation_angle in angles ]
+                    step = 1 if center_x >= self.starting_x else -1
+                    required += [ self._get_position_index(angle, x) for x in range(self.starting_x, center_x + step, step) ]
+                    candidates.append((angle, center_x, required))
+            candidates_by_shape.append(candidates)
+
+        number_of_shapes = len(self.shapes)
+        number_of_candidates = max(len(candidates) for candidates in candidates_by_shape)
+        number_of_positions = self.position_masks.shape[1]
+        self.candidate_valid = np.zeros((number_of_shapes, number_of_candidates), dtype=bool)
+        self.candidate_angle = np.zeros((number_of_shapes, number_of_candidates), dtype=np.int64)
+        self.candidate_center_x = np.zeros((number_of_shapes, number_of_candidates), dtype=np.int64)
+        self.candidate_masks = np.zeros((number_of_shapes, number_of_candidates, 4), dtype=self.dtype)
+        self.candidate_spawn_bottom = np.zeros((number_of_shapes, number_of_candidates), dtype=np.int64)
+        self.candidate_required = np.zeros((number_of_shapes, number_of_candidates, number_of_positions), dtype=np.float32) # 0 or 1, to multiply
+
+        for shape_index, candidates in enumerate(candidates_by_shape):
+            for candidate_index, (angle, center_x, required) in enumerate(candidates):
+                position_index = self._get_position_index(angle, center_x)
+                self.candidate_valid[shape_index, candidate_index] = True
+                self.candidate_angle[shape_index, candidate_index] = angle
+                self.candidate_center_x[shape_index, candidate_index] = center_x
+                self.candidate_masks[shape_index, candidate_index] = self.position_masks[shape_index, position_index]
+                self.candidate_spawn_bottom[shape_index, candidate_index] = self.position_bottom[shape_index, position_index]
+                self.candidate_required[shape_index, candidate_index, required] = 1
+
+    def _compile_positions(self) -> None:
+        """
+        Every shape at every angle and every center_x, at the spawn height.
+        position_masks are the rows of the piece from its bottom row up, already shifted to their columns,
+        and position_bottom the index of the bottom row of the piece in the playfield array
+        """
+        number_of_positions = 4 * self.columns
+        self.position_masks = np.zeros((len(self.shapes), number_of_positions, 4), dtype=self.dtype)
+        self.position_bottom = np.zeros((len(self.shapes), number_of_positions), dtype=np.int64)
+        for shape_index, shape in enumerate(self.shapes):
+            for angle in (0, 90, 180, 270):
+                orientation = self.orientation_table[(shape, angle)]
+                for center_x in range(1, self.columns + 1):
+                    position_index = self._get_position_index(angle, center_x)
+                    shift = center_x + orientation.min_relative_x - 1 + WALL_BITS
+                    for dy, row_mask in enumerate(orientation.row_masks):
+                        self.position_masks[shape_index, position_index, dy] = row_mask << shift
+                    self.position_bottom[shape_index, position_index] = self.starting_y + orientation.min_relative_y
+
+    def _get_position_index(self, angle :int, center_x :int) -> int:
+        return (angle // 90) * self.columns + center_x - 1
+
+    def _is_spawn_blocked(self, playfields :np.ndarray, shape_indexes :np.ndarray, position_indexes :np.ndarray) -> np.ndarray:
+        """ For every playfield, if the piece at that spawn position collides. The last dimension are the positions """
+        masks = self.position_masks[shape_indexes[:, np.newaxis], position_indexes]  # (games, positions, 4)
+        bottom = self.position_bottom[shape_indexes[:, np.newaxis], position_indexes] # (games, positions)
+        games = np.arange(len(playfields))[:, np.newaxis]
+        overlaps = playfields[games, bottom] & masks[..., 0]
+        for dy in range(1, 4):
+            overlaps |= playfields[games, bottom + dy] & masks[..., dy]
+        return overlaps != 0
+
+    def get_results(self) -> dict:
+        return {
+            "lines_cleared": self.lines_cleared.copy(),
+            "pieces_placed": self.pieces_placed.copy(),
+            "is_game_over":  self.is_game_over.copy()
+        }
+
+    def reset(self) -> None:
+        self.playfields = np.full((self.number_of_games, 1 + self.rows + CEILING_ROWS), self.full_row, dtype=self.dtype)
+        self.playfields[:, 1:self.rows + 1] = self.empty_row
+        self.lines_cleared = np.zeros(self.number_of_games, dtype=np.int64)
+        self.pieces_placed = np.zeros(self.number_of_games, dtype=np.int64)
+        self.is_game_over = np.zeros(self.number_of_games, dtype=bool)
+        self.is_finished = np.full(self.number_of_games, self.number_of_pieces == 0)
+        self.piece_index = 0
+
+    def get_row_masks(self, game :int) -> tuple[int, ...]:
+        """ Like Playfield.get_all_row_masks for one of the games """
+        return tuple( (int(row) >> WALL_BITS) & self.columns_mask for row in self.playfields[game, 1:self.rows + 1] )
+
+    def run(self) -> dict:
+        """ It plays until all the games are over or out of pieces """
+        while self.step():
+            pass
+        return self.get_results()
+
+    def step(self) -> bool:
+        """
+        All the games still playing place their next piece. It returns false when there are no games left.
+        """
+        games = np.flatnonzero(~self.is_finished)
+        if len(games) == 0:
+            return False
+        number_of_games = len(games)
+        piece_index = self.piece_index # lockstep: all the games playing are placing the same piece of their streams
+        shape_indexes = self.piece_streams[games, piece_index]
+        playfields = self.playfields[games]
+        height = playfields.shape[1]
+
+        # Which candidates can get to their column: the spawn positions they go through must be free
+        all_positions = np.broadcast_to(np.arange(self.position_masks.shape[1]), (number_of_games, self.position_masks.shape[1]))
+        spawn_blocked = self._is_spawn_blocked(playfields, shape_indexes, all_positions)
+        blocked_required = np.matmul(self.candidate_required[shape_indexes], spawn_blocked[..., np.newaxis].astype(np.float32))[..., 0]
+        valid = self.candidate_valid[shape_indexes] & (blocked_required == 0)
+
+        # Dropping: the piece lands just above the highest collision below the spawn position (the floor at least)
+        masks = self.candidate_masks[shape_indexes] # (games, candidates, 4)
+        bottoms = np.arange(height - 3)
+        overlaps = np.zeros((number_of_games, masks.shape[1], len(bottoms)), dtype=self.dtype)
+        for dy in range(4):
+            overlaps |= playfields[:, np.newaxis, bottoms + dy] & masks[:, :, dy, np.newaxis]
+        collisions = (overlaps != 0) & (bottoms < self.candidate_spawn_bottom[shape_indexes][..., np.newaxis])
+        landing = np.where(collisions, bottoms, -1).max(axis=-1) + 1 # (games, candidates)
+
+        results = np.repeat(playfields[:, np.newaxis, :], masks.shape[1], axis=1)
+        for dy in range(4):
+            row_indexes = np.minimum(landing + dy, height - 1)[..., np.newaxis] # masks are 0 above the piece
+            values = np.take_along_axis(results, row_indexes, axis=-1) | masks[..., dy, np.newaxis]
+            np.put_along_axis(results, row_indexes, values, axis=-1)
+
+        # Clearing the full lines: the rows kept go down (stable sort) and empty rows at the top
+        rows = results[..., 1:self.rows + 1]
+        full = (rows & self.inner_row) == self.inner_row
+        lines_cleared = full.sum(axis=-1)
+        rows = np.take_along_axis(rows, np.argsort(full, axis=-1, kind="stable"), axis=-1)
+        rows = np.where(np.arange(self.rows) >= self.rows - lines_cleared[..., np.newaxis], self.empty_row, rows)
+
+        statistics = tetris_numpy.get_playfield_statistics((rows >> WALL_BITS) & self.columns_mask, self.columns)
+        weights = { name: values[games, np.newaxis] for name, values in self.weights.items() }
+        fitting_algorithm = tetris_numpy.calculate_heuristics(statistics, lines_cleared, weights)
+        fitting_algorithm = np.where(valid, fitting_algorithm, np.inf)
+        best = fitting_algorithm.argmin(axis=-1)
+
+        # A game without any valid placement is over (only if its piece didn't fit when spawning)
+        no_placement = ~valid.any(axis=-1)
+        placed = ~no_placement
+        self.playfields[games[placed], 1:self.rows + 1] = rows[placed, best[placed]]
+        self.lines_cleared[games[placed]] += lines_cleared[placed, best[placed]]
+        self.pieces_placed[games[placed]] += 1
+
+        # Game over when the next piece can't spawn. Out of pieces is finished but not game over
+        if piece_index + 1 < self.number_of_pieces:
+            next_shape_indexes = self.piece_streams[games, piece_index + 1]
+            spawn_position = np.full((number_of_games, 1), self._get_position_index(0, self.starting_x))
+            next_blocked = self._is_spawn_blocked(self.playfields[games], next_shape_indexes, spawn_position)[:, 0]
+            self.is_game_over[games] = no_placement | next_blocked
+            self.is_finished[games] = self.is_game_over[games]
+        else:
+            self.is_game_over[games] = no_placement
+            self.is_finished[games] = True
+
+        self.piece_index += 1
+        return True
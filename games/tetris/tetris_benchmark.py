@@ -0,0 +1,170 @@
+"""
+Benchmarks of the engine, the agent and the genetic algorithm, always with the same seeds so every run does the same work.
+
+Every workload is run some times (--repeat) and we keep the median and the spread of its throughput (operations per second):
+
+    collision_checks : TetrisEngine.can_place of every orientation in every position of a played playfield
+    placements       : TetrisEngine.place of every placement of every shape (and the snapshot restored after each one)
+    greedy_games     : games of 300 movements played by the greedy TetrisAgent
+    wide_games       : the same games in a 20x40 board (Ruleset(columns=20, rows=42)), side by side with the others
+    statistics       : TetrisAgent.get_playfield_statistics of a played playfield
+    ga_generations   : generations of a small GeneticAlgorithm in one process (per minute)
+
+The results can be saved as JSON and compared with the ones of a baseline (e.g. saved before changing the engine).
+A workload is a regression when its median is more than --tolerance slower than the baseline median.
+The baseline depends on the computer, so make your own one:
+
+    python tetris_benchmark.py --output baseline.json
+    ... changes ...
+    python tetris_benchmark.py --baseline baseline.json
+
+It exits with 1 if there is any regression.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+from time import perf_counter
+from tetris_agent import TetrisAgent, example_weights
+from tetris_engine import PieceSource, Ruleset, orientation_table
+from tetris_genetic_algorithm import GeneticAlgorithm
+
+def get_played_agent(seed :int = 7, pieces :int = 40) -> TetrisAgent:
+    """ An agent with some pieces already played, so the playfield is not empty """
+    agent = TetrisAgent(seed=seed)
+    for _ in range(pieces):
+        agent.play_sequence(agent.get_best_sequence(agent.get_possible_placements(), example_weights))
+    return agent
+
+def benchmark_collision_checks() -> int:
+    agent = get_played_agent()
+    checks = 0
+    for _ in range(20):
+        for orientation in orientation_table.values():
+            for center_x in range(agent.playfield.min_x, agent.playfield.columns + 1):
+                for center_y in range(agent.playfield.min_y, agent.playfield.rows + 1):
+                    agent.can_place(orientation, center_x, center_y)
+                    checks += 1
+    return checks
+
+def benchmark_placements() -> int:
+    agent = get_played_agent()
+    playfield_snapshot = agent.playfield.get_snapshot()
+    placements = 0
+    for _ in range(20):
+        for shape in PieceSource.shapes:
+            for _, angle, center_x in agent.get_possible_placements(shape):
+                agent.place(shape, angle, center_x)
+                agent.playfield.restore_snapshot(playfield_snapshot)
+                placements += 1
+    return placements
+
+def benchmark_greedy_games() -> int:
+    games = 4
+    for seed in range(games):
+        TetrisAgent(seed=seed).play_game(example_weights, 300)
+    return games
+
+def benchmark_wide_games() -> int:
+    games = 4
+    ruleset = Ruleset(columns=20, rows=42)
+    for seed in range(games):
+        TetrisAgent(seed=seed, ruleset=ruleset).play_game(example_weights, 300)
+    return games
+
+def benchmark_statistics() -> int:
+    agent = get_played_agent()
+    evaluations = 20000
+    for _ in range(evaluations):
+        agent.get_playfield_statistics(agent.playfield)
+    return evaluations
+
+def benchmark_ga_generations() -> float:
+    genetic_algorithm = GeneticAlgorithm(population_size=8, generations=2, games_per_individual=1,
+                                         max_number_of_movements=100, elitism=2, seed=7, processes=1)
+    genetic_algorithm.report = lambda generation_statistics: None
+    genetic_algorithm.run()
+    return genetic_algorithm.generations * 60 # per minute
+
+workloads = {
+    # name: (function returning the operations done, unit)
+    "collision_checks": (benchmark_collision_checks, "checks/s"),
+    "placements":       (benchmark_placements,       "placements/s"),
+    "greedy_games":     (benchmark_greedy_games,     "games/s"),
+    "wide_games":       (benchmark_wide_games,       "games/s"),
+    "statistics":       (benchmark_statistics,       "evaluations/s"),
+    "ga_generations":   (benchmark_ga_generations,   "generations/min")
+}
+
+def compare_with_baseline(results :dict, baseline :dict, tolerance :float) -> list[str]:
+    """ The names of the workloads whose median is more than tolerance (e.g. 0.1 = 10%) slower than in the baseline """
+    regressions = []
+    for name, result in results["workloads"].items():
+        if name not in baseline["workloads"]:
+            continue
+        if result["median"] < baseline["workloads"][name]["median"] * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+def run_benchmarks(names :list[str], repeat :int) -> dict:
+    results = {
+        "python":    platform.python_version(),
+        "machine":   platform.machine(),
+        "repeat":    repeat,
+        "workloads": {}
+    }
+    for name in names:
+        results["workloads"][name] = run_workload(name, repeat)
+    return results
+
+def run_workload(name :str, repeat :int) -> dict:
+    """ The throughput of every run, its median and its spread """
+    function, unit = workloads[name]
+    function() # warm up (caches, imports...)
+    throughputs = []
+    for _ in range(repeat):
+        t_start = perf_counter()
+        operations = function()
+        throughputs.append(operations / (perf_counter() - t_start))
+    return {
+        "unit":        unit,
+        "median":      statistics.median(throughputs),
+        "min":         min(throughputs),
+        "max":         max(throughputs),
+        "stdev":       statistics.stdev(throughputs) if repeat > 1 else 0.0,
+        "throughputs": throughputs
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the Tetris engine, agent and genetic algorithm")
+    parser.add_argument("--workloads", nargs="+", choices=list(workloads), default=list(workloads))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON file to save the results")
+    parser.add_argument("--baseline", help="JSON file with the results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown allowed before a regression (0.1 = 10%%)")
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.workloads, arguments.repeat)
+
+    baseline = None
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    for name, result in results["workloads"].items():
+        line = f'{name:17} {result["median"]:12.1f} {result["unit"]:16} (min {result["min"]:.1f} max {result["max"]:.1f})'
+        if baseline and name in baseline["workloads"]:
+            line += f' {result["median"] / baseline["workloads"][name]["median"] - 1:+7.1%} vs baseline'
+        print(line)
+
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+    if baseline:
+        regressions = compare_with_baseline(results, baseline, arguments.tolerance)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}')
+            sys.exit(1)
@@ -6,7 +6,10 @@ https://tetris.fandom.com/wiki/SRS
 https://tetris.fandom.com/wiki/Tetris_Guideline
 
 Playfield   : just a grid with all the tetrominoes, each cell has one letter value
+TetrominoOrientation: a tetromino at one angle, precompiled from the config (see orientation_table)
+Ruleset     : board size, hidden rows, spawn and tetrominoes of a game, validated and compiled once (see default_ruleset)
 FallingPiece: information about the piece about to fall
+PieceSource : where the shapes of the falling pieces come from, every engine has its own one
 TetrisEngine: all the Tetris logic
 
 """
@@ -122,11 +125,146 @@ config = {
     }
 }
 
+class TetrominoOrientation:
+    """
+    One entry of the orientation table: everything we need to know about a tetromino rotated at some angle.
+    All the values are relative to the center of the piece:
+
+    row_masks     : the rows of the piece from its bottom row up, bit 0 = leftmost column of the piece
+    bottom_profile: for every column of the piece (left to right) how high is its lowest block from the bottom of the piece
+    """
+    def __init__(self, shape :TetrominoShape, angle :int, relative_coordinates :list[list[int]]) -> None:
+        self.shape = shape
+        self.angle = angle
+        self.relative_coordinates = tuple( (relative_x, relative_y) for relative_x, relative_y in relative_coordinates )
+
+        self.min_relative_x = min(relative_x for relative_x, _ in self.relative_coordinates)
+        self.max_relative_x = max(relative_x for relative_x, _ in self.relative_coordinates)
+        self.min_relative_y = min(relative_y for _, relative_y in self.relative_coordinates)
+        self.max_relative_y = max(relative_y for _, relative_y in self.relative_coordinates)
+        self.width = self.max_relative_x - self.min_relative_x + 1
+        self.height = self.max_relative_y - self.min_relative_y + 1
+
+        row_masks = [0] * self.height
+        bottom_profile = [self.height] * self.width
+        for relative_x, relative_y in self.relative_coordinates:
+            column = relative_x - self.min_relative_x
+            row = relative_y - self.min_relative_y
+            row_masks[row] |= 1 << column
+            bottom_profile[column] = min(bottom_profile[column], row)
+        self.row_masks = tuple(row_masks)
+        self.bottom_profile = tuple(bottom_profile)
+
+    def __str__(self) -> str:
+        return f'{self.shape} - {self.angle}°'
+
+def compile_orientation_table(tetrominoes :list[dict]) -> dict[tuple[TetrominoShape, int], TetrominoOrientation]:
+    """
+    The tetrominoes in the config are nested (shape -> orientations -> angles) and easy to read for us,
+    but we don't want to search them every time a piece rotates or spawns.
+    We flatten them once into a table indexed by (shape, angle)
+    """
+    orientation_table = {}
+    for tetromino in tetrominoes:
+        for orientation in tetromino["orientations"]:
+            for angle in orientation["angles"]:
+                orientation_table[(tetromino["shape"], angle)] = TetrominoOrientation(
+                    tetromino["shape"], angle, orientation["relative_coordinates"])
+    return orientation_table
+
+class Ruleset:
+    """
+    The rules of a game: board size, hidden rows, spawn position and tetrominoes (same format as config["tetrominoes"]).
+    They are validated and compiled once and every engine has its own ruleset (by default default_ruleset,
+    the one of the config), so games with different rules can be played side by side in the same process,
+    e.g. Ruleset(columns=20, rows=42) for a 20x40 board.
+
+    Everything the engine needs in its hot paths is a plain attribute, no nested dicts:
+    orientation_table, shapes (in the order of the tetrominoes, their index is the one in records and streams),
+    shape_indexes, spawn_orientations, starting_x, starting_y...
+    """
+    def __init__(self,
+        columns :int = 10,
+        rows :int = 22,
+        hidden_top_rows :int = 2,
+        starting_x :int = None,
+        starting_y :int = None,
+        tetrominoes :list[dict] = None,
+        gravity_speed :int = 2000) -> None:
+        """
+        :param rows: all the rows, including the hidden ones at the top
+        :param starting_x: spawn position of the center of the pieces, by default in the middle of the board
+        :param starting_y: by default in the top visible row
+        :param tetrominoes: by default the ones of the config
+        :param gravity_speed: ms between the moves down of the falling piece (for the UIs and the sessions)
+        """
+        self.columns = columns
+        self.rows = rows
+        self.hidden_top_rows = hidden_top_rows
+        self.visible_rows = rows - hidden_top_rows
+        self.starting_x = columns // 2 if starting_x is None else starting_x
+        self.starting_y = self.visible_rows if starting_y is None else starting_y
+        self.tetrominoes = config["tetrominoes"] if tetrominoes is None else tetrominoes
+        self.gravity_speed = gravity_speed
+
+        if columns < 4 or self.visible_rows < 4 or hidden_top_rows < 0:
+            raise ValueError(f"A board of {columns} columns and {rows} rows ({hidden_top_rows} hidden) is too small for the tetrominoes")
+        if not self.tetrominoes:
+            raise ValueError("There have to be some tetrominoes")
+
+        self.orientation_table = compile_orientation_table(self.tetrominoes)
+        self.shapes = tuple([ tetromino["shape"] for tetromino in self.tetrominoes ])
+        if len(set(self.shapes)) != len(self.shapes) or TetrominoShape.NONE in self.shapes:
+            raise ValueError("Every tetromino has to have its own shape")
+        self.shape_indexes = { shape: index for index, shape in enumerate(self.shapes) }
+        for shape in self.shapes:
+            for angle in (0, 90, 180, 270):
+                if (shape, angle) not in self.orientation_table:
+                    raise ValueError(f"The shape {shape} has no orientation for the angle {angle}")
+                # The rest of the code counts on it: 4 blocks per piece (frames, records), never more than 2 blocks
+                # away from the center (the walls and the ceiling of the batch simulator, the row masks of the orientations)
+                relative_coordinates = self.orientation_table[(shape, angle)].relative_coordinates
+                if len(set(relative_coordinates)) != 4 or len(relative_coordinates) != 4:
+                    raise ValueError(f"The shape {shape} at the angle {angle} doesn't have 4 blocks")
+                if any(abs(value) > 2 for relative_x_y in relative_coordinates for value in relative_x_y):
+                    raise ValueError(f"The shape {shape} at the angle {angle} has blocks more than 2 blocks away from its center")
+        self.spawn_orientations = tuple([ self.orientation_table[(shape, 0)] for shape in self.shapes ])
+        for orientation in self.spawn_orientations:
+            if not (1 <= self.starting_x + orientation.min_relative_x and self.starting_x + orientation.max_relative_x <= columns
+                    and 1 <= self.starting_y + orientation.min_relative_y and self.starting_y + orientation.max_relative_y <= rows):
+                raise ValueError(f"The shape {orientation.shape} doesn't fit in the board at the spawn position")
+
+    @classmethod
+    def from_config(cls, config :dict) -> "Ruleset":
+        playfield = config["playfield"]
+        return cls(
+            playfield["columns"],
+            playfield["rows"],
+            playfield["hidden_top_rows"],
+            playfield["falling_piece"]["starting_x"],
+            playfield["falling_piece"]["starting_y"],
+            config["tetrominoes"],
+            playfield["falling_piece"]["gravity_speed"])
+
+default_ruleset = Ruleset.from_config(config)
+orientation_table = default_ruleset.orientation_table # the orientations of default_ruleset
+
 class Playfield:
     """
     Playfield is a grid/board with the bottom row = first row
 
     and the coordinates start on the left bottom corner (1,1)
+
+    Next to the grid of letters we keep an occupancy index: one integer bitmask per row,
+    where bit 0 is the column x=1. Collision checks and full lines only need the bitmasks.
+
+    We also keep updated, every time a block is set or lines are cleared, (read only please):
+    column_heights  : highest non empty row of every column (0 if the column is empty)
+    column_holes    : empty blocks below the highest non empty row of every column
+    row_fill_counts : non empty blocks of every row
+    board_hash      : 64 bits hash of the occupied blocks, the key of the playfield in any cache (see _get_row_hash)
+
+    Two playfields are equal when they have the same blocks occupied, the shapes (colors) don't matter.
     """
     def __init__(self, columns: int, rows: int, hidden_top_rows :int) -> None:
         self.min_x = 1
@@ -134,47 +272,161 @@ class Playfield:
         self.columns = columns
         self.rows = rows
         self.visible_rows = rows - hidden_top_rows # E.g. internally 22 rows but visible in the screen only the 20 bottom ones
+        self.full_row_mask = (1 << columns) - 1
         self.clear()
 
     def _get_grid_coordinates(self, x :int, y :int) -> list:
         """
         Playfield coordinates to internal grid coordinates
-        Playfield (x,y) = (1,1) is the left bottom corner
+        Playfield (x,y) = (1,1) is the left bottom corner and it is the first element of the first row in the grid
+        """
+        return [x - 1, y - 1]
+
+    def _get_hash(self) -> int:
+        board_hash = 0
+        for grid_y, row_mask in enumerate(self._row_masks):
+            if row_mask:
+                board_hash ^= self._get_row_hash(grid_y, row_mask)
+        return board_hash
+
+    @staticmethod
+    def _get_row_hash(grid_y :int, row_mask :int) -> int:
+        """
+        The hash of the playfield is the XOR of the hashes of its rows (the empty rows are 0),
+        so when a block changes we only XOR out the old row and XOR in the new one.
+        This is splitmix64 of the row mask and the row, like Zobrist hashing but one number per row instead of per block,
+        which also lets us hash the rows again after clearing lines without a table of random numbers per block
         """
-        return [x - 1, self.rows - y]
+        z = (row_mask + (grid_y + 1) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return z ^ (z >> 31)
+
+    def _get_row_mask_from_values(self, row :list[str]) -> int:
+        mask = 0
+        for grid_x, value in enumerate(row):
+            if value != str(TetrominoShape.NONE):
+                mask |= 1 << grid_x
+        return mask
+
+    def _update_column_statistics(self, grid_x :int) -> None:
+        """ Height and holes of a column from scratch, only when we can't know them from the previous values """
+        bit = 1 << grid_x
+        height = 0
+        blocks = 0
+        for grid_y in range(self.rows - 1, -1, -1):
+            if self._row_masks[grid_y] & bit:
+                if height == 0:
+                    height = grid_y + 1
+                blocks += 1
+        self.column_heights[grid_x] = height
+        self.column_holes[grid_x] = height - blocks
+
+    def _update_row_hash(self, grid_y :int, old_row_mask :int) -> None:
+        if old_row_mask:
+            self.board_hash ^= self._get_row_hash(grid_y, old_row_mask)
+        self.board_hash ^= self._get_row_hash(grid_y, self._row_masks[grid_y])
+
+    def _update_statistics(self) -> None:
+        self.row_fill_counts = [ row_mask.bit_count() for row_mask in self._row_masks ]
+        self.column_heights = [0] * self.columns
+        self.column_holes = [0] * self.columns
+        for grid_x in range(self.columns):
+            self._update_column_statistics(grid_x)
+
+    def are_blocks_available(self, row_masks :list[int], left_x :int, bottom_y :int, width :int) -> bool:
+        """
+        Same as is_block_available but for a whole piece at once.
+        row_masks are the rows of the piece from its bottom row up, bit 0 being the column left_x.
+        Boundaries first and later one AND per row of the piece.
+        """
+        if left_x < self.min_x or left_x + width - 1 > self.columns:
+            return False
+        if bottom_y < self.min_y or bottom_y + len(row_masks) - 1 > self.rows:
+            return False
+        shift = left_x - 1
+        occupied_rows = self._row_masks
+        for dy, mask in enumerate(row_masks):
+            if occupied_rows[bottom_y - 1 + dy] & (mask << shift):
+                return False
+        return True
 
     def clear(self) -> None:
         self._grid = [[str(TetrominoShape.NONE)] * self.columns for y in range(self.rows)]
+        self._row_masks = [0] * self.rows
+        self._update_statistics()
+        self.board_hash = 0
 
     def clear_full_lines(self) -> int:
         """
         It is difficult to remove elements (full lines) from a grid.
         It is safer to create a new grid without those full lines
-        and later add empty lines at the top to replace the full lines removed
+        and later add empty lines at the top to replace the full lines removed.
+        A line is full when its bitmask has all the bits set.
+
+        Full lines have no holes so the holes don't change, and the columns are lines_cleared lower,
+        unless the highest block of a column was in a full line: only then we count that column again.
         """
-        new_grid = [ self._grid[y].copy() for y in range(self.rows) if str(TetrominoShape.NONE) in self._grid[y] ]
-        
-        lines_cleared = self.rows - len(new_grid)
-        for _ in range(lines_cleared):
-            new_grid.insert(0, [str(TetrominoShape.NONE)] * self.columns)
+        full_row_mask = self.full_row_mask
+        if full_row_mask not in self._row_masks:
+            return 0
+
+        rows_kept = [ y for y in range(self.rows) if self._row_masks[y] != full_row_mask ]
+
+        lines_cleared = self.rows - len(rows_kept)
+        self._grid = [ self._grid[y] for y in rows_kept ] + [ [str(TetrominoShape.NONE)] * self.columns for _ in range(lines_cleared) ]
+        self._row_masks = [ self._row_masks[y] for y in rows_kept ] + [0] * lines_cleared
+        self.row_fill_counts = [ self.row_fill_counts[y] for y in rows_kept ] + [0] * lines_cleared
 
-        self._grid = new_grid
+        for grid_x in range(self.columns):
+            height = self.column_heights[grid_x] - lines_cleared
+            if height > 0 and self._row_masks[height - 1] & (1 << grid_x):
+                self.column_heights[grid_x] = height
+            else:
+                self._update_column_statistics(grid_x)
+
+        self.board_hash = self._get_hash() # all the rows above the full lines moved down
 
         return lines_cleared
 
+    def get_all_row_masks(self) -> tuple[int, ...]:
+        """ Occupancy of all the rows from the first row (bottom) to the last row (top) """
+        return tuple(self._row_masks)
+
     def get_all_rows(self) -> list[list[str]]:
         """ It gets a deep copy of all the rows from the first row (bottom) to the last row (top) """
-        return list( reversed([ list(row) for row in self._grid ]) )
+        return [ list(row) for row in self._grid ]
 
     def get_block(self, x :int, y :int) -> str:
         [grid_x, grid_y] = self._get_grid_coordinates(x, y)
         return self._grid[grid_y][grid_x]
 
+    def get_shared_rows(self) -> tuple[list[str], ...]:
+        """
+        All the rows from the first row (bottom) to the last row (top), not copied: never change them.
+        set_block replaces a row instead of changing it (copy on write), so if a row is the same object
+        as some time ago, it didn't change
+        """
+        return tuple(self._grid)
+
+    def get_snapshot(self) -> tuple:
+        """
+        Immutable value of the playfield that can be restored later with restore_snapshot.
+        It is cheap: the rows are not copied, they are shared between the snapshot and the playfield
+        because set_block never changes a row in place, it replaces it (copy on write)
+        """
+        return (tuple(self._row_masks), tuple(self._grid),
+                tuple(self.column_heights), tuple(self.column_holes), tuple(self.row_fill_counts), self.board_hash)
+
     def get_row(self, y :int) -> list[str]:
         """ Deep copy of a row. Bottom row is row y=1 """
         [_, grid_y] = self._get_grid_coordinates(1, y)
         return [ value for value in self._grid[grid_y] ]
 
+    def get_row_mask(self, y :int) -> int:
+        """ Occupancy of a row, bit 0 is the column x=1. Bottom row is row y=1 """
+        return self._row_masks[y - 1]
+
     def is_block_available(self, x: int, y: int) -> bool:
         """
         Order is important. First check for the boundaries and later if it is empty.
@@ -183,23 +435,62 @@ class Playfield:
         return self.is_block_within_boundaries(x, y) and self.is_block_empty(x, y)
 
     def is_block_empty(self, x: int, y: int) -> bool:
-        return self.get_block(x, y) == str(TetrominoShape.NONE)
+        return not self._row_masks[y - 1] & (1 << (x - 1))
 
     def is_block_within_boundaries(self, x :int, y: int) -> bool:
         return self.min_x <= x <= self.columns and self.min_y <= y <= self.rows
 
+    def restore_snapshot(self, snapshot :tuple) -> None:
+        row_masks, grid, column_heights, column_holes, row_fill_counts, self.board_hash = snapshot
+        self._row_masks = list(row_masks)
+        self._grid = list(grid)
+        self.column_heights = list(column_heights)
+        self.column_holes = list(column_holes)
+        self.row_fill_counts = list(row_fill_counts)
+
     def set_all_rows(self, rows :list[list[str]]) -> None:
         """ It sets all rows (deep copy) from the first row (bottom) to the last row (top) """
-        self._grid = [ list(row) for row in reversed(rows) ]
+        self._grid = [ list(row) for row in rows ]
+        self._row_masks = [ self._get_row_mask_from_values(row) for row in self._grid ]
+        self._update_statistics()
+        self.board_hash = self._get_hash()
 
     def set_block(self, x: int, y: int, shape: TetrominoShape) -> None:
         [grid_x, grid_y] = self._get_grid_coordinates(x, y)
-        self._grid[grid_y][grid_x] = str(shape)
+        row = self._grid[grid_y].copy() # the old row may be shared with a snapshot
+        row[grid_x] = str(shape)
+        self._grid[grid_y] = row
+
+        bit = 1 << grid_x
+        row_mask = self._row_masks[grid_y]
+        was_empty = not row_mask & bit
+        if shape == TetrominoShape.NONE:
+            if not was_empty:
+                self._row_masks[grid_y] &= ~bit
+                self._update_row_hash(grid_y, row_mask)
+                self.row_fill_counts[grid_y] -= 1
+                self._update_column_statistics(grid_x)
+        elif was_empty:
+            self._row_masks[grid_y] |= bit
+            self._update_row_hash(grid_y, row_mask)
+            self.row_fill_counts[grid_y] += 1
+            height = self.column_heights[grid_x]
+            if y > height:
+                self.column_holes[grid_x] += y - height - 1 # the empty blocks in between are holes now
+                self.column_heights[grid_x] = y
+            else:
+                self.column_holes[grid_x] -= 1 # we filled a hole
+
+    def __eq__(self, other :object) -> bool:
+        """ The hashes first, so two different playfields are almost always told apart in O(1) """
+        if not isinstance(other, Playfield):
+            return NotImplemented
+        return self.board_hash == other.board_hash and self.columns == other.columns and self._row_masks == other._row_masks
 
     def __str__(self) -> str:
         """ Useful for debugging to dump to the command line the grid values """
         grid = ""
-        for row in self._grid:
+        for row in reversed(self._grid):
             line = ""
             for block in row:
                 line = line + " " + (block if block != str(TetrominoShape.NONE) else "•")
@@ -208,8 +499,11 @@ class Playfield:
 
 class FallingPiece:
 
-    def __init__(self, shape :TetrominoShape) -> None:
-        self.tetrominoes = config["tetrominoes"]
+    def __init__(self, shape :TetrominoShape, ruleset :Ruleset = None) -> None:
+        ruleset = ruleset or default_ruleset
+        self.orientation_table = ruleset.orientation_table
+        self.starting_x = ruleset.starting_x
+        self.starting_y = ruleset.starting_y
         self.set_new_falling_piece(shape)
 
     def __str__(self) -> str:
@@ -222,37 +516,100 @@ class FallingPiece:
         return self.get_absolute_coordinates(self.center_x, self.center_y)
 
     def get_relative_coordinates(self, angle :int) -> any:
-        data = next((orientation for orientation in self.orientations if angle in orientation["angles"]), None)
-        return data["relative_coordinates"]
+        return self.orientation_table[(self.shape, angle)].relative_coordinates
 
     def rotate_left(self) -> None:
         self.angle -= 90
         if self.angle == -90 : self.angle = 270
-        self.relative_coordinates = self.get_relative_coordinates(self.angle)
+        self.set_orientation(self.orientation_table[(self.shape, self.angle)])
 
     def rotate_right(self) -> None:
         self.angle += 90
         if self.angle == 360 : self.angle = 0
-        self.relative_coordinates = self.get_relative_coordinates(self.angle)
+        self.set_orientation(self.orientation_table[(self.shape, self.angle)])
 
     def set_angle(self, angle :int) -> None:
         self.angle = angle
-        self.relative_coordinates = self.get_relative_coordinates(self.angle)
+        self.set_orientation(self.orientation_table[(self.shape, self.angle)])
 
     def set_new_falling_piece(self, shape: TetrominoShape) -> None:
         self.set_shape(shape)
         self.set_angle(0)
         self.set_starting_position()
 
+    def set_orientation(self, orientation :TetrominoOrientation) -> None:
+        self.orientation = orientation
+        self.relative_coordinates = orientation.relative_coordinates
+
     def set_shape(self, shape: TetrominoShape) -> None:
         self.shape = shape
 
-        data = next((tetromino for tetromino in self.tetrominoes if tetromino["shape"] == self.shape), None)
-        self.orientations = data["orientations"]
-
     def set_starting_position(self) -> None:
-        self.center_x = config["playfield"]["falling_piece"]["starting_x"]
-        self.center_y = config["playfield"]["falling_piece"]["starting_y"]
+        self.center_x = self.starting_x
+        self.center_y = self.starting_y
+
+class PieceSource:
+    """
+    The shapes of the falling pieces, with its own random generator so engines never interfere with each other
+    (e.g. several agents in the same process), in one of these modes:
+
+    uniform : every shape with the same probability every time (the classic one).
+              With the same seed we get the same shapes that random.seed(seed) + random.choice used to give us
+    7-bag   : the 7 shapes shuffled like in a bag, and when the bag is empty another bag
+    stream  : the shapes of a stream made with get_stream, one byte per piece (the index of the shape in
+              config["tetrominoes"]) so a lot of games (or processes, or BatchTetrisSimulator) can share the same pieces.
+              When the stream ends it starts again from the beginning
+    The shapes are the ones of the config, or the ones of a ruleset (Ruleset.shapes)
+    """
+    UNIFORM = "uniform"
+    SEVEN_BAG = "7-bag"
+    STREAM = "stream"
+
+    shapes = tuple([ tetromino["shape"] for tetromino in config["tetrominoes"] ])
+
+    def __init__(self, mode :str = UNIFORM, seed :int = None, stream :bytes = None, shapes :tuple = None) -> None:
+        """
+        :param seed: seed of the random generator, None for a different game every time
+        :param stream: only for the stream mode
+        :param shapes: by default the ones of the config
+        """
+        if mode not in (self.UNIFORM, self.SEVEN_BAG, self.STREAM):
+            raise ValueError(f"Unknown piece source mode {mode}")
+        if (mode == self.STREAM) != (stream is not None):
+            raise ValueError("A stream is needed for the stream mode, and only for it")
+        self.mode = mode
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.stream = stream
+        if shapes:
+            self.shapes = tuple(shapes)
+        self.bag = list(self.shapes)
+        self.position = len(self.bag) if mode == self.SEVEN_BAG else 0 # the bag starts empty
+        self.shapes_given = 0 # e.g. to know where a game starts when an engine plays more than one
+
+    def get_next_shape(self) -> TetrominoShape:
+        self.shapes_given += 1
+        if self.mode == self.UNIFORM:
+            return self.random.choice(self.shapes)
+
+        if self.mode == self.SEVEN_BAG:
+            if self.position == len(self.bag):
+                self.random.shuffle(self.bag) # we shuffle the same list again, no need for a new bag
+                self.position = 0
+            shape = self.bag[self.position]
+        else:
+            if self.position == len(self.stream):
+                self.position = 0
+            shape = self.shapes[self.stream[self.position]]
+        self.position += 1
+        return shape
+
+    @classmethod
+    def get_stream(cls, length :int, mode :str = UNIFORM, seed :int = None, shapes :tuple = None) -> bytes:
+        """ The next length shapes of a new uniform or 7-bag piece source, as a stream for the stream mode """
+        piece_source = cls(mode, seed, shapes=shapes)
+        indexes = { shape: index for index, shape in enumerate(piece_source.shapes) }
+        return bytes([ indexes[piece_source.get_next_shape()] for _ in range(length) ])
 
 class TetrisEngine:
 
@@ -262,25 +619,48 @@ class TetrisEngine:
         ON_LINES_CLEARED     = 2,
         ON_GAME_OVER         = 3
 
-    def __init__(self) -> None:
-        self.playfield = Playfield(config["playfield"]["columns"], config["playfield"]["rows"], config["playfield"]["hidden_top_rows"])
+    def __init__(self, preview_size :int = 1, piece_source :PieceSource = None, ruleset :Ruleset = None) -> None:
+        """
+        :param preview_size: how many of the next shapes we know in advance (at least 1, see next_shape)
+        :param piece_source: where the shapes come from, by default uniform random shapes (of the ruleset)
+        :param ruleset: board, spawn and tetrominoes, by default default_ruleset (the config)
+        """
+        self.ruleset = ruleset or default_ruleset
+        self.orientation_table = self.ruleset.orientation_table
+        self.starting_x = self.ruleset.starting_x
+        self.starting_y = self.ruleset.starting_y
+        self.piece_source = piece_source or PieceSource(shapes=self.ruleset.shapes)
+        self.playfield = Playfield(self.ruleset.columns, self.ruleset.rows, self.ruleset.hidden_top_rows)
         
         next_shape = self.get_next_shape()
-        self.falling_piece = FallingPiece(next_shape)
+        self.falling_piece = FallingPiece(next_shape, self.ruleset)
+        self.next_shapes = [ self.get_next_shape() for _ in range(preview_size) ] # The preview: the shapes of the next falling pieces
 
         self.event_bindings = {}
         self.enable_on_playfield_updated_event = True
+        # Delta mode: ON_PLAYFIELD_UPDATED only sends what changed since the previous event (see raise_on_playfield_updated_event)
+        self.delta_on_playfield_updated_event = False
+        self.full_playfield_updated_event_interval = 100
+        self.sent_rows = None # the rows of the previous event, None to send all of them in the next one
+        self.sent_falling_piece_coordinates = []
+        self.playfield_updated_events_since_full = 0
         self.enable_on_lines_cleared_event = True
         self.enable_on_game_over_event = True
 
+        self.spawn_orientations = self.ruleset.spawn_orientations
+
     def bind_event(self, event_name :Events, func:object) -> None:
         self.event_bindings[event_name] = func
 
     def can_move_falling_piece(self, new_center_x :int, new_center_y :int) -> bool:
-        return all([
-            self.playfield.is_block_available(x, y)
-            for x, y in self.falling_piece.get_absolute_coordinates(new_center_x, new_center_y)
-        ])
+        return self.can_place(self.falling_piece.orientation, new_center_x, new_center_y)
+
+    def can_place(self, orientation :TetrominoOrientation, center_x :int, center_y :int) -> bool:
+        return self.playfield.are_blocks_available(
+            orientation.row_masks,
+            center_x + orientation.min_relative_x,
+            center_y + orientation.min_relative_y,
+            orientation.width)
 
     def drop(self) -> None:
         while self.can_move_falling_piece(self.falling_piece.center_x, self.falling_piece.center_y - 1):
@@ -297,19 +677,16 @@ class TetrisEngine:
             self.raise_on_game_over_event()
 
     def get_next_piece(self) -> None:
-        next_shape = self.get_next_shape()
-        self.falling_piece.set_new_falling_piece(next_shape)
+        self.falling_piece.set_new_falling_piece(self.next_shapes.pop(0))
+        self.next_shapes.append(self.get_next_shape())
 
     def get_next_shape(self) -> TetrominoShape:
-        return random.choice([
-            TetrominoShape.I_SHAPE,
-            TetrominoShape.J_SHAPE,
-            TetrominoShape.L_SHAPE,
-            TetrominoShape.O_SHAPE,
-            TetrominoShape.S_SHAPE,
-            TetrominoShape.T_SHAPE,
-            TetrominoShape.Z_SHAPE
-        ])
+        return self.piece_source.get_next_shape()
+
+    @property
+    def next_shape(self) -> TetrominoShape:
+        """ The shape of the falling piece that comes after this one """
+        return self.next_shapes[0]
 
     def lock_falling_piece(self) -> None:
         self.set_falling_piece()
@@ -379,6 +756,15 @@ class TetrisEngine:
             self.event_bindings[TetrisEngine.Events.ON_LINES_CLEARED](lines)
 
     def raise_on_playfield_updated_event(self) -> None:
+        """
+        By default every event has all the visible playfield ("type": "full").
+        With delta_on_playfield_updated_event most of the events are "type": "delta", with only what changed:
+            previous_falling_piece_coordinates: to remove the falling piece from where it was
+            falling_piece_coordinates and ghost_dropped_piece_coordinates: where they are now
+            changed_rows: y -> row, only the rows that changed (after a piece is locked or lines are cleared)
+        and every full_playfield_updated_event_interval events (and the first one of a game) a full one,
+        so whoever missed something gets all the playfield again. See apply_playfield_updated_event.
+        """
         if not self.enable_on_playfield_updated_event:
             return
         event_bound = TetrisEngine.Events.ON_PLAYFIELD_UPDATED in self.event_bindings
@@ -389,23 +775,111 @@ class TetrisEngine:
         data["falling_piece_shape"]             = str(self.falling_piece.shape)
         data["falling_piece_coordinates"]       = self.falling_piece.get_current_absolute_coordinates()
         data["ghost_dropped_piece_coordinates"] = self.get_ghost_dropped_piece_coordinates()
-        data["rows_from_the_bottom_up"]         = [self.playfield.get_row(y)
-                                                    for y in range(self.playfield.min_y, self.playfield.visible_rows + 1)]
+
+        if not self.delta_on_playfield_updated_event:
+            data["type"]                    = "full"
+            data["rows_from_the_bottom_up"] = [self.playfield.get_row(y)
+                                               for y in range(self.playfield.min_y, self.playfield.visible_rows + 1)]
+        else:
+            # The rows are never changed, they are replaced (copy on write), so a row that is the same object didn't change
+            rows = self.playfield.get_shared_rows()[:self.playfield.visible_rows]
+            self.playfield_updated_events_since_full += 1
+            if self.sent_rows is None or self.playfield_updated_events_since_full >= self.full_playfield_updated_event_interval:
+                data["type"]                    = "full"
+                data["rows_from_the_bottom_up"] = [ list(row) for row in rows ]
+                self.playfield_updated_events_since_full = 0
+            else:
+                data["type"]                               = "delta"
+                data["previous_falling_piece_coordinates"] = self.sent_falling_piece_coordinates
+                data["changed_rows"]                       = { y: list(row) for y, (row, sent_row) in enumerate(zip(rows, self.sent_rows), start=1)
+                                                               if row is not sent_row }
+            self.sent_rows = rows
+            self.sent_falling_piece_coordinates = data["falling_piece_coordinates"]
 
         self.event_bindings[TetrisEngine.Events.ON_PLAYFIELD_UPDATED](data)
 
+    @staticmethod
+    def apply_playfield_updated_event(playfield_data :dict, data :dict) -> dict:
+        """
+        For the ones receiving ON_PLAYFIELD_UPDATED in delta mode: it applies the event data to the last full data we have
+        (None at the beginning) and returns the full data, i.e. with all the rows_from_the_bottom_up.
+        It returns None while we are waiting for the first full event
+        """
+        if data["type"] == "full":
+            playfield_data = dict(data)
+            playfield_data["rows_from_the_bottom_up"] = list(data["rows_from_the_bottom_up"])
+            return playfield_data
+        if playfield_data is None:
+            return None
+
+        for y, row in data["changed_rows"].items():
+            playfield_data["rows_from_the_bottom_up"][y - 1] = row
+        playfield_data["falling_piece_shape"]             = data["falling_piece_shape"]
+        playfield_data["falling_piece_coordinates"]       = data["falling_piece_coordinates"]
+        playfield_data["ghost_dropped_piece_coordinates"] = data["ghost_dropped_piece_coordinates"]
+        return playfield_data
+
+    def get_snapshot(self) -> tuple:
+        """ Playfield and falling piece, see Playfield.get_snapshot. The events are not part of the snapshot """
+        falling_piece = self.falling_piece
+        return (self.playfield.get_snapshot(), falling_piece.shape, falling_piece.angle, falling_piece.center_x, falling_piece.center_y)
+
+    def get_dropped_center_y(self, orientation :TetrominoOrientation, center_x :int, center_y :int) -> int:
+        """ Where the center of a piece would end if we drop it from (center_x, center_y) """
+        while self.can_place(orientation, center_x, center_y - 1):
+            center_y -= 1
+        return center_y
+
     def get_ghost_dropped_piece_coordinates(self) -> list:
         center_x = self.falling_piece.center_x
-        center_y = self.falling_piece.center_y
-        while self.can_move_falling_piece(center_x, center_y - 1):
-            center_y -= 1
+        center_y = self.get_dropped_center_y(self.falling_piece.orientation, center_x, self.falling_piece.center_y)
         return self.falling_piece.get_absolute_coordinates(center_x, center_y)
 
     def new_game(self) -> None:
+        self.sent_rows = None
         self.playfield.clear()
         self.falling_piece.set_starting_position()
         self.raise_on_playfield_updated_event()
 
+    def place(self, shape :TetrominoShape, angle :int, center_x :int, next_shape :TetrominoShape = None) -> tuple[int, bool, tuple[int, ...]]:
+        """
+        Headless placement: in one call the piece is rotated in the spawn position, moved sideways at the spawn height
+        to center_x, dropped and locked, and the full lines are cleared.
+        No events are raised and the falling piece is not touched, it only changes the playfield,
+        which is what the agent, the GA and any search code need to try a lot of placements.
+
+        It returns (lines cleared, game over, row masks of the resulting playfield)
+        or None if the piece can't get there (the playfield is not changed then).
+        Game over means that next_shape can't spawn or, if we don't know the next shape, that some shape can't.
+        """
+        orientation = self.orientation_table[(shape, angle)]
+        starting_x = self.starting_x
+        starting_y = self.starting_y
+
+        step = 1 if center_x >= starting_x else -1
+        for x in range(starting_x, center_x + step, step):
+            if not self.can_place(orientation, x, starting_y):
+                return None
+
+        center_y = self.get_dropped_center_y(orientation, center_x, starting_y)
+        for relative_x, relative_y in orientation.relative_coordinates:
+            self.playfield.set_block(center_x + relative_x, center_y + relative_y, shape)
+        lines_cleared = self.playfield.clear_full_lines()
+
+        if next_shape:
+            is_game_over = not self.can_place(self.orientation_table[(next_shape, 0)], starting_x, starting_y)
+        else:
+            is_game_over = not all(self.can_place(spawn_orientation, starting_x, starting_y) for spawn_orientation in self.spawn_orientations)
+
+        return (lines_cleared, is_game_over, self.playfield.get_all_row_masks())
+
+    def restore_snapshot(self, snapshot :tuple) -> None:
+        playfield_snapshot, shape, angle, center_x, center_y = snapshot
+        self.playfield.restore_snapshot(playfield_snapshot)
+        self.falling_piece.set_shape(shape)
+        self.falling_piece.set_angle(angle)
+        self.move_falling_piece(center_x, center_y)
+
     def set_falling_piece(self) -> None:
         for x, y in self.falling_piece.get_current_absolute_coordinates():
             self.playfield.set_block(x, y, self.falling_piece.shape)
@@ -0,0 +1,220 @@
+"""
+Frames of a playfield in shared memory, so an agent in another process can send every movement to the UI
+without pickling anything.
+
+FrameRingBuffer is a ring of fixed-size frames in a multiprocessing.shared_memory block:
+
+    header : frames written so far, frames read so far (8 bytes each), capacity, columns, rows (4 bytes each)
+    slots  : capacity x frame
+
+    frame  : sequence (8 bytes, odd while the frame is being written, see below)
+             falling piece shape (1 byte, the letter of the shape)
+             number of falling piece blocks (1 byte) and their (x, y) (4 x 2 bytes)
+             number of ghost dropped piece blocks (1 byte) and their (x, y) (4 x 2 bytes)
+             blocks from the bottom row up, one byte per block (the letter of the shape)
+
+There is only one writer (the agent) and one reader (the UI), each one only writes its own counter in the header.
+The memory used is always the same: when the ring is full (the reader is capacity frames behind)
+the writer waits for the reader up to max_wait seconds (backpressure) and then overwrites the oldest frame.
+By default it never waits. The stop_event (e.g. a multiprocessing.Event) stops the waiting right away.
+The sequence of every frame works like a seqlock: if it changed while we were reading the frame,
+the writer overwrote it and we drop it.
+
+The reader can take the frames one by one (read_next_frame) or jump to the last one (read_latest_frame),
+frames_dropped counts the ones it never saw and get_depth the ones waiting to be read.
+
+Reading a frame copies its slot, in one go, to a bytearray of the reader (so the writer can't change it while
+the UI draws it) and returns always the same dict: its rows are memoryviews of that bytearray (one byte per block),
+no strings or lists are built for them. Only the coordinates of the two pieces (4 blocks each) are new lists.
+The frame is valid until the next read, copy what you want to keep.
+"""
+
+from multiprocessing import shared_memory
+from time import perf_counter, sleep
+import struct
+
+class FrameRingBuffer:
+
+    HEADER = struct.Struct("<QQIII")   # frames written, frames read, capacity, columns, rows
+    FRAMES_READ_OFFSET = 8
+    SEQUENCE = struct.Struct("<Q")     # also the frames written and read in the header
+    PIECE = struct.Struct("<cB8BB8B") # shape, falling piece blocks and coordinates, ghost blocks and coordinates
+
+    def __init__(self, memory :shared_memory.SharedMemory, capacity :int, columns :int, rows :int,
+        max_wait :float = 0.0, stop_event :object = None) -> None:
+        """ Use create or attach instead """
+        self.memory = memory
+        self.buffer = memory.buf
+        self.capacity = capacity
+        self.columns = columns
+        self.rows = rows
+        self.blocks_offset = self.SEQUENCE.size + self.PIECE.size
+        self.frame_size = self.blocks_offset + columns * rows
+
+        # Only used by the reader: the copy of the last frame read and the frame we return, with the rows as views of the copy
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.frame_copy = bytearray(self.frame_size)
+        frame_view = memoryview(self.frame_copy)
+        self.frame = {
+            "falling_piece_shape":             " ",
+            "falling_piece_coordinates":       [],
+            "ghost_dropped_piece_coordinates": [],
+            "rows_from_the_bottom_up":         [ frame_view[self.blocks_offset + y*columns : self.blocks_offset + (y+1)*columns] for y in range(rows) ]
+        }
+
+        # Only used by the writer: the blocks of the last frame, so a delta event only changes the rows in it
+        self.blocks = bytearray(b" " * (columns * rows))
+        self.max_wait = max_wait
+        self.stop_event = stop_event
+        self.frames_waited = 0 # frames that found the ring full
+        self.seconds_waited = 0.0
+
+    @classmethod
+    def attach(cls, name :str, max_wait :float = 0.0, stop_event :object = None) -> "FrameRingBuffer":
+        """
+        From the other process, with the name of the one created with create
+
+        :param max_wait: seconds the writer waits at most for the reader when the ring is full,
+        0 never waits (the oldest frame is overwritten), None waits as long as needed (until stop_event is set)
+        :param stop_event: when it is set (e.g. the UI is closing) the writer doesn't wait anymore
+        """
+        # The processes started with multiprocessing share the resource tracker of the one that created it,
+        # so attaching doesn't remove the memory when they end. Only the creator unlinks it.
+        memory = shared_memory.SharedMemory(name=name)
+        _, _, capacity, columns, rows = cls.HEADER.unpack_from(memory.buf, 0)
+        return cls(memory, capacity, columns, rows, max_wait, stop_event)
+
+    def close(self) -> None:
+        self.buffer = None
+        self.memory.close()
+
+    @classmethod
+    def create(cls, capacity :int, columns :int, rows :int) -> "FrameRingBuffer":
+        frame_size = cls.SEQUENCE.size + cls.PIECE.size + columns * rows
+        memory = shared_memory.SharedMemory(create=True, size=cls.HEADER.size + capacity * frame_size)
+        cls.HEADER.pack_into(memory.buf, 0, 0, 0, capacity, columns, rows)
+        ring = cls(memory, capacity, columns, rows)
+        for slot in range(capacity):
+            cls.SEQUENCE.pack_into(memory.buf, ring._get_slot_offset(slot), 0)
+        return ring
+
+    def _get_slot_offset(self, frame_number :int) -> int:
+        return self.HEADER.size + (frame_number % self.capacity) * self.frame_size
+
+    def _set_frames_read(self, frames_read :int) -> None:
+        self.frames_read = frames_read
+        self.SEQUENCE.pack_into(self.buffer, self.FRAMES_READ_OFFSET, frames_read)
+
+    def _wait_for_reader(self, frame_number :int) -> None:
+        """ Backpressure: while the frame would overwrite one not read yet, up to max_wait seconds """
+        if self.max_wait == 0 or frame_number - self.get_frames_read() < self.capacity:
+            return
+        self.frames_waited += 1
+        t_start = perf_counter()
+        while frame_number - self.get_frames_read() >= self.capacity:
+            if self.max_wait is not None and perf_counter() - t_start >= self.max_wait:
+                break
+            if self.stop_event is None:
+                sleep(0.005)
+            elif self.stop_event.wait(0.005):
+                break
+        self.seconds_waited += perf_counter() - t_start
+
+    def get_depth(self) -> int:
+        """ Frames written but not read yet, it can be more than capacity if the reader is that behind """
+        return self.get_frames_written() - self.get_frames_read()
+
+    def get_frames_read(self) -> int:
+        return self.SEQUENCE.unpack_from(self.buffer, self.FRAMES_READ_OFFSET)[0]
+
+    def get_frames_written(self) -> int:
+        return self.SEQUENCE.unpack_from(self.buffer, 0)[0]
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def read_frame(self, frame_number :int) -> dict:
+        """
+        The frame as the data of TetrisEngine.Events.ON_PLAYFIELD_UPDATED, but the rows are memoryviews
+        (one byte per block, the letter of the shape) and it is the same dict every time, see above.
+        It returns None if that frame is not there anymore (overwritten)
+        """
+        offset = self._get_slot_offset(frame_number)
+        expected_sequence = 2 * frame_number + 2
+        if self.SEQUENCE.unpack_from(self.buffer, offset)[0] != expected_sequence:
+            return None
+        self.frame_copy[:] = self.buffer[offset : offset + self.frame_size]
+        if self.SEQUENCE.unpack_from(self.buffer, offset)[0] != expected_sequence:
+            return None # overwritten while we were copying it
+
+        shape, falling_blocks, *values = self.PIECE.unpack_from(self.frame_copy, self.SEQUENCE.size)
+        ghost_blocks = values[8]
+        frame = self.frame
+        frame["falling_piece_shape"] = shape.decode("ascii")
+        frame["falling_piece_coordinates"] = [ [values[2*i], values[2*i + 1]] for i in range(falling_blocks) ]
+        frame["ghost_dropped_piece_coordinates"] = [ [values[9 + 2*i], values[9 + 2*i + 1]] for i in range(ghost_blocks) ]
+        return frame
+
+    def read_latest_frame(self) -> dict:
+        """
+        The last frame written, or None if there are no new frames.
+        All the frames in between are skipped (frames_dropped), so the reader is never behind
+        """
+        frames_written = self.get_frames_written()
+        if self.frames_read < frames_written - 1:
+            self.frames_dropped += frames_written - 1 - self.frames_read
+            self._set_frames_read(frames_written - 1)
+        return self.read_next_frame()
+
+    def read_next_frame(self) -> dict:
+        """
+        The oldest frame not read yet, or None if there are no new frames.
+        If the writer went so fast that it overwrote frames we didn't read, we skip them (frames_dropped)
+        """
+        while self.frames_read < self.get_frames_written():
+            oldest_frame = self.get_frames_written() - self.capacity
+            if self.frames_read < oldest_frame:
+                self.frames_dropped += oldest_frame - self.frames_read
+                self.frames_read = oldest_frame
+            frame = self.read_frame(self.frames_read)
+            self._set_frames_read(self.frames_read + 1)
+            if frame is not None:
+                return frame
+            self.frames_dropped += 1
+        return None
+
+    def unlink(self) -> None:
+        """ Only the process that created it, when nobody is using it anymore """
+        self.memory.unlink()
+
+    def write_frame(self, data :dict) -> None:
+        """ data is the one from TetrisEngine.Events.ON_PLAYFIELD_UPDATED, full or delta """
+        frame_number = self.get_frames_written()
+        self._wait_for_reader(frame_number)
+        offset = self._get_slot_offset(frame_number)
+        self.SEQUENCE.pack_into(self.buffer, offset, 2 * frame_number + 1)
+
+        falling_piece_coordinates = data["falling_piece_coordinates"]
+        ghost_coordinates = data["ghost_dropped_piece_coordinates"]
+        coordinates = [ value for x_y in falling_piece_coordinates for value in x_y ]
+        coordinates += [0] * (8 - len(coordinates))
+        coordinates.append(len(ghost_coordinates))
+        coordinates += [ value for x_y in ghost_coordinates for value in x_y ]
+        coordinates += [0] * (17 - len(coordinates))
+        self.PIECE.pack_into(self.buffer, offset + self.SEQUENCE.size,
+            data["falling_piece_shape"].encode("ascii"), len(falling_piece_coordinates), *coordinates)
+
+        if data.get("type", "full") == "full":
+            rows = enumerate(data["rows_from_the_bottom_up"][:self.rows], start=1)
+        else:
+            rows = data["changed_rows"].items()
+        for y, row in rows:
+            if y <= self.rows:
+                self.blocks[(y-1)*self.columns : y*self.columns] = "".join(row).encode("ascii")
+        blocks_offset = offset + self.blocks_offset
+        self.buffer[blocks_offset : blocks_offset + len(self.blocks)] = self.blocks
+
+        self.SEQUENCE.pack_into(self.buffer, offset, 2 * frame_number + 2)
+        self.SEQUENCE.pack_into(self.buffer, 0, frame_number + 1)
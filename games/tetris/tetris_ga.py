@@ -1,29 +1,47 @@
 # Tetris Genetic algorithms UI
 from tetris_playable import PlayfieldScreen, config
 from tetris_agent import TetrisAgent
-from tetris_engine import TetrisEngine
+from tetris_engine import TetrisEngine, default_ruleset
+from tetris_frames import FrameRingBuffer
+import argparse
 import tkinter as tk
 import tkinter.ttk as ttk
 import multiprocessing as mp
 
 class Window(tk.Tk):
-    def __init__(self):
+
+    display_modes = ["latest", "replay"]
+
+    def __init__(self, display_mode :str = "latest", fps :int = 10):
+        """
+        :param display_mode: how the frames of the agents are shown, in every tick of the timer:
+            latest : the last frame written, the agents play as fast as they can and we skip the frames in between
+            replay : the next frame, so we see every movement at fps. The agents wait for us when they are
+                     a whole frame buffer ahead (backpressure), so nothing is dropped and nothing grows
+        :param fps: frames per second i.e. movements in the playfield read from the frame buffers
+        """
+        if display_mode not in self.display_modes:
+            raise ValueError(f"The display mode has to be one of {self.display_modes}")
         super().__init__()
+        self.display_mode = display_mode
 
         self.title("AI Games - Tetris Genetic algorithms")
         self.geometry("1000x600")
         
         self.setup_playfield_frames()
 
-        exit_button = ttk.Button(self, text="Exit", command=exit) # TODO stop everything gracefully
+        exit_button = ttk.Button(self, text="Exit", command=self.exit)
         exit_button.place(x=900, y=550)
+        self.protocol("WM_DELETE_WINDOW", self.exit)
 
-        fps = 10 # frames per second i.e. movements in the playfield stored in the queue
         self.speed = int(1000/fps)
 
         self.processes :list[(mp.Process,mp.Event)] = []
-        self.queues :list[mp.Queue] = [mp.Queue() for _ in range(6)]
-        self.event = mp.Event()
+        # One ring of frames in shared memory per agent. 1024 frames are ~230KB, in latest mode if we are too slow
+        # the agent overwrites the oldest ones, in replay mode it waits for us
+        self.frame_buffers :list[FrameRingBuffer] = [FrameRingBuffer.create(1024, default_ruleset.columns, default_ruleset.visible_rows) for _ in range(6)]
+        self.event = mp.Event() # set when we exit, so the agents stop
+        max_wait = None if display_mode == "replay" else 0.0
         
         weights = {
             "weight_aggregated_height":  5,
@@ -32,7 +50,7 @@ class Window(tk.Tk):
             "weight_lines_cleared":    -10
         }
         self.set_weight_labels(1, weights)
-        p = mp.Process(target=run_agent, args=(weights, 100, self.queues[0]), kwargs={'event': self.event})
+        p = mp.Process(target=run_agent, args=(weights, 100, self.frame_buffers[0].name), kwargs={'event': self.event, 'max_wait': max_wait})
         self.processes.append((p, self.event))
 
         weights = {
@@ -42,28 +60,38 @@ class Window(tk.Tk):
             "weight_lines_cleared":    -10
         }
         self.set_weight_labels(2, weights)
-        p = mp.Process(target=run_agent, args=(weights, 100, self.queues[1]), kwargs={'event': self.event})
+        p = mp.Process(target=run_agent, args=(weights, 100, self.frame_buffers[1].name), kwargs={'event': self.event, 'max_wait': max_wait})
         self.processes.append((p, self.event))
 
         for p, _ in self.processes:
             p.start()
 
-        print("joined")
-
         self.update_playfield_timer = self.after(500, self.update_playfield)
 
     def exit(self) -> None:
-        # while not self.queue.empty():
-        #     self.queue.get()
+        """ The agents see the event after their current movement and end their games, they don't wait for us anymore """
+        if self.update_playfield_timer:
+            self.after_cancel(self.update_playfield_timer)
+            self.update_playfield_timer = None
         for _, event in self.processes:
             event.set()
         for p, _ in self.processes:
-            print("joining in")
-            p.join()
-            p.terminate()
+            p.join(5)
+            if p.is_alive():
+                p.terminate()
+        self.print_frame_statistics()
+        for frame_buffer in self.frame_buffers:
+            frame_buffer.close()
+            frame_buffer.unlink()
 
         self.destroy()
 
+    def print_frame_statistics(self) -> None:
+        for index, _ in enumerate(self.processes):
+            frame_buffer = self.frame_buffers[index]
+            print(f"Agent #{index + 1}: {frame_buffer.frames_read} frames read, {frame_buffer.frames_dropped} dropped, "
+                  f"{frame_buffer.get_depth()} waiting")
+
     def set_weight_labels(self, agent_number :int, weights :dict) -> None:
         index = agent_number - 1
         self.playfield_frames[index].set_weight_labels(weights)
@@ -88,29 +116,49 @@ class Window(tk.Tk):
     def update_playfield(self) -> None:
         """
         The Tetris Agent is really fast and we won't be able to see in the UI all the movements.
-        The easiest way to deal with this is to let the agent run and queue all the data for updating the playfield
-        in a queue and with a timer start getting elements until the queue is empty.
+        The easiest way to deal with this is to let the agent run and write all the frames for updating the playfield
+        in a ring buffer in shared memory and with a timer start reading them until there are no more.
+        Every tick reads one frame per agent (the latest or the next one, see display_mode), so the work here
+        is the same no matter how far ahead the agents are.
         """
-        print(self.processes[0][0].is_alive())
-        if all([queue.empty() for queue in self.queues]):
-            print("all queues empty")
-            self.after_cancel(self.update_playfield_timer)
+        if self.display_mode == "latest":
+            frames = [ frame_buffer.read_latest_frame() for frame_buffer in self.frame_buffers ]
         else:
-            for index, queue in enumerate(self.queues):
-                if not queue.empty():
-                    data = queue.get()
-                    self.playfield_frames[index].update(data)
-            self.after(self.speed, self.update_playfield) # Call again the timer
+            frames = [ frame_buffer.read_next_frame() for frame_buffer in self.frame_buffers ]
+        for index, frame in enumerate(frames):
+            if frame:
+                self.playfield_frames[index].update(frame)
+            if index < len(self.processes):
+                frame_buffer = self.frame_buffers[index]
+                self.playfield_frames[index].set_frame_labels(frame_buffer.frames_dropped, frame_buffer.get_depth())
+
+        agents_running = any([ p.is_alive() for p, _ in self.processes ])
+        if not agents_running and not any(frames):
+            print("all frames shown")
+            self.print_frame_statistics()
+            self.update_playfield_timer = None
+        else:
+            self.update_playfield_timer = self.after(self.speed, self.update_playfield) # Call again the timer
 
 # It has to be top-level or we will get an error when starting the process:
 # TypeError: cannot pickle '_tkinter.tkapp' object
-def run_agent(weights: dict, max_number_of_movements :int, queue :mp.Queue, event=None) -> None:
+def run_agent(weights: dict, max_number_of_movements :int, frame_buffer_name :str, event=None, max_wait :float = 0.0) -> None:
+    """ event is set by the window when it exits, then the agent ends its game after the current movement """
+    frame_buffer = FrameRingBuffer.attach(frame_buffer_name, max_wait, event)
     agent = TetrisAgent()
-    agent.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, lambda data: queue.put(data))
+    agent.delta_on_playfield_updated_event = True # the frame buffer only copies the rows that changed
+
+    def write_frame(data :dict) -> None:
+        if event and event.is_set():
+            agent.is_game_over = True # so play_game stops
+            return
+        frame_buffer.write_frame(data)
+
+    agent.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, write_frame)
     agent.start_new_game(weights, max_number_of_movements)
-    print(f"the queue is {queue.qsize()}")
-    event.set()
-    # set the event here after all is done?
+    print(f"frames written {frame_buffer.get_frames_written()}, "
+          f"{frame_buffer.frames_waited} waited for the window in {frame_buffer.seconds_waited:.2f} s")
+    frame_buffer.close()
 
 class PlayfieldFrame(tk.Frame):
     def __init__(self, master, width :int, height :int, **kwargs):
@@ -121,12 +169,14 @@ class PlayfieldFrame(tk.Frame):
         x = 10
         y = 10
 
+        # The original playfield is bigger because it is the one used for the playable Tetris,
+        # here it is half the width and half the height
         self.playfield_screen = PlayfieldScreen(self,
-            config["playfield"]["columns"],
-            config["playfield"]["rows"],
+            default_ruleset.columns,
+            default_ruleset.visible_rows,
             config["playfield"]["background_color"],
-            config["tetrominoes"])
-        self.scale_down_playfield_screen(self.playfield_screen)
+            default_ruleset.tetrominoes,
+            scale=0.5)
         self.playfield_screen.place(x=x, y=y)
 
         x = 140
@@ -148,23 +198,15 @@ class PlayfieldFrame(tk.Frame):
         self.weight_lines_cleared_text = tk.StringVar()
         ttk.Label(self, textvariable=self.weight_lines_cleared_text, foreground=fg, background=bg).place(x=x, y=y+80)
 
-    def scale_down_playfield_screen(self, playfield_screen :PlayfieldScreen) -> None:
-        """
-        The original playfield is bigger because it is the one used for the playable Tetris
-        So instead of copy/paste and make modifications we are using the same class
-        but scaling down after every update
-        """
-        original_width = playfield_screen.width
-        original_height = playfield_screen.height
-        scale = 0.25 # 1/4 of the size which means that width is half and height is half
-        new_width = original_width // 2
-        new_height = original_height // 2
-        playfield_screen.scale("all", 0, 0, scale*2, scale*2)       # It scales the contents but not the container
-        playfield_screen.config(width=new_width, height=new_height) # It scales the container
+        self.frames_text = tk.StringVar()
+        ttk.Label(self, textvariable=self.frames_text, foreground=fg, background=bg).place(x=x, y=y+110)
 
     def set_agent_number_label(self, agent_number: int) -> None:
         self.agent_number_text.set(f"Agent #{agent_number}")
     
+    def set_frame_labels(self, frames_dropped :int, depth :int) -> None:
+        self.frames_text.set(f"Frames dropped: {frames_dropped} waiting: {depth}")
+
     def set_weight_labels(self, weights :dict) -> None:
         self.weight_aggregated_height_text.set(f'Weight aggregated height: {weights["weight_aggregated_height"]}')
         self.weight_total_holes_text.set(f'Weight total holes: {weights["weight_total_holes"]}')
@@ -177,8 +219,12 @@ class PlayfieldFrame(tk.Frame):
             data["falling_piece_shape"],
             data["falling_piece_coordinates"],
             data["ghost_dropped_piece_coordinates"])
-        self.scale_down_playfield_screen(self.playfield_screen)
 
 if __name__ == "__main__":
-    window = Window()
+    parser = argparse.ArgumentParser(description="The Tetris agents playing side by side")
+    parser.add_argument("--mode", choices=Window.display_modes, default="latest", help="see Window")
+    parser.add_argument("--fps", type=int, default=10)
+    arguments = parser.parse_args()
+
+    window = Window(arguments.mode, arguments.fps)
     window.mainloop()
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Headless genetic algorithm to find the weights of the TetrisAgent (see TetrisAgent.calculate_heuristics)
+
+Every individual is a dict of weights and its fitness is the average of lines cleared in some games.
+In every generation all the individuals play the same games (same seeds, so the same pieces),
+the games are spread in a pool of processes created once for the whole run.
+
+Population:
+    - the best individuals go to the next generation as they are (elitism)
+    - the rest are children of two parents chosen by tournament,
+      with each weight taken from one parent or the other (uniform crossover) and sometimes mutated (gaussian)
+
+Example (100 individuals x 50 generations):
+    python tetris_genetic_algorithm.py --population 100 --generations 50
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import random
+from time import time
+from tetris_agent import TetrisAgent, weight_names
+
+# It has to be top-level so the pool can send it to the processes
+def evaluate_fitness(task :tuple[dict, int, int]) -> int:
+    """ Lines cleared by the agent playing one game with those weights. task = (weights, seed, max_number_of_movements) """
+    weights, seed, max_number_of_movements = task
+    agent = TetrisAgent(seed=seed)
+    lines_cleared, _ = agent.play_game(weights, max_number_of_movements)
+    return lines_cleared
+
+class GeneticAlgorithm:
+
+    def __init__(self,
+        population_size :int = 100,
+        generations :int = 50,
+        games_per_individual :int = 2,
+        max_number_of_movements :int = 1000,
+        elitism :int = 4,
+        tournament_size :int = 3,
+        mutation_rate :float = 0.2,
+        mutation_scale :float = 1.0,
+        seed :int = 7,
+        processes :int = None) -> None:
+        """
+        :param games_per_individual: games played by every individual in every generation, the fitness is the average
+        :param max_number_of_movements: to stop the games that the agent plays really well (see TetrisAgent.play_game)
+        :param mutation_rate: probability of every weight of a child to be mutated
+        :param mutation_scale: standard deviation of the mutation
+        :param seed: seed of the genetic algorithm, the games of every generation have their seeds from this one
+        :param processes: processes in the pool, by default one per core
+        """
+        # Before any game is played, not when the first generation is already done
+        if not 0 <= elitism < population_size:
+            raise ValueError("The population has to be bigger than the elitism")
+        if not 1 <= tournament_size <= population_size:
+            raise ValueError(f"The tournament size has to be between 1 and the population size {population_size}")
+        self.population_size = population_size
+        self.generations = generations
+        self.games_per_individual = games_per_individual
+        self.max_number_of_movements = max_number_of_movements
+        self.elitism = elitism
+        self.tournament_size = tournament_size
+        self.mutation_rate = mutation_rate
+        self.mutation_scale = mutation_scale
+        self.random = random.Random(seed)
+        self.processes = processes or os.cpu_count() or 1
+
+        self.history :list[dict] = []
+
+    def crossover(self, parent_1 :dict, parent_2 :dict) -> dict:
+        return { name: (parent_1 if self.random.random() < 0.5 else parent_2)[name] for name in weight_names }
+
+    def evaluate_population(self, pool :mp.Pool, population :list[dict], game_seeds :list[int]) -> list[float]:
+        """
+        All the games of all the individuals go to the pool at once, in chunks
+        so every process has always work to do without sending the tasks one by one
+        """
+        tasks = [ (weights, game_seed, self.max_number_of_movements) for weights in population for game_seed in game_seeds ]
+        chunksize = max(1, len(tasks) // (self.processes * 4))
+        lines_cleared = pool.map(evaluate_fitness, tasks, chunksize=chunksize)
+
+        games = len(game_seeds)
+        return [ sum(lines_cleared[index:index + games]) / games for index in range(0, len(lines_cleared), games) ]
+
+    def get_random_individual(self) -> dict:
+        weights = { name: self.random.uniform(0, 10) for name in weight_names }
+        weights["weight_lines_cleared"] = -weights["weight_lines_cleared"] # lines cleared are good: the lower the better
+        return weights
+
+    def mutate(self, weights :dict) -> dict:
+        return {
+            name: value + self.random.gauss(0, self.mutation_scale) if self.random.random() < self.mutation_rate else value
+            for name, value in weights.items()
+        }
+
+    def next_generation(self, population :list[dict], fitness :list[float]) -> list[dict]:
+        ranking = sorted(range(len(population)), key=lambda index: fitness[index], reverse=True)
+        new_population = [ population[index] for index in ranking[:self.elitism] ]
+        while len(new_population) < self.population_size:
+            parent_1 = self.tournament(population, fitness)
+            parent_2 = self.tournament(population, fitness)
+            new_population.append(self.mutate(self.crossover(parent_1, parent_2)))
+        return new_population
+
+    def run(self, population :list[dict] = None) -> dict:
+        """
+        It runs all the generations and returns the best individual found: { "weights": ..., "fitness": ... }
+        The statistics of every generation are in history
+        """
+        population = population or [ self.get_random_individual() for _ in range(self.population_size) ]
+        best = { "weights": None, "fitness": float("-inf") }
+        self.history = []
+
+        with mp.Pool(self.processes) as pool:
+            for generation in range(1, self.generations + 1):
+                t_start = time()
+                game_seeds = [ self.random.randrange(2**32) for _ in range(self.games_per_individual) ]
+                fitness = self.evaluate_population(pool, population, game_seeds)
+
+                best_index = max(range(len(population)), key=lambda index: fitness[index])
+                if fitness[best_index] > best["fitness"]:
+                    best = { "weights": population[best_index], "fitness": fitness[best_index] }
+
+                self.history.append({
+                    "generation":   generation,
+                    "best_fitness": fitness[best_index],
+                    "mean_fitness": sum(fitness) / len(fitness),
+                    "best_weights": population[best_index],
+                    "seconds":      time() - t_start
+                })
+                self.report(self.history[-1])
+
+                if generation < self.generations:
+                    population = self.next_generation(population, fitness)
+
+        return best
+
+    def report(self, generation_statistics :dict) -> None:
+        print(f'Generation {generation_statistics["generation"]:3}: '
+              f'best {generation_statistics["best_fitness"]:8.2f} '
+              f'mean {generation_statistics["mean_fitness"]:8.2f} '
+              f'in {generation_statistics["seconds"]:6.2f} s')
+
+    def tournament(self, population :list[dict], fitness :list[float]) -> dict:
+        contenders = self.random.sample(range(len(population)), self.tournament_size)
+        return population[max(contenders, key=lambda index: fitness[index])]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genetic algorithm for the weights of the Tetris agent")
+    parser.add_argument("--population", type=int, default=100)
+    parser.add_argument("--generations", type=int, default=50)
+    parser.add_argument("--games", type=int, default=2, help="games per individual and generation")
+    parser.add_argument("--movements", type=int, default=1000, help="max number of movements per game")
+    parser.add_argument("--processes", type=int, default=None, help="by default one per core")
+    parser.add_argument("--seed", type=int, default=7)
+    arguments = parser.parse_args()
+
+    genetic_algorithm = GeneticAlgorithm(
+        population_size=arguments.population,
+        generations=arguments.generations,
+        games_per_individual=arguments.games,
+        max_number_of_movements=arguments.movements,
+        processes=arguments.processes,
+        seed=arguments.seed)
+    t_start = time()
+    best = genetic_algorithm.run()
+    print(f'Best fitness {best["fitness"]:.2f} with {best["weights"]} in {time() - t_start:.2f} s')
@@ -0,0 +1,70 @@
+"""
+NumPy version of the playfield statistics, to evaluate a lot of playfields at once.
+
+NumPy is optional: only the code that needs to evaluate batches of playfields imports this module.
+
+The playfields are arrays of row masks (see Playfield.get_all_row_masks) with shape (number of playfields, rows)
+"""
+
+import numpy as np
+
+def get_row_mask_dtype(columns :int) -> np.dtype:
+    """ The smallest unsigned integer where a row fits """
+    for dtype in (np.uint16, np.uint32, np.uint64):
+        if columns <= np.iinfo(dtype).bits:
+            return np.dtype(dtype)
+    raise ValueError(f"A row of {columns} columns doesn't fit in a 64 bits row mask")
+
+def count_blocks(row_masks :np.ndarray) -> np.ndarray:
+    """ Non empty blocks of every row """
+    if hasattr(np, "bitwise_count"): # NumPy 2.0+
+        return np.bitwise_count(row_masks).astype(np.int64)
+    return get_cells(row_masks, row_masks.dtype.itemsize * 8).sum(axis=-1, dtype=np.int64)
+
+def get_cells(row_masks :np.ndarray, columns :int) -> np.ndarray:
+    """ From (..., rows) row masks to (..., rows, columns) 0/1 values. Bit 0 is the column x=1 """
+    row_bytes = np.ascontiguousarray(row_masks, dtype=row_masks.dtype.newbyteorder("<")).view(np.uint8)
+    row_bytes = row_bytes.reshape(row_masks.shape + (row_masks.dtype.itemsize,))
+    return np.unpackbits(row_bytes, axis=-1, bitorder="little")[..., :columns]
+
+def get_playfield_statistics(row_masks :np.ndarray, columns :int) -> dict:
+    """
+    Same statistics as TetrisAgent.get_playfield_statistics but for (..., rows) row masks at once.
+    Each statistic is an array with the shape of row_masks without the last dimension (the rows)
+
+    A block is covered when it is at or below the highest block of its column: the OR of its row and all the rows above.
+    The height of a column is the number of covered blocks and the holes are the covered blocks that are empty
+    """
+    covered = np.bitwise_or.accumulate(row_masks[..., ::-1], axis=-1)[..., ::-1]
+    heights = get_cells(covered, columns).sum(axis=-2, dtype=np.int64)
+    aggregated_height = heights.sum(axis=-1)
+    total_holes = aggregated_height - count_blocks(row_masks).sum(axis=-1)
+    bumpiness = np.abs(np.diff(heights, axis=-1)).sum(axis=-1)
+
+    return {
+        "aggregated_height": aggregated_height,
+        "total_holes":       total_holes,
+        "bumpiness":         bumpiness
+    }
+
+def calculate_heuristics(playfield_statistics :dict, lines_cleared :np.ndarray, weights :dict) -> np.ndarray:
+    """
+    Same formula (and same order of operations) as TetrisAgent.calculate_heuristics
+    so we get exactly the same floats as the pure Python version
+    """
+    return (
+        weights["weight_aggregated_height"] * playfield_statistics["aggregated_height"] +
+        weights["weight_total_holes"]       * playfield_statistics["total_holes"]       +
+        weights["weight_bumpiness"]         * playfield_statistics["bumpiness"]         +
+        weights["weight_lines_cleared"]     * lines_cleared
+    )
+
+def get_best_index(playfields :list[tuple[int, ...]], lines_cleared :list[int], columns :int, weights :dict) -> int:
+    """
+    playfields are the row masks after each candidate placement and lines_cleared the lines each one made.
+    It returns the index of the best one (the first one in case of a draw, like min() does)
+    """
+    row_masks = np.array(playfields, dtype=get_row_mask_dtype(columns))
+    statistics = get_playfield_statistics(row_masks, columns)
+    fitting_algorithm = calculate_heuristics(statistics, np.array(lines_cleared, dtype=np.int64), weights)
+    return int(np.argmin(fitting_algorithm))
@@ -1,53 +1,61 @@
-from tetris_engine import TetrisEngine, TetrominoColor, TetrominoShape
+from tetris_engine import Ruleset, TetrisEngine, TetrominoColor, TetrominoShape
 from tetris_engine import config
 import tkinter as tk
 import tkinter.ttk as ttk
 
 class Window(tk.Tk):
-    def __init__(self):
+    def __init__(self, ruleset :Ruleset = None):
+        """ :param ruleset: board, spawn and tetrominoes (see tetris_engine.Ruleset), by default the ones of the config """
         super().__init__()
 
         self.title("AI Games - Tetris")
-        self.geometry("264x580")
+
+        self.tetris_engine = TetrisEngine(ruleset=ruleset)
+        ruleset = self.tetris_engine.ruleset
+
+        self.playfield_screen = PlayfieldScreen(self,
+            ruleset.columns,
+            ruleset.visible_rows,
+            config["playfield"]["background_color"],
+            ruleset.tetrominoes)
+        self.playfield_screen.place(x=20, y=20)
+
+        # Everything else goes below the playfield, for the default board it is 264x580
+        y = self.playfield_screen.height + 38
+        self.geometry(f"{max(264, self.playfield_screen.width + 40)}x{y + 100}")
 
         self.lines_cleared_text = tk.StringVar()
         self.reset_lines_cleared_counter()
         lines_cleared_label = ttk.Label(self, textvariable=self.lines_cleared_text)
-        lines_cleared_label.place(x=20, y=480)
+        lines_cleared_label.place(x=20, y=y)
 
         self.game_over_text = tk.StringVar()
         self.game_over_text.set("")
         game_over_label = ttk.Label(self, textvariable=self.game_over_text)
-        game_over_label.place(x=170, y=480)
+        game_over_label.place(x=170, y=y)
 
         self.show_ghost_dropped_piece_checkbutton_value = tk.IntVar(value=1)
         show_ghost_dropped_piece_checkbutton = ttk.Checkbutton(self,
             text="Show ghost dropped piece",
             variable=self.show_ghost_dropped_piece_checkbutton_value,
             command=self.show_ghost)
-        show_ghost_dropped_piece_checkbutton.place(x=20, y=500)
+        show_ghost_dropped_piece_checkbutton.place(x=20, y=y+20)
 
         exit_button = ttk.Button(self, text="Exit", command=self.exit)
-        exit_button.place(x=20, y=540)
+        exit_button.place(x=20, y=y+60)
 
         new_game_button = ttk.Button(self, text="New game", command=self.new_game)
-        new_game_button.place(x=170, y=540)
+        new_game_button.place(x=170, y=y+60)
 
         self.bind('<KeyPress>', self.on_key_down)
 
-        self.tetris_engine = TetrisEngine()
+        self.tetris_engine.delta_on_playfield_updated_event = True # only what changed in every event
+        self.playfield_data = None # the whole playfield, updated with every event
         self.tetris_engine.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, self.update_playfield)
         self.tetris_engine.bind_event(TetrisEngine.Events.ON_LINES_CLEARED, self.update_lines_cleared_counter)
         self.tetris_engine.bind_event(TetrisEngine.Events.ON_GAME_OVER, self.game_over)
 
-        self.playfield_screen = PlayfieldScreen(self,
-            config["playfield"]["columns"],
-            config["playfield"]["rows"],
-            config["playfield"]["background_color"],
-            config["tetrominoes"])
-        self.playfield_screen.place(x=20, y=20)
-
-        self.gravity_speed = config["playfield"]["falling_piece"]["gravity_speed"]
+        self.gravity_speed = ruleset.gravity_speed
         self.gravity_timer = None # It has to be define outside new_game or it will mess up after_cancel
                                 # since the value will be None
         self.new_game()
@@ -114,7 +122,9 @@ class Window(tk.Tk):
         self.total_lines_cleared += lines_cleared
         self.lines_cleared_text.set(f"Lines cleared: {self.total_lines_cleared}")
 
-    def update_playfield(self, data :dict):       
+    def update_playfield(self, data :dict):
+        self.playfield_data = TetrisEngine.apply_playfield_updated_event(self.playfield_data, data)
+        data = self.playfield_data
         if self.show_ghost_dropped_piece_checkbutton_value.get() == 1:
             self.playfield_screen.draw(
                 data["rows_from_the_bottom_up"],
@@ -129,25 +139,37 @@ class Window(tk.Tk):
                 [])
 
 class PlayfieldScreen(tk.Canvas):
-    def __init__(self, master, columns: int, rows: int, background_color :str, tetrominoes: any, **kwargs):
-        self.width = 224  # 2 x border(2px) + 10 x blocks (20px) +  9 x gaps (2px) + extra two to fit all well
-        self.height = 442 # well bottom 2px + 20 x blocks (20px) + 19 x gaps (2px) + extra two to fit all well
+    """
+    The canvas items are created only once: a rectangle per block, 4 for the falling piece and 4 for the ghost dropped piece.
+    Every time we draw, only the blocks with a different color are changed and the pieces are moved,
+    so we never delete and create the ~230 items again and we can draw a lot of frames per second.
+    """
+    def __init__(self, master, columns: int, rows: int, background_color :str, tetrominoes: any, scale :float = 1, **kwargs):
+        """
+        :param rows: the visible ones, the hidden rows at the top are not drawn
+        :param scale: size of the screen, e.g. 0.5 is half the width and half the height. It can't change later
+        """
+        self.width = round((22 * columns + 4) * scale) # 2 x border(2px) + 10 x blocks (20px) +  9 x gaps (2px) + extra two to fit all well
+        self.height = round((22 * rows + 2) * scale)   # well bottom 2px + 20 x blocks (20px) + 19 x gaps (2px) + extra two to fit all well
         self.background = background_color
         super().__init__(master, width=self.width, height=self.height, bg=self.background, **kwargs)
 
         self.columns = columns
         self.rows = rows
 
+        self.scale = scale
         self.well_border_color = "darkslategrey"
-        self.well_border_width = 2
-        self.block_length = 20
-        self.block_length_gap = 2
+        self.well_border_width = max(1, round(2 * scale))
+        self.block_length = 20 * scale
+        self.block_length_gap = 2 * scale
+        self.ghost_inset = 2 * scale
 
         # coordinates of (1,1) in pixels
-        self.x1 = self.well_border_width + 2 # 4px
+        self.x1 = self.well_border_width + 2 * scale # 4px
         self.y1 = self.height - self.well_border_width - self.block_length
-        
+
         self.build_color_dictionary(tetrominoes)
+        self.create_items()
         self.clear()
 
     def build_color_dictionary(self, tetrominoes :any) -> None:
@@ -155,63 +177,94 @@ class PlayfieldScreen(tk.Canvas):
         self.colors_by_shape[str(TetrominoShape.NONE)] = str(TetrominoColor.NONE)
         for tetromino in tetrominoes:
             self.colors_by_shape[str(tetromino["shape"])] = str(tetromino["color"])
+        self.colors_by_code = { ord(shape): color for shape, color in self.colors_by_shape.items() } # for the rows of bytes
+
+    def clear(self) -> None:
+        self.draw([[str(TetrominoShape.NONE)] * self.columns for y in range(self.rows)])
+
+    def create_items(self) -> None:
+        """ All the items of the canvas, the order is important because the last ones are on top """
+        self.draw_well()
+
+        # block_items[y-1][x-1] is the block (x,y) and drawn_rows what we have drawn there (bytes per row)
+        self.block_items = [ [ self.create_rectangle(self.get_block_rectangle(x, y), outline="black", fill=str(TetrominoColor.NONE))
+                               for x in range(1, self.columns + 1) ]
+                             for y in range(1, self.rows + 1) ]
+        self.drawn_rows = [ str(TetrominoShape.NONE).encode("ascii") * self.columns for _ in range(self.rows) ]
+
+        self.falling_piece_items = [ self.create_rectangle((0, 0, 0, 0), outline="black", state="hidden") for _ in range(4) ]
+        self.ghost_dropped_piece_items = [ self.create_rectangle((0, 0, 0, 0), outline="black", fill="#D0D0D0", state="hidden")
+                                           for _ in range(4) ]
+        self.drawn_falling_piece = None           # (shape, coordinates)
+        self.drawn_ghost_dropped_piece = None     # coordinates
 
     def draw(self,
         rows_from_the_bottom_up :list[list[str]],
         falling_piece_shape: str = str(TetrominoShape.NONE),
         falling_piece_coordinates :list[list] = [],
         ghost_dropped_piece_coordinates :list[list] = []) -> None:
-        # The right thing to do is to tag each block and redraw only the ones that are different
-        # i.e. different color. See this answer from comments: https://stackoverflow.com/a/15840231
-        # But due to the simplicity of our grid and since I can't see any slowdown due to this,
-        # we will delete all the graphics and redraw them in each frame
-        self.delete("all")
-        self.draw_well()
         self.draw_rows(rows_from_the_bottom_up)
         self.draw_falling_piece(falling_piece_shape, falling_piece_coordinates)
         self.draw_ghost_dropped_piece(ghost_dropped_piece_coordinates)
 
-    def clear(self) -> None:
-        self.draw([[str(TetrominoShape.NONE)] * self.columns for y in range(self.rows)])
-
-    def draw_block(self, playfield_x :int, playfield_y :int, shape :str) -> None:
-        x = self.x1 + (playfield_x - 1) * (self.block_length + self.block_length_gap)
-        y = self.y1 - (playfield_y - 1) * (self.block_length + self.block_length_gap)
-        color = self.colors_by_shape[shape]
-        self.create_rectangle( (x, y, x + self.block_length, y + self.block_length), outline="black", fill=color)
-
     def draw_falling_piece(self, shape :str, coordinates: list[list]) -> None:
-        if not coordinates:
+        if self.drawn_falling_piece == (shape, coordinates):
             return
-        for x, y in coordinates:
-            self.draw_block(x, y, shape)
-
-    def draw_ghost_block(self, playfield_x :int, playfield_y :int) -> None:
-        x = self.x1 + (playfield_x - 1) * (self.block_length + self.block_length_gap)
-        y = self.y1 - (playfield_y - 1) * (self.block_length + self.block_length_gap)
-        color = "black"
-        inset_px = 2
-        self.create_rectangle(
-                (x + inset_px, y + inset_px, x + self.block_length - inset_px, y + self.block_length - inset_px),
-                outline=color, fill="#D0D0D0")
+        self.drawn_falling_piece = (shape, coordinates)
+        color = self.colors_by_shape[shape]
+        self.move_piece_items(self.falling_piece_items, coordinates, self.get_block_rectangle, color)
 
     def draw_ghost_dropped_piece(self, coordinates :list) -> None:
-        if not coordinates:
+        if self.drawn_ghost_dropped_piece == coordinates:
             return
-        for x, y in coordinates:
-            self.draw_ghost_block(x, y)
+        self.drawn_ghost_dropped_piece = coordinates
+        self.move_piece_items(self.ghost_dropped_piece_items, coordinates, self.get_ghost_block_rectangle)
 
     def draw_rows(self, rows: list[list[str]]) -> None:
-        for y, row in enumerate(rows, start=1):
+        """
+        Only the blocks that changed since the last time. The rows are lists of letters (the engine)
+        or memoryviews of bytes (FrameRingBuffer, compared with what we have drawn without building anything)
+        """
+        for y, row in enumerate(rows[:self.rows], start=1):
+            if not isinstance(row, memoryview):
+                row = "".join(row).encode("ascii") # so we always compare bytes with bytes
+            drawn_row = self.drawn_rows[y - 1]
+            if row == drawn_row:
+                continue
             for x, value in enumerate(row, start=1):
-                self.draw_block(x, y, value)
+                if value != drawn_row[x - 1]:
+                    self.itemconfigure(self.block_items[y - 1][x - 1], fill=self.colors_by_code[value])
+            self.drawn_rows[y - 1] = bytes(row)
 
     def draw_well(self):
         # 3px seems to do the trick to see the left well wall because 0 wouldn't make it.
-        self.create_line(         3,           0,          3, self.height, width=self.well_border_width, fill=self.well_border_color)
+        left = 3 * self.scale
+        self.create_line(      left,           0,       left, self.height, width=self.well_border_width, fill=self.well_border_color)
         self.create_line(         0, self.height, self.width, self.height, width=self.well_border_width, fill=self.well_border_color)
         self.create_line(self.width, self.height, self.width,           0, width=self.well_border_width, fill=self.well_border_color)
 
+    def get_block_rectangle(self, playfield_x :int, playfield_y :int) -> tuple:
+        x = self.x1 + (playfield_x - 1) * (self.block_length + self.block_length_gap)
+        y = self.y1 - (playfield_y - 1) * (self.block_length + self.block_length_gap)
+        return (x, y, x + self.block_length, y + self.block_length)
+
+    def get_ghost_block_rectangle(self, playfield_x :int, playfield_y :int) -> tuple:
+        x1, y1, x2, y2 = self.get_block_rectangle(playfield_x, playfield_y)
+        inset = self.ghost_inset
+        return (x1 + inset, y1 + inset, x2 - inset, y2 - inset)
+
+    def move_piece_items(self, items :list[int], coordinates :list[list], get_rectangle :object, color :str = None) -> None:
+        """ The items of a piece go to its blocks and the ones we don't need are hidden """
+        for index, item in enumerate(items):
+            if index < len(coordinates):
+                self.coords(item, get_rectangle(*coordinates[index]))
+                if color:
+                    self.itemconfigure(item, fill=color, state="normal")
+                else:
+                    self.itemconfigure(item, state="normal")
+            else:
+                self.itemconfigure(item, state="hidden")
+
 if __name__ == "__main__":
     window = Window()
     window.mainloop()
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Opt-in profiling of the phases of the TetrisAgent, e.g. TetrisAgent(profiler=AgentProfiler()).
+
+When it is attached to an agent, the methods of every phase are replaced in that agent (and in its playfield)
+by the same methods counting their calls and their time. The class is never changed,
+so an agent without profiler runs exactly the same code as always and pays nothing for it.
+
+    sequence_generation : TetrisAgent.get_possible_placements
+    state_restore       : Playfield.restore_snapshot
+    placement           : TetrisEngine.place (simulated placements)
+    sequence_playback   : TetrisAgent.play_sequence (the movements really played)
+    statistics          : TetrisAgent.get_playfield_statistics
+    heuristic_scoring   : TetrisAgent.calculate_heuristics
+
+The phases can be nested (e.g. the lookahead generates sequences while it simulates),
+so the seconds of all the phases don't have to add up to the time of the move.
+
+The statistics of every move and of every game are dicts { phase: { "calls": ..., "seconds": ... } } (plus "moves" per game).
+We can read them (move_statistics, game_statistics) or get them in a callback(event, statistics),
+where event is "move" or "game".
+"""
+
+from time import perf_counter
+
+class AgentProfiler:
+
+    phases = {
+        # phase: (object of the agent with the method, method)
+        "sequence_generation": (None,        "get_possible_placements"),
+        "state_restore":       ("playfield", "restore_snapshot"),
+        "placement":           (None,        "place"),
+        "sequence_playback":   (None,        "play_sequence"),
+        "statistics":          (None,        "get_playfield_statistics"),
+        "heuristic_scoring":   (None,        "calculate_heuristics")
+    }
+
+    def __init__(self, callback :object = None) -> None:
+        """
+        :param callback: function(event, statistics) called after every move and every game
+        """
+        self.callback = callback
+        self.counters = { phase: [0, 0.0] for phase in self.phases } # calls and seconds of the current move
+        self.move_statistics :dict = {}
+        self.game_statistics :dict = self._get_empty_statistics()
+        self.game_statistics["moves"] = 0
+
+    def _get_empty_statistics(self) -> dict:
+        return { phase: { "calls": 0, "seconds": 0.0 } for phase in self.phases }
+
+    def _get_owner(self, agent :object, attribute :str) -> object:
+        return getattr(agent, attribute) if attribute else agent
+
+    def _get_timed_method(self, phase :str, method :object) -> object:
+        counter = self.counters[phase]
+        def timed_method(*args, **kwargs):
+            t_start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += perf_counter() - t_start
+        return timed_method
+
+    def attach(self, agent :object) -> None:
+        for phase, (attribute, method_name) in self.phases.items():
+            owner = self._get_owner(agent, attribute)
+            setattr(owner, method_name, self._get_timed_method(phase, getattr(owner, method_name)))
+
+    def detach(self, agent :object) -> None:
+        """ The agent goes back to the methods of its class """
+        for attribute, method_name in self.phases.values():
+            owner = self._get_owner(agent, attribute)
+            if method_name in vars(owner):
+                delattr(owner, method_name)
+
+    def end_game(self) -> None:
+        if self.callback:
+            self.callback("game", self.game_statistics)
+
+    def end_move(self) -> None:
+        self.move_statistics = self._get_empty_statistics()
+        for phase, counter in self.counters.items():
+            calls, seconds = counter
+            self.move_statistics[phase]["calls"] = calls
+            self.move_statistics[phase]["seconds"] = seconds
+            self.game_statistics[phase]["calls"] += calls
+            self.game_statistics[phase]["seconds"] += seconds
+            counter[0] = 0
+            counter[1] = 0.0
+        self.game_statistics["moves"] += 1
+        if self.callback:
+            self.callback("move", self.move_statistics)
+
+    def start_game(self) -> None:
+        for counter in self.counters.values():
+            counter[0] = 0
+            counter[1] = 0.0
+        self.game_statistics = self._get_empty_statistics()
+        self.game_statistics["moves"] = 0
@@ -0,0 +1,407 @@
+"""
+Compact binary records of the games played by the TetrisAgent, e.g. TetrisAgent(recorder=GameRecordWriter(file)).
+
+We don't save every playfield, only what is needed to play the game again: for every piece its shape,
+rotation and column (and the lines it cleared, to verify the game when we play it again).
+That is 2 bytes per piece, so a game of 1000 pieces is ~2KB and a file can have one record after another:
+
+    header    : magic "TTRC", version, piece source mode, has seed, seed, shapes of the piece source skipped
+                (the ones it gave to the games played before this one), the 4 weights (see weight_names),
+                keyframe interval, columns, rows
+    pieces    : 2 bytes per piece
+                    byte 0: shape index in config["tetrominoes"] (bits 0-2), angle / 90 (bits 3-4), lines cleared (bits 5-7)
+                    byte 1: center_x
+                and every keyframe interval pieces a keyframe (see below)
+    end       : 1 byte 0xFF (shape index 7 doesn't exist) and the trailer:
+                pieces, lines cleared, game over, next shape (to know if the last piece was game over),
+                board hash (see Playfield.board_hash) at the end of the game
+    index     : piece index and offset (from the beginning of the record) of every keyframe
+    footer    : number of keyframes, size of the whole record
+
+    keyframe  : 1 byte 0xFE (it would be 7 lines cleared), the piece index and the playfield before that piece,
+                every row packed in an integer with 3 bits per block (0 empty, 1 + shape index otherwise)
+
+With the keyframes we don't need to play a long game from the beginning to see the playfield at some piece,
+only from the keyframe before it (see GameRecordFile.seek). And with the footer at the end of every record we find
+the records and their keyframes from the end of the file, so a memory mapped file is never read completely.
+
+The writer streams the record: the header goes to the file when the game starts and the pieces every keyframe interval
+pieces (with the keyframe), so the agent only appends 2 bytes per piece to a small buffer while it plays and the memory
+used doesn't grow with the game. At the end only the rest of the pieces, the trailer, the index and the footer are written.
+If the game never ends (e.g. a crash) the last record of the file has no end: read_records and GameRecordFile
+read it anyway, with what was written, as a record cut before the end (trailer None).
+
+replay_record plays a record again with TetrisEngine.place and raises ValueError if something is not the same
+(lines cleared by every piece, the shapes of the piece source with that seed, the keyframes or the trailer)
+
+The board of the game can be any size (see tetris_engine.Ruleset), but the tetrominoes have to be the ones of the config:
+a record doesn't have the piece set, so a game with other tetrominoes can't be recorded (ValueError in start_game)
+"""
+
+from bisect import bisect_right
+import mmap
+import os
+import struct
+from tetris_agent import weight_names
+from tetris_engine import PieceSource, Playfield, Ruleset, TetrisEngine, TetrominoShape, default_ruleset
+
+MAGIC = b"TTRC"
+VERSION = 3
+KEYFRAME = 0xFE
+END_OF_PIECES = 0xFF
+
+HEADER = struct.Struct("<4sBBBQI4dHBB") # magic, version, piece source mode, has seed, seed, shapes skipped, weights, keyframe interval, columns, rows
+KEYFRAME_PIECE_INDEX = struct.Struct("<I")
+TRAILER = struct.Struct("<IIBBQ")       # pieces, lines cleared, game over, next shape, board hash
+INDEX_ENTRY = struct.Struct("<II")      # piece index, offset of the keyframe
+FOOTER = struct.Struct("<II")           # keyframes, size of the record
+
+piece_source_modes = [ PieceSource.UNIFORM, PieceSource.SEVEN_BAG, PieceSource.STREAM ]
+shape_indexes = { shape: index for index, shape in enumerate(PieceSource.shapes) }
+block_codes = { str(shape): index + 1 for index, shape in enumerate(PieceSource.shapes) }
+block_values = [ str(TetrominoShape.NONE) ] + [ str(shape) for shape in PieceSource.shapes ]
+
+def _get_ruleset(columns :int, rows :int, ruleset :Ruleset) -> Ruleset:
+    """ The ruleset to play a record again: the one we are told or, if none, the one of the config with the board of the record """
+    if ruleset is None:
+        ruleset = default_ruleset if (columns, rows) == (default_ruleset.columns, default_ruleset.rows) else Ruleset(columns, rows)
+    if (columns, rows) != (ruleset.columns, ruleset.rows):
+        raise ValueError(f"The record is for a playfield of {columns}x{rows}")
+    if ruleset.shapes != PieceSource.shapes:
+        raise ValueError("The records are only for the tetrominoes of the config")
+    return ruleset
+
+def _get_row_size(columns :int) -> int:
+    return (3 * columns + 7) // 8
+
+def _pack_rows(rows :list[list[str]]) -> bytes:
+    row_size = _get_row_size(len(rows[0]))
+    packed_rows = bytearray()
+    for row in rows:
+        packed_row = 0
+        for grid_x, value in enumerate(row):
+            if value in block_codes:
+                packed_row |= block_codes[value] << (3 * grid_x)
+        packed_rows += packed_row.to_bytes(row_size, "little")
+    return bytes(packed_rows)
+
+def _unpack_rows(data :bytes, offset :int, columns :int, rows :int) -> list[list[str]]:
+    row_size = _get_row_size(columns)
+    unpacked_rows = []
+    for grid_y in range(rows):
+        packed_row = int.from_bytes(data[offset + grid_y * row_size : offset + (grid_y + 1) * row_size], "little")
+        unpacked_rows.append([ block_values[(packed_row >> (3 * grid_x)) & 0b111] for grid_x in range(columns) ])
+    return unpacked_rows
+
+def _unpack_piece(piece :int, center_x :int) -> tuple:
+    return (PieceSource.shapes[piece & 0b111], ((piece >> 3) & 0b11) * 90, center_x, piece >> 5)
+
+class GameRecord:
+    """ A record read with read_records or GameRecordFile """
+
+    def __init__(self,
+        piece_source_mode :str,
+        seed :int,
+        weights :dict,
+        columns :int,
+        rows :int,
+        pieces :list[tuple],
+        keyframes :dict[int, list[list[str]]],
+        trailer :tuple,
+        shapes_skipped :int = 0) -> None:
+        """
+        :param pieces: (shape, angle, center_x, lines cleared) of every piece
+        :param keyframes: piece index -> all the rows of the playfield (see Playfield.get_all_rows) before that piece
+        :param trailer: (pieces, lines cleared, game over, next shape index, board hash), None if the record was cut before the end
+        :param shapes_skipped: shapes that the piece source with the seed gave before the first piece of the game
+        """
+        self.piece_source_mode = piece_source_mode
+        self.seed = seed
+        self.weights = weights
+        self.columns = columns
+        self.rows = rows
+        self.pieces = pieces
+        self.keyframes = keyframes
+        self.trailer = trailer
+        self.shapes_skipped = shapes_skipped
+
+class GameRecordWriter:
+
+    def __init__(self, file :object, keyframe_interval :int = 256) -> None:
+        """
+        :param file: binary file (or anything with write) where the records go one after another
+        :param keyframe_interval: pieces between keyframes, the more pieces the smaller the record but the slower the seeking.
+        It is also how often the pieces are written to the file
+        """
+        self.file = file
+        self.keyframe_interval = keyframe_interval
+        self.playfield = None
+        self.pending = bytearray() # the part of the record not written yet
+        self.bytes_written = 0     # of the record of this game
+        self.number_of_pieces = 0
+        self.keyframes = [] # (piece index, offset)
+        self.games_written = 0
+
+    def end_game(self, lines_cleared :int, is_game_over :bool, next_shape :object, board_hash :int) -> None:
+        self.pending.append(END_OF_PIECES)
+        self.pending += TRAILER.pack(self.number_of_pieces, lines_cleared, is_game_over, shape_indexes[next_shape], board_hash)
+        for piece_index, offset in self.keyframes:
+            self.pending += INDEX_ENTRY.pack(piece_index, offset)
+        self.pending += FOOTER.pack(len(self.keyframes), self.bytes_written + len(self.pending) + FOOTER.size)
+        self.flush()
+        self.games_written += 1
+
+    def flush(self) -> None:
+        """ What we have of the record to the file, so it is there even if the game never ends """
+        self.file.write(self.pending)
+        self.bytes_written += len(self.pending)
+        self.pending.clear()
+        if hasattr(self.file, "flush"):
+            self.file.flush()
+
+    def start_game(self, piece_source :PieceSource, weights :dict, playfield :Playfield, shapes_skipped :int = 0) -> None:
+        """
+        :param playfield: the one of the game, we take the keyframes from it
+        :param shapes_skipped: shapes the piece source gave before the first piece of this game (e.g. to the games before)
+        """
+        if piece_source.shapes != PieceSource.shapes:
+            raise ValueError("Only the games with the tetrominoes of the config can be recorded")
+        has_seed = piece_source.seed is not None and 0 <= piece_source.seed < 2**64
+        self.playfield = playfield
+        self.pending = bytearray(HEADER.pack(MAGIC, VERSION, piece_source_modes.index(piece_source.mode),
+                                             has_seed, piece_source.seed if has_seed else 0, shapes_skipped,
+                                             *[ weights[name] for name in weight_names ],
+                                             self.keyframe_interval, playfield.columns, playfield.rows))
+        self.bytes_written = 0
+        self.number_of_pieces = 0
+        self.keyframes = []
+        self.flush()
+
+    def write_keyframe(self) -> None:
+        self.keyframes.append((self.number_of_pieces, self.bytes_written + len(self.pending)))
+        self.pending.append(KEYFRAME)
+        self.pending += KEYFRAME_PIECE_INDEX.pack(self.number_of_pieces)
+        self.pending += _pack_rows(self.playfield.get_all_rows())
+
+    def write_piece(self, shape :object, angle :int, center_x :int, lines_cleared :int) -> None:
+        """ After the piece is played, with the playfield already updated """
+        self.pending.append(shape_indexes[shape] | (angle // 90) << 3 | lines_cleared << 5)
+        self.pending.append(center_x)
+        self.number_of_pieces += 1
+        if self.number_of_pieces % self.keyframe_interval == 0:
+            self.write_keyframe()
+            self.flush()
+
+def read_record(data :bytes, offset :int) -> tuple[GameRecord, int]:
+    """ The record starting at offset of data, and where the next one starts (the end of data if the record was cut) """
+    if len(data) - offset < HEADER.size:
+        raise ValueError(f"The game record at byte {offset} was cut in its header")
+    magic, version, mode, has_seed, seed, shapes_skipped, *weights, _, columns, rows = HEADER.unpack_from(data, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a game record (version {VERSION}) at byte {offset}")
+    offset += HEADER.size
+    keyframe_size = KEYFRAME_PIECE_INDEX.size + rows * _get_row_size(columns)
+
+    pieces = []
+    keyframes = {}
+    while offset < len(data) and data[offset] != END_OF_PIECES:
+        if data[offset] == KEYFRAME:
+            if offset + 1 + keyframe_size > len(data):
+                break # cut while the keyframe was written
+            piece_index, = KEYFRAME_PIECE_INDEX.unpack_from(data, offset + 1)
+            keyframes[piece_index] = _unpack_rows(data, offset + 1 + KEYFRAME_PIECE_INDEX.size, columns, rows)
+            offset += 1 + keyframe_size
+        else:
+            if offset + 2 > len(data):
+                break
+            pieces.append(_unpack_piece(data[offset], data[offset + 1]))
+            offset += 2
+
+    trailer = None
+    end = offset + 1 + TRAILER.size + len(keyframes) * INDEX_ENTRY.size + FOOTER.size
+    if offset < len(data) and data[offset] == END_OF_PIECES and end <= len(data):
+        trailer = TRAILER.unpack_from(data, offset + 1)
+        offset = end
+    else:
+        offset = len(data) # the record was cut before the end, it is the last one
+
+    record = GameRecord(piece_source_modes[mode], seed if has_seed else None, dict(zip(weight_names, weights)),
+                        columns, rows, pieces, keyframes, trailer, shapes_skipped)
+    return (record, offset)
+
+def read_records(data :bytes) -> list[GameRecord]:
+    """ All the records one after another in data (e.g. the content of a file) """
+    records = []
+    offset = 0
+    while offset < len(data):
+        record, offset = read_record(data, offset)
+        records.append(record)
+    return records
+
+def replay_record(record :GameRecord, ruleset :Ruleset = None) -> dict:
+    """
+    It plays the game of the record again, verifying it, and returns how it ended:
+    { "pieces": ..., "lines_cleared": ..., "is_game_over": ..., "board_hash": ... }
+    The ruleset is needed only if the record was not played with the default one (or one of the same size)
+    """
+    ruleset = _get_ruleset(record.columns, record.rows, ruleset)
+    if record.seed is not None and record.piece_source_mode != PieceSource.STREAM:
+        piece_source = PieceSource(record.piece_source_mode, record.seed, shapes=ruleset.shapes)
+        for _ in range(record.shapes_skipped):
+            piece_source.get_next_shape()
+    else:
+        piece_source = None # we only have the shapes of the record
+
+    engine = TetrisEngine(piece_source=piece_source, ruleset=ruleset)
+    if piece_source:
+        shapes = [ engine.falling_piece.shape ] + engine.next_shapes # the engine already took them
+
+    total_lines_cleared = 0
+    is_game_over = False
+    for index, (shape, angle, center_x, lines_cleared) in enumerate(record.pieces):
+        if piece_source:
+            if index >= len(shapes):
+                shapes.append(piece_source.get_next_shape())
+            if shapes[index] != shape:
+                raise ValueError(f"Piece {index} is {shape} but the piece source with seed {record.seed} gives {shapes[index]}")
+        if is_game_over:
+            raise ValueError(f"Piece {index} was played after game over")
+        if index in record.keyframes and record.keyframes[index] != engine.playfield.get_all_rows():
+            raise ValueError(f"The keyframe of piece {index} is not the playfield we have")
+
+        if index + 1 < len(record.pieces):
+            next_shape = record.pieces[index + 1][0]
+        else:
+            next_shape = PieceSource.shapes[record.trailer[3]] if record.trailer else None
+        result = engine.place(shape, angle, center_x, next_shape)
+        if result is None:
+            raise ValueError(f"Piece {index} {shape} can't be placed at angle {angle} and center_x {center_x}")
+        replayed_lines_cleared, is_game_over, _ = result
+        if replayed_lines_cleared != lines_cleared:
+            raise ValueError(f"Piece {index} cleared {replayed_lines_cleared} lines instead of {lines_cleared}")
+        total_lines_cleared += replayed_lines_cleared
+
+    result = {
+        "pieces":        len(record.pieces),
+        "lines_cleared": total_lines_cleared,
+        "is_game_over":  is_game_over,
+        "board_hash":    engine.playfield.board_hash
+    }
+    if record.trailer and record.trailer != (result["pieces"], result["lines_cleared"], result["is_game_over"], record.trailer[3], result["board_hash"]):
+        raise ValueError(f"The game ended as {result} but the record says {record.trailer}")
+    return result
+
+def _get_record_offsets(data :bytes, end :int) -> list[int]:
+    """
+    Where the complete records that end at end start, walking their footers back to the beginning of data.
+    None if they don't end there: a footer that doesn't match its record is not a footer (e.g. the pieces of a cut record)
+    """
+    record_offsets = []
+    while end > 0:
+        if end < HEADER.size + 1 + TRAILER.size + FOOTER.size:
+            return None
+        keyframes, record_size = FOOTER.unpack_from(data, end - FOOTER.size)
+        start = end - record_size
+        end_of_pieces = end - FOOTER.size - keyframes * INDEX_ENTRY.size - TRAILER.size - 1
+        if start < 0 or end_of_pieces < start + HEADER.size or data[start : start + len(MAGIC)] != MAGIC \
+            or data[end_of_pieces] != END_OF_PIECES:
+            return None
+        record_offsets.append(start)
+        end = start
+    record_offsets.reverse()
+    return record_offsets
+
+class GameRecordFile:
+    """
+    A file of records, memory mapped: only the parts we need are read.
+    The records are found from the end of the file with their footers. If the last one was cut (its game never ended)
+    it has no footer, so we look for its header and the footers of the records before it (cut_record_offset)
+    """
+
+    def __init__(self, path :str) -> None:
+        self.file = open(path, "rb")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.data = b"" # no records yet (e.g. no game started), and an empty file can't be memory mapped
+        else:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.cut_record_offset = None
+        self.record_offsets = _get_record_offsets(self.data, len(self.data))
+        start = len(self.data)
+        while self.record_offsets is None:
+            start = self.data.rfind(MAGIC, 0, start)
+            if start < 0:
+                raise ValueError(f"{path} is not a file of game records")
+            self.record_offsets = _get_record_offsets(self.data, start)
+            if self.record_offsets is not None and len(self.data) - start >= HEADER.size: # else it was cut in its header
+                self.record_offsets.append(start)
+                self.cut_record_offset = start
+
+    def __len__(self) -> int:
+        return len(self.record_offsets)
+
+    def _find_keyframes(self, record_offset :int) -> list[tuple[int, int]]:
+        """ Like get_keyframe_index for the record that was cut, which has no index: we walk its pieces """
+        columns, rows = HEADER.unpack_from(self.data, record_offset)[-2:]
+        keyframe_size = 1 + KEYFRAME_PIECE_INDEX.size + rows * _get_row_size(columns)
+        keyframe_index = []
+        offset = record_offset + HEADER.size
+        while offset < len(self.data):
+            if self.data[offset] == KEYFRAME:
+                if offset + keyframe_size > len(self.data):
+                    break
+                keyframe_index.append((KEYFRAME_PIECE_INDEX.unpack_from(self.data, offset + 1)[0], offset))
+                offset += keyframe_size
+            else:
+                offset += 2
+        return keyframe_index
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def get_keyframe_index(self, record_number :int) -> list[tuple[int, int]]:
+        """ (piece index, offset in the file) of every keyframe of the record """
+        record_offset = self.record_offsets[record_number]
+        if record_offset == self.cut_record_offset:
+            return self._find_keyframes(record_offset)
+        end = self.record_offsets[record_number + 1] if record_number + 1 < len(self) else len(self.data)
+        keyframes, _ = FOOTER.unpack_from(self.data, end - FOOTER.size)
+        index_offset = end - FOOTER.size - keyframes * INDEX_ENTRY.size
+        keyframe_index = []
+        for keyframe in range(keyframes):
+            piece_index, offset = INDEX_ENTRY.unpack_from(self.data, index_offset + keyframe * INDEX_ENTRY.size)
+            keyframe_index.append((piece_index, record_offset + offset))
+        return keyframe_index
+
+    def read_record(self, record_number :int) -> GameRecord:
+        record, _ = read_record(self.data, self.record_offsets[record_number])
+        return record
+
+    def seek(self, record_number :int, piece_index :int, ruleset :Ruleset = None) -> TetrisEngine:
+        """
+        An engine with the playfield before the piece piece_index of the record was played.
+        It starts from the last keyframe before that piece, so it plays at most keyframe interval pieces.
+        See replay_record for the ruleset
+        """
+        record_offset = self.record_offsets[record_number]
+        columns, rows = HEADER.unpack_from(self.data, record_offset)[-2:]
+        engine = TetrisEngine(ruleset=_get_ruleset(columns, rows, ruleset))
+
+        keyframe_index = self.get_keyframe_index(record_number)
+        keyframe = bisect_right([ keyframe_piece_index for keyframe_piece_index, _ in keyframe_index ], piece_index) - 1
+        if keyframe >= 0:
+            current_piece_index, offset = keyframe_index[keyframe]
+            engine.playfield.set_all_rows(_unpack_rows(self.data, offset + 1 + KEYFRAME_PIECE_INDEX.size, columns, rows))
+            offset += 1 + KEYFRAME_PIECE_INDEX.size + rows * _get_row_size(columns)
+        else:
+            current_piece_index, offset = 0, record_offset + HEADER.size
+
+        while current_piece_index < piece_index:
+            if offset + 2 > len(self.data) or self.data[offset] == END_OF_PIECES:
+                raise IndexError(f"The record {record_number} has only {current_piece_index} pieces")
+            shape, angle, center_x, _ = _unpack_piece(self.data[offset], self.data[offset + 1])
+            engine.place(shape, angle, center_x)
+            current_piece_index += 1
+            offset += 2
+        return engine
@@ -0,0 +1,364 @@
+"""
+Headless game server: many Tetris sessions in one process (see tetris_sessions.GameLoop) behind a JSON lines protocol
+over TCP or a Unix socket. Every message is a JSON object in one line, from the client:
+
+    { "id": 1, "command": "create", "weights": {...}, "seed": 7, "gravity_speed": 2000, "ruleset": {...} }  all optional
+    { "id": 2, "command": "move", "session": 1, "action": "left" }                        see GameSession.actions
+    { "id": 3, "command": "close", "session": 1 }
+    { "id": 4, "command": "statistics" }
+
+weights (all the ones of tetris_agent.weight_names) are for a bot and ruleset for a board that is not the default one,
+e.g. { "columns": 20, "rows": 42 }
+(see tetris_engine.Ruleset, only the board, the spawn and the gravity: the tetrominoes are always the default ones).
+
+And from the server, the reply to every command with its id (the moves are replied by the updates, see below):
+
+    { "id": 1, "session": 1 }
+    { "id": 4, "statistics": {...} }
+    { "id": 2, "error": "..." }       e.g. a move after game over
+
+The moves are not played when they arrive: they wait for the next tick of the game loop, which plays the moves
+of all the sessions in a batch, moves the pieces down (gravity) and the bots. After every tick each client gets
+one update per session of it that changed, with all the changes of the tick merged:
+
+    { "session": 1, "tick": 130, "type": "delta", "rows": { "1": "IIII  J   ", ... }, "shape": "T",
+      "falling": [[x, y], ...], "ghost": [[x, y], ...], "moves": 12, "lines_cleared": 3, "game_over": false }
+
+"type" is "full" (rows is the list of all the visible rows from the bottom up) or "delta" (rows is y -> row,
+only the rows that changed), see TetrisEngine.raise_on_playfield_updated_event and apply_update.
+"moves" are the moves played so far, so the client knows which ones were played in this tick.
+
+The statistics are to size a deployment:
+    move_latency      : seconds from receiving a move to sending the update of its tick (median, p99...)
+    cpu_utilization   : fraction of the time the server was busy (ticks and messages)
+    sessions_per_core : sessions that one core could host with the same load (sessions / cpu_utilization)
+
+LocalClient is a client in the same process without sockets, e.g. for the tests or to simulate many clients:
+    python tetris_server.py --simulate 500 --seconds 10
+or serving clients (python tetris_server.py --port 7000 or --unix /tmp/tetris.sock).
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import random
+from time import perf_counter
+from tetris_agent import weight_names
+from tetris_engine import Ruleset, TetrisEngine
+from tetris_sessions import GameLoop, GameSession, get_latency_statistics
+
+def _is_integer(value :object) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _check_session_parameters(weights :dict, seed :int, gravity_speed :int) -> None:
+    """ The parameters of create come from the client: a bad one would break the game loop of all the sessions later """
+    if weights is not None:
+        if not isinstance(weights, dict) or sorted(weights) != sorted(weight_names) or not all(
+            (_is_integer(value) or isinstance(value, float)) and math.isfinite(value) for value in weights.values()):
+            raise ValueError(f"The weights have to be the numbers {', '.join(weight_names)}")
+    if seed is not None and not _is_integer(seed):
+        raise ValueError("The seed has to be an integer")
+    if gravity_speed is not None and not (_is_integer(gravity_speed) and gravity_speed > 0):
+        raise ValueError("The gravity speed has to be a positive integer (ms)")
+
+def apply_update(state :dict, update :dict) -> dict:
+    """
+    The client side: it applies an update to the state of a session (None at the beginning) and returns the new state,
+    with rows as the list of all the visible rows. It returns None while we are waiting for the first full update
+    """
+    if update["type"] == "full":
+        state = dict(update)
+        state["rows"] = list(update["rows"])
+        return state
+    if state is None:
+        return None
+    for y, row in update["rows"].items():
+        state["rows"][int(y) - 1] = row
+    for key in ["shape", "falling", "ghost", "moves", "lines_cleared", "game_over", "tick"]:
+        state[key] = update[key]
+    return state
+
+class LocalConnection:
+    """ The messages to a LocalClient, encoded and decoded as if they went through a socket """
+
+    def __init__(self) -> None:
+        self.updates = asyncio.Queue()
+        self.replies = collections.deque() # the server replies straight away, while it handles the message
+
+    def send(self, message :dict) -> None:
+        message = json.loads(json.dumps(message))
+        if "tick" in message:
+            self.updates.put_nowait(message)
+        else:
+            self.replies.append(message)
+
+class StreamConnection:
+
+    def __init__(self, writer :asyncio.StreamWriter) -> None:
+        self.writer = writer
+
+    def send(self, message :dict) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+
+class GameServer:
+
+    # The rulesets come from the clients: a huge board would block the event loop of all the sessions while it is compiled
+    max_columns = 40
+    max_rows = 80
+    max_rulesets = 64 # compiled rulesets kept, the oldest one goes when there are more
+
+    def __init__(self, tick_seconds :float = 0.01, bot_action_seconds :float = 0.05, latency_samples :int = 10000) -> None:
+        self.game_loop = GameLoop(tick_seconds, bot_action_seconds=bot_action_seconds, on_tick=self.send_updates)
+        self.connections = {}      # session id: connection of the client that created it
+        self.changes :dict = {}    # session id: the update with the changes of the current tick
+        self.moves_received :dict[int, list[float]] = collections.defaultdict(list) # session id: when the moves of this tick arrived
+        self.move_latencies = collections.deque(maxlen=latency_samples) # seconds
+        self.rulesets = {} # parameters: ruleset, compiled once for all the sessions with the same rules
+        self.next_session_id = 1
+        self.moves = 0
+        self.messages_seconds = 0.0 # busy handling messages
+        self.t_start = perf_counter()
+
+    def _add_change(self, session_id :int, data :dict) -> None:
+        """ It merges the ON_PLAYFIELD_UPDATED event (delta mode) into the update of the session for this tick """
+        update = self.changes.get(session_id)
+        if data["type"] == "full":
+            update = { "type": "full", "rows": [ "".join(row) for row in data["rows_from_the_bottom_up"] ] }
+        elif update is None:
+            update = { "type": "delta", "rows": {} }
+        if data["type"] == "delta":
+            for y, row in data["changed_rows"].items():
+                if update["type"] == "full":
+                    update["rows"][y - 1] = "".join(row)
+                else:
+                    update["rows"][str(y)] = "".join(row)
+        update["shape"] = data["falling_piece_shape"]
+        update["falling"] = data["falling_piece_coordinates"]
+        update["ghost"] = data["ghost_dropped_piece_coordinates"]
+        self.changes[session_id] = update
+
+    def close_connection(self, connection :object) -> None:
+        """ The sessions of a client that is gone """
+        for session_id in [ session_id for session_id, owner in self.connections.items() if owner is connection ]:
+            self.close_session(session_id)
+
+    def close_session(self, session_id :int) -> None:
+        self.game_loop.remove_session(session_id)
+        del self.connections[session_id]
+        self.changes.pop(session_id, None)
+        self.moves_received.pop(session_id, None)
+
+    def create_session(self, connection :object, weights :dict = None, seed :int = None, gravity_speed :int = None,
+        ruleset_parameters :dict = None) -> int:
+        """ It raises ValueError if a parameter is not valid, before anything is created """
+        _check_session_parameters(weights, seed, gravity_speed)
+        ruleset = self.get_ruleset(ruleset_parameters) if ruleset_parameters else None
+        session_id = self.next_session_id
+        session = GameSession(session_id, weights, seed, gravity_speed, ruleset)
+        self.next_session_id += 1
+        session.engine.delta_on_playfield_updated_event = True
+        session.engine.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, lambda data: self._add_change(session_id, data))
+        self.connections[session_id] = connection
+        self.game_loop.add_session(session) # new game: the first full update goes in the next tick
+        return session_id
+
+    def get_ruleset(self, parameters :dict) -> Ruleset:
+        ruleset_parameters = ("columns", "rows", "hidden_top_rows", "starting_x", "starting_y", "gravity_speed")
+        if not isinstance(parameters, dict) or not all(name in ruleset_parameters and _is_integer(value) for name, value in parameters.items()):
+            raise ValueError(f"The ruleset can only have the integers {', '.join(ruleset_parameters)}")
+        if parameters.get("columns", 0) > self.max_columns or parameters.get("rows", 0) > self.max_rows:
+            raise ValueError(f"The board can have at most {self.max_columns} columns and {self.max_rows} rows")
+        if "gravity_speed" in parameters:
+            _check_session_parameters(None, None, parameters["gravity_speed"])
+        key = tuple(sorted(parameters.items()))
+        if key not in self.rulesets:
+            if len(self.rulesets) >= self.max_rulesets:
+                del self.rulesets[next(iter(self.rulesets))]
+            self.rulesets[key] = Ruleset(**parameters)
+        return self.rulesets[key]
+
+    def get_statistics(self) -> dict:
+        seconds = perf_counter() - self.t_start
+        cpu_utilization = (self.game_loop.busy_seconds + self.messages_seconds) / seconds if seconds > 0 else 0.0
+        sessions = len(self.game_loop.sessions)
+        return {
+            "sessions":           sessions,
+            "moves":              self.moves,
+            "ticks":              self.game_loop.ticks,
+            "seconds":            seconds,
+            "cpu_utilization":    cpu_utilization,
+            "sessions_per_core":  sessions / cpu_utilization if cpu_utilization > 0 else None,
+            "move_latency":       get_latency_statistics(self.move_latencies),
+            "scheduling_latency": self.game_loop.get_scheduling_latency()
+        }
+
+    async def handle_connection(self, reader :asyncio.StreamReader, writer :asyncio.StreamWriter) -> None:
+        connection = StreamConnection(writer)
+        try:
+            while line := await reader.readline():
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    message = None
+                if not isinstance(message, dict):
+                    connection.send({ "error": "The messages have to be JSON objects, one per line" })
+                    continue
+                self.handle_message(connection, message)
+                await writer.drain() # if the client doesn't read we stop reading from it
+        except ConnectionError:
+            pass
+        finally:
+            self.close_connection(connection)
+            writer.close()
+
+    def handle_message(self, connection :object, message :dict) -> None:
+        t_start = perf_counter()
+        message_id = message.get("id")
+        try:
+            command = message.get("command")
+            if command == "move":
+                session_id = message["session"]
+                if self.connections.get(session_id) is not connection:
+                    raise ValueError(f"There is no session {session_id}")
+                self.game_loop.send_input(session_id, message["action"])
+                self.moves_received[session_id].append(t_start)
+                self.moves += 1
+            elif command == "create":
+                session_id = self.create_session(connection, message.get("weights"), message.get("seed"), message.get("gravity_speed"),
+                                                 message.get("ruleset"))
+                connection.send({ "id": message_id, "session": session_id })
+            elif command == "close":
+                session_id = message["session"]
+                if self.connections.get(session_id) is not connection:
+                    raise ValueError(f"There is no session {session_id}")
+                self.close_session(session_id)
+                connection.send({ "id": message_id, "session": session_id })
+            elif command == "statistics":
+                connection.send({ "id": message_id, "statistics": self.get_statistics() })
+            else:
+                raise ValueError(f"Unknown command {command}")
+        except (KeyError, TypeError, ValueError) as error: # e.g. a missing field, a session that is a list...
+            connection.send({ "id": message_id, "error": str(error) })
+        self.messages_seconds += perf_counter() - t_start
+
+    async def run(self, host :str = "127.0.0.1", port :int = 0, path :str = None) -> None:
+        """ Serving clients on TCP (or a Unix socket with path) until the game loop is stopped """
+        if path:
+            server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            print(f'Serving on {", ".join(str(socket.getsockname()) for socket in server.sockets)}')
+            await self.game_loop.run()
+
+    def send_updates(self) -> None:
+        """ After every tick: the changes of the sessions to their clients, and the latency of the moves played """
+        for session_id in self.moves_received:
+            self.changes.setdefault(session_id, { "type": "delta", "rows": {} })
+        now = perf_counter()
+        for session_id, update in self.changes.items():
+            session = self.game_loop.sessions[session_id]
+            if "shape" not in update:
+                falling_piece = session.engine.falling_piece
+                update["shape"] = str(falling_piece.shape)
+                update["falling"] = falling_piece.get_current_absolute_coordinates()
+                update["ghost"] = session.engine.get_ghost_dropped_piece_coordinates()
+            update["session"] = session_id
+            update["tick"] = self.game_loop.ticks
+            update["moves"] = session.actions_played
+            update["lines_cleared"] = session.lines_cleared
+            update["game_over"] = session.is_game_over
+            self.connections[session_id].send(update)
+        for received in self.moves_received.values():
+            self.move_latencies.extend(now - t_received for t_received in received)
+        self.changes = {}
+        self.moves_received.clear()
+
+class LocalClient:
+    """ A client in the same process as the server, it talks to it with the same messages but without any socket """
+
+    def __init__(self, server :GameServer) -> None:
+        self.server = server
+        self.connection = LocalConnection()
+        self.next_message_id = 1
+        self.states :dict[int, dict] = {} # session id: state (see apply_update)
+
+    def close_session(self, session_id :int) -> dict:
+        return self.send({ "command": "close", "session": session_id })
+
+    def create_session(self, weights :dict = None, seed :int = None, gravity_speed :int = None, ruleset :dict = None) -> int:
+        """ ruleset are the parameters of the rules, see GameServer.get_ruleset """
+        reply = self.send({ "command": "create", "weights": weights, "seed": seed, "gravity_speed": gravity_speed, "ruleset": ruleset })
+        return reply["session"]
+
+    def get_statistics(self) -> dict:
+        return self.send({ "command": "statistics" })["statistics"]
+
+    def move(self, session_id :int, action :str) -> None:
+        """ Its update comes after the next tick, see receive_update """
+        self.send({ "command": "move", "session": session_id, "action": action })
+
+    async def receive_update(self) -> dict:
+        """ The next update of any session of this client, which is already applied to its state """
+        update = await self.connection.updates.get()
+        self.states[update["session"]] = apply_update(self.states.get(update["session"]), update)
+        return update
+
+    def send(self, message :dict) -> dict:
+        """ It returns the reply of the server (None for the moves, unless there is an error) """
+        message["id"] = self.next_message_id
+        self.next_message_id += 1
+        self.server.handle_message(self.connection, message)
+        reply = self.connection.replies.popleft() if self.connection.replies else None
+        if reply and "error" in reply:
+            raise ValueError(reply["error"])
+        return reply
+
+async def simulate_clients(server :GameServer, clients :int, seconds :float, moves_per_second :float, seed :int = 7) -> dict:
+    """ Every client has a human session playing random moves, all of them in the same process as the server """
+    randomizer = random.Random(seed)
+    local_clients = [ LocalClient(server) for _ in range(clients) ]
+    session_ids = [ local_client.create_session(seed=randomizer.randrange(2**32)) for local_client in local_clients ]
+
+    async def play(local_client :LocalClient, session_id :int) -> None:
+        while server.game_loop.is_running:
+            await asyncio.sleep(randomizer.expovariate(moves_per_second))
+            if session_id in server.game_loop.sessions and not server.game_loop.sessions[session_id].is_game_over:
+                local_client.move(session_id, randomizer.choice(list(GameSession.actions)))
+            while not local_client.connection.updates.empty():
+                await local_client.receive_update()
+
+    game_loop_task = asyncio.create_task(server.game_loop.run())
+    await asyncio.sleep(0) # so the game loop is running
+    players = [ asyncio.create_task(play(local_client, session_id)) for local_client, session_id in zip(local_clients, session_ids) ]
+    await asyncio.sleep(seconds)
+    statistics = server.get_statistics()
+    server.game_loop.stop()
+    await game_loop_task
+    await asyncio.gather(*players)
+    return statistics
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless Tetris game server (JSON lines)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--unix", help="path of a Unix socket instead of TCP")
+    parser.add_argument("--tick", type=float, default=0.01, help="seconds per tick")
+    parser.add_argument("--simulate", type=int, help="number of local clients to simulate instead of serving")
+    parser.add_argument("--seconds", type=float, default=10, help="of the simulation")
+    parser.add_argument("--moves-per-second", type=float, default=5, help="of every simulated client")
+    arguments = parser.parse_args()
+
+    game_server = GameServer(tick_seconds=arguments.tick)
+    if arguments.simulate:
+        statistics = asyncio.run(simulate_clients(game_server, arguments.simulate, arguments.seconds, arguments.moves_per_second))
+        move_latency = statistics["move_latency"]
+        print(f'{statistics["sessions"]} sessions, {statistics["moves"]} moves in {statistics["ticks"]} ticks, '
+              f'CPU {statistics["cpu_utilization"]:.1%}, {statistics["sessions_per_core"]:.0f} sessions per core')
+        print(f'Move latency: median {move_latency["median"]*1000:.2f} ms p99 {move_latency["p99"]*1000:.2f} ms '
+              f'max {move_latency["max"]*1000:.2f} ms')
+    else:
+        asyncio.run(game_server.run(arguments.host, arguments.port, arguments.unix))
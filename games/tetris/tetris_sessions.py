@@ -0,0 +1,315 @@
+"""
+Many headless Tetris games (sessions) in one process on a single asyncio event loop, without any Tk window.
+
+GameLoop is one task for all the sessions. In every tick (tick_seconds, 10 ms by default) it:
+    - plays the inputs that arrived for the sessions since the last tick (send_input, e.g. the keys of a human)
+    - expires the timers of the TimerWheel that are due: the gravity of every session and the movements of the bots
+
+The timers are in a hashed timing wheel instead of one asyncio task (or call_later) per game,
+so scheduling and expiring a timer is O(1) and a tick only touches the sessions that have something to do.
+
+A bot is a session with weights: its engine is a TetrisAgent and every bot_action_seconds it plays
+one movement of the best sequence for its falling piece (like a human pressing keys).
+
+Scheduling latency is how late every tick started compared to when it should have started,
+e.g. because the ticks before took too long or something else blocked the event loop (see get_scheduling_latency).
+
+Example (500 bots for 10 seconds):
+    python tetris_sessions.py --bots 500 --seconds 10
+"""
+
+import argparse
+import asyncio
+import collections
+import collections.abc
+import statistics
+from time import perf_counter
+from tetris_agent import TetrisAgent, example_weights
+from tetris_engine import PieceSource, Ruleset, TetrisEngine, default_ruleset
+
+def get_latency_statistics(latencies :collections.abc.Iterable) -> dict:
+    """ Number of samples and mean, median, 99th percentile and max of them (seconds) """
+    latencies = sorted(latencies)
+    if not latencies:
+        return { "samples": 0, "mean": 0.0, "median": 0.0, "p99": 0.0, "max": 0.0 }
+    return {
+        "samples": len(latencies),
+        "mean":    statistics.fmean(latencies),
+        "median":  latencies[len(latencies) // 2],
+        "p99":     latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max":     latencies[-1]
+    }
+
+class TimerWheel:
+    """
+    The timers are in a ring of slots, one slot per tick. A timer due in more ticks than slots stays
+    in its slot some rounds of the wheel. Cancelled timers are only marked and removed when their slot comes
+    """
+
+    def __init__(self, slots :int = 256) -> None:
+        self.slots :list[list[list]] = [ [] for _ in range(slots) ]
+        self.current_tick = 0
+
+    def advance(self) -> int:
+        """ Next tick: it calls the timers due and returns how many """
+        self.current_tick += 1
+        index = self.current_tick % len(self.slots)
+        due = []
+        remaining = []
+        for timer in self.slots[index]:
+            if timer[1] is None:
+                continue # cancelled
+            if timer[0] > 0:
+                timer[0] -= 1
+                remaining.append(timer)
+            else:
+                due.append(timer)
+        self.slots[index] = remaining
+        for timer in due:
+            callback = timer[1]
+            timer[1] = None
+            callback()
+        return len(due)
+
+    def cancel(self, timer :list) -> None:
+        if timer:
+            timer[1] = None
+
+    def schedule(self, ticks :int, callback :object) -> list:
+        """ callback() is called after ticks ticks (at least 1), it returns the timer to cancel it """
+        ticks = max(1, ticks)
+        timer = [ (ticks - 1) // len(self.slots), callback ] # rounds of the wheel before it is due, callback
+        self.slots[(self.current_tick + ticks) % len(self.slots)].append(timer)
+        return timer
+
+class GameSession:
+
+    actions = {
+        # input: method of the engine
+        "left":         "move_left",
+        "right":        "move_right",
+        "down":         "move_down",
+        "drop":         "drop",
+        "rotate_left":  "rotate_left",
+        "rotate_right": "rotate_right"
+    }
+
+    bot_actions = {
+        TetrisAgent.GameAction.MOVE_LEFT:    "left",
+        TetrisAgent.GameAction.MOVE_RIGHT:   "right",
+        TetrisAgent.GameAction.ROTATE_LEFT:  "rotate_left",
+        TetrisAgent.GameAction.ROTATE_RIGHT: "rotate_right",
+        TetrisAgent.GameAction.DROP:         "drop"
+    }
+
+    def __init__(self, session_id :object, weights :dict = None, seed :int = None, gravity_speed :int = None, ruleset :Ruleset = None) -> None:
+        """
+        :param weights: for a bot (see TetrisAgent.calculate_heuristics), None for a human sending the inputs
+        :param seed: of the pieces of the game
+        :param gravity_speed: ms between the moves down of the falling piece, by default the one of the ruleset
+        :param ruleset: every session can have its own rules, by default the ones of the config
+        """
+        self.session_id = session_id
+        self.weights = weights
+        ruleset = ruleset or default_ruleset
+        if weights:
+            self.engine = TetrisAgent(seed=seed, ruleset=ruleset)
+        else:
+            self.engine = TetrisEngine(piece_source=PieceSource(seed=seed, shapes=ruleset.shapes), ruleset=ruleset)
+        self.engine.bind_event(TetrisEngine.Events.ON_LINES_CLEARED, self.update_lines_cleared_counter)
+        self.engine.bind_event(TetrisEngine.Events.ON_GAME_OVER, self.game_over)
+        self.gravity_speed = gravity_speed or ruleset.gravity_speed
+
+        self.inputs = collections.deque() # the ones not played yet
+        self.lines_cleared = 0
+        self.actions_played = 0
+        self.is_game_over = False
+        self.has_ended = False # the game loop already knows about the game over
+        self.planned_piece = None # for a bot, the piece (shapes given by the piece source) of the inputs
+        self.gravity_timer = None
+        self.bot_timer = None
+
+    def game_over(self) -> None:
+        self.is_game_over = True
+
+    def has_new_piece(self) -> bool:
+        """ For a bot: the falling piece is not the one of its inputs anymore (e.g. gravity locked it before the drop) """
+        return self.planned_piece != self.engine.piece_source.shapes_given
+
+    def is_bot(self) -> bool:
+        return self.weights is not None
+
+    def play_input(self, action :str) -> None:
+        if self.is_game_over:
+            return
+        getattr(self.engine, self.actions[action])()
+        self.actions_played += 1
+
+    def play_inputs(self) -> None:
+        while self.inputs and not self.is_game_over:
+            self.play_input(self.inputs.popleft())
+
+    def plan_bot_inputs(self) -> None:
+        """ The movements of the best sequence for the falling piece, instead of the ones left (if any) """
+        best_sequence = self.engine.get_best_sequence(self.engine.get_possible_placements(), self.weights)
+        self.inputs.clear()
+        self.inputs.extend(self.bot_actions[game_action] for game_action in best_sequence)
+        self.planned_piece = self.engine.piece_source.shapes_given
+
+    def update_lines_cleared_counter(self, lines_cleared :int) -> None:
+        self.lines_cleared += lines_cleared
+
+class GameLoop:
+
+    def __init__(self, tick_seconds :float = 0.01, wheel_slots :int = 256, bot_action_seconds :float = 0.05,
+        latency_samples :int = 10000, on_game_over :object = None, on_tick :object = None) -> None:
+        """
+        :param tick_seconds: how often the loop plays the inputs and the timers due
+        :param bot_action_seconds: time between two movements of a bot
+        :param latency_samples: the scheduling latency is from the last ticks only
+        :param on_game_over: function(session) called when a session reaches game over
+        :param on_tick: function() called after every tick
+        """
+        self.tick_seconds = tick_seconds
+        self.wheel = TimerWheel(wheel_slots)
+        self.bot_action_ticks = self.get_ticks(bot_action_seconds)
+        self.on_game_over = on_game_over
+        self.on_tick = on_tick
+        self.max_catch_up_ticks = 10 # if we are later than this we skip the ticks instead of playing them all at once
+
+        self.sessions :dict[object, GameSession] = {}
+        self.sessions_with_inputs :set[GameSession] = set()
+        self.is_running = False
+        self.ticks = 0
+        self.ticks_skipped = 0
+        self.busy_seconds = 0.0 # in the ticks, the rest of the time the event loop is free for other tasks
+        self.latencies = collections.deque(maxlen=latency_samples) # seconds
+
+    def _end_session_if_game_over(self, session :GameSession) -> None:
+        """ Only the first time, the inputs that arrive later are not played (see send_input) """
+        if not session.is_game_over or session.has_ended:
+            return
+        session.has_ended = True
+        session.inputs.clear()
+        self.wheel.cancel(session.gravity_timer)
+        self.wheel.cancel(session.bot_timer)
+        session.gravity_timer = session.bot_timer = None
+        if self.on_game_over:
+            self.on_game_over(session)
+
+    def _execute_bot_action(self, session :GameSession) -> None:
+        if not session.inputs or session.has_new_piece():
+            session.plan_bot_inputs() # the plan is always from the spawn of the piece, see get_possible_placements
+        if session.inputs:
+            session.play_input(session.inputs.popleft())
+        if session.is_game_over:
+            self._end_session_if_game_over(session)
+        else:
+            session.bot_timer = self.wheel.schedule(self.bot_action_ticks, lambda: self._execute_bot_action(session))
+
+    def _execute_gravity(self, session :GameSession) -> None:
+        session.engine.move_down()
+        if session.is_game_over:
+            self._end_session_if_game_over(session)
+        else:
+            session.gravity_timer = self.wheel.schedule(self.get_ticks(session.gravity_speed / 1000), lambda: self._execute_gravity(session))
+
+    def add_session(self, session :GameSession) -> GameSession:
+        if session.session_id in self.sessions:
+            raise ValueError(f"There is already a session {session.session_id}")
+        self.sessions[session.session_id] = session
+        session.engine.new_game()
+        session.gravity_timer = self.wheel.schedule(self.get_ticks(session.gravity_speed / 1000), lambda: self._execute_gravity(session))
+        if session.is_bot():
+            # The bots don't start all in the same tick, so they don't think all at the same time either
+            first_action_ticks = 1 + len(self.sessions) % self.bot_action_ticks
+            session.bot_timer = self.wheel.schedule(first_action_ticks, lambda: self._execute_bot_action(session))
+        return session
+
+    def get_scheduling_latency(self) -> dict:
+        """ Seconds that the last ticks started late, see get_latency_statistics """
+        return get_latency_statistics(self.latencies)
+
+    def get_ticks(self, seconds :float) -> int:
+        return max(1, round(seconds / self.tick_seconds))
+
+    def remove_session(self, session_id :object) -> GameSession:
+        session = self.sessions.pop(session_id)
+        self.wheel.cancel(session.gravity_timer)
+        self.wheel.cancel(session.bot_timer)
+        session.gravity_timer = session.bot_timer = None
+        self.sessions_with_inputs.discard(session)
+        return session
+
+    async def run(self, ticks :int = None) -> None:
+        """ Until stop is called (or after some ticks) """
+        event_loop = asyncio.get_running_loop()
+        self.is_running = True
+        next_tick_time = event_loop.time() + self.tick_seconds
+        ticks_to_run = ticks
+        while self.is_running and (ticks_to_run is None or ticks_to_run > 0):
+            await asyncio.sleep(max(0.0, next_tick_time - event_loop.time()))
+            now = event_loop.time()
+            self.latencies.append(now - next_tick_time)
+
+            # The ticks we are late (if any) are played now, unless we are so late that it is better to skip them
+            late_ticks = int((now - next_tick_time) / self.tick_seconds)
+            if late_ticks > self.max_catch_up_ticks:
+                self.ticks_skipped += late_ticks
+                next_tick_time += late_ticks * self.tick_seconds
+                if ticks_to_run is not None:
+                    ticks_to_run -= late_ticks
+                late_ticks = 0
+            for _ in range(late_ticks + 1 if ticks_to_run is None else min(late_ticks + 1, ticks_to_run)):
+                self.tick()
+                next_tick_time += self.tick_seconds
+                if ticks_to_run is not None:
+                    ticks_to_run -= 1
+        self.is_running = False
+
+    def send_input(self, session_id :object, action :str) -> None:
+        """ It is played in the next tick """
+        if action not in GameSession.actions:
+            raise ValueError(f"Unknown input {action}")
+        session = self.sessions[session_id]
+        if session.is_game_over:
+            raise ValueError(f"The game of the session {session_id} is over")
+        session.inputs.append(action)
+        self.sessions_with_inputs.add(session)
+
+    def stop(self) -> None:
+        self.is_running = False
+
+    def tick(self) -> None:
+        t_start = perf_counter()
+        sessions_with_inputs = self.sessions_with_inputs
+        self.sessions_with_inputs = set()
+        for session in sessions_with_inputs:
+            session.play_inputs()
+            self._end_session_if_game_over(session)
+        self.wheel.advance()
+        self.ticks += 1
+        if self.on_tick:
+            self.on_tick()
+        self.busy_seconds += perf_counter() - t_start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless Tetris bots on one asyncio event loop")
+    parser.add_argument("--bots", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--tick", type=float, default=0.01, help="seconds per tick")
+    arguments = parser.parse_args()
+
+    game_loop = GameLoop(tick_seconds=arguments.tick)
+    for bot in range(arguments.bots):
+        game_loop.add_session(GameSession(bot, example_weights, seed=bot))
+
+    asyncio.run(game_loop.run(round(arguments.seconds / arguments.tick)))
+
+    latency = game_loop.get_scheduling_latency()
+    sessions = game_loop.sessions.values()
+    print(f'{len(sessions)} sessions, {sum(session.actions_played for session in sessions)} movements, '
+          f'{sum(session.lines_cleared for session in sessions)} lines cleared, '
+          f'{sum(session.is_game_over for session in sessions)} game over')
+    print(f'Scheduling latency of {latency["samples"]} ticks: mean {latency["mean"]*1000:.2f} ms median {latency["median"]*1000:.2f} ms '
+          f'p99 {latency["p99"]*1000:.2f} ms max {latency["max"]*1000:.2f} ms, {game_loop.ticks_skipped} ticks skipped')
@@ -1,5 +1,27 @@
-from tetris_agent import TetrisAgent, TetrominoShape
+from tetris_agent import TetrisAgent, TetrominoShape, example_weights
+from tetris_engine import PieceSource, Playfield, Ruleset, TetrisEngine, config, orientation_table
+from tetris_frames import FrameRingBuffer
+from tetris_genetic_algorithm import GeneticAlgorithm
+import tetris_benchmark
+from tetris_profiler import AgentProfiler
+from tetris_record import GameRecordFile, GameRecordWriter, read_records, replay_record
+from tetris_server import GameServer, LocalClient
+from tetris_sessions import GameLoop, GameSession, TimerWheel
+import asyncio
+import json
+import os
+import tempfile
+import io
+import random
+import threading
 import unittest
+try:
+    import numpy
+    import tetris_numpy
+    from tetris_batch import BatchTetrisSimulator
+    from tetris_vector_env import TetrisVectorEnv
+except ImportError:
+    numpy = None
 
 # mainly tests to make sure that the playfield statistics algorithm is correct
 # and to avoid having a big comment explaining how we calculate the statistics
@@ -30,8 +52,19 @@ playfield_test = [
     [ 'S S • O O S S T T T' ]  # row  1
 ]
 
+# the weights of our example game, the ones we use in most of the tests
+weights = example_weights
+
 class TestTetris(unittest.TestCase):
 
+    def copy_frame(self, frame :dict) -> dict:
+        # FrameRingBuffer returns always the same frame, with the rows as views of its copy of the shared memory
+        if frame is None:
+            return None
+        frame = dict(frame)
+        frame["rows_from_the_bottom_up"] = [ str(row, "ascii") for row in frame["rows_from_the_bottom_up"] ]
+        return frame
+
     def get_playfield_statistics_from_debug_rows(self, debug_rows :list[list[str]]) -> dict:
         rows = self.transform_debug_rows_to_playfield_rows(debug_rows)
         agent = TetrisAgent()
@@ -208,5 +241,863 @@ class TestTetris(unittest.TestCase):
         ]
         self.assertEqual(expected_movement_symbols, actual_movement_symbols)  
 
+    def test_06_playfield_row_masks_and_full_lines(self):
+
+        # arrange
+        scenario = [
+            ['• • • • • • • • • •'],
+            ['I I I I I I I I I I'],
+            ['• S S Z • • • • • I'],
+            ['I I I I I I I I I I']
+        ]
+        rows = self.transform_debug_rows_to_playfield_rows(scenario)
+        agent = TetrisAgent()
+        agent.playfield.set_all_rows(rows)
+
+        # act
+        row_masks_before = agent.playfield.get_all_row_masks()[:3]
+        lines_cleared = agent.playfield.clear_full_lines()
+
+        # assert
+        self.assertEqual((0b1111111111, 0b1000001110, 0b1111111111), row_masks_before)
+        self.assertEqual(2, lines_cleared)
+        self.assertEqual(0b1000001110, agent.playfield.get_row_mask(1))
+        self.assertEqual([' ', 'S', 'S', 'Z', ' ', ' ', ' ', ' ', ' ', 'I'], agent.playfield.get_row(1))
+        self.assertTrue(all(mask == 0 for mask in agent.playfield.get_all_row_masks()[1:]))
+        self.assertFalse(agent.playfield.are_blocks_available([0b11], 2, 1, 2))
+        self.assertTrue(agent.playfield.are_blocks_available([0b11], 5, 1, 2))
+        self.assertFalse(agent.playfield.are_blocks_available([0b11], 10, 1, 2)) # out of the right wall
+
+    def test_07_orientation_table(self):
+
+        # act
+        t_shape = orientation_table[(TetrominoShape.T_SHAPE, 0)]
+        j_shape = orientation_table[(TetrominoShape.J_SHAPE, 90)]
+        o_shape_0 = orientation_table[(TetrominoShape.O_SHAPE, 0)]
+        o_shape_270 = orientation_table[(TetrominoShape.O_SHAPE, 270)]
+
+        # assert
+        self.assertEqual(7 * 4, len(orientation_table))
+        self.assertEqual((0b111, 0b010), t_shape.row_masks)
+        self.assertEqual((0, 0, 0), t_shape.bottom_profile)
+        self.assertEqual((-1, 1, 0, 1), (t_shape.min_relative_x, t_shape.max_relative_x, t_shape.min_relative_y, t_shape.max_relative_y))
+        self.assertEqual((0b01, 0b01, 0b11), j_shape.row_masks)
+        self.assertEqual((0, 2), j_shape.bottom_profile)
+        self.assertEqual((2, 3), (j_shape.width, j_shape.height))
+        self.assertEqual(o_shape_0.relative_coordinates, o_shape_270.relative_coordinates)
+
+    def test_08_headless_placement(self):
+
+        # arrange
+        scenario = [
+            ['• • • • • • • • • I'],
+            ['I I I I • • I I • I']
+        ]
+        agent = TetrisAgent()
+        agent.playfield.set_all_rows(self.transform_debug_rows_to_playfield_rows(scenario))
+        falling_piece_before = str(agent.falling_piece)
+
+        # act
+        blocked_by_the_wall = agent.place(TetrominoShape.I_SHAPE, 0, 10)
+        o_shape = agent.place(TetrominoShape.O_SHAPE, 0, 5)   # it fills the gap in the columns 5 and 6
+        i_shape = agent.place(TetrominoShape.I_SHAPE, 90, 9)  # vertical, it fills the column 9 and makes a line
+
+        # assert
+        self.assertIsNone(blocked_by_the_wall)
+        self.assertEqual((0, False), o_shape[:2])
+        self.assertEqual((0b1011111111, 0b1000110000), o_shape[2][:2])
+        self.assertEqual((1, False), i_shape[:2])
+        self.assertEqual((0b1100110000, 0b0100000000, 0b0100000000, 0), i_shape[2][:4])
+        self.assertEqual([' ', 'O', 'O', ' ', ' ', 'I', 'I'], agent.playfield.get_row(1)[3:])
+        self.assertEqual(falling_piece_before, str(agent.falling_piece))
+
+    def test_09_snapshot_and_restore(self):
+
+        # arrange
+        scenario = [
+            ['• • • • • • • • • I'],
+            ['I I I I • • I I • I']
+        ]
+        agent = TetrisAgent()
+        agent.playfield.set_all_rows(self.transform_debug_rows_to_playfield_rows(scenario))
+        rows_before = agent.playfield.get_all_rows()
+        snapshot = agent.get_snapshot()
+
+        # act
+        agent.place(TetrominoShape.O_SHAPE, 0, 5)
+        agent.place(TetrominoShape.I_SHAPE, 90, 9)
+        agent.rotate_left()
+        agent.move_right()
+        agent.restore_snapshot(snapshot)
+
+        # assert
+        self.assertEqual(rows_before, agent.playfield.get_all_rows())
+        self.assertEqual(0b1011001111, agent.playfield.get_row_mask(1))
+        self.assertEqual(snapshot, agent.get_snapshot())
+        self.assertEqual('L - 0°', str(agent.falling_piece))
+
+    def test_10_possible_placements_without_duplicates(self):
+
+        # arrange
+        agent = TetrisAgent()
+        shapes = [TetrominoShape.I_SHAPE, TetrominoShape.J_SHAPE, TetrominoShape.L_SHAPE, TetrominoShape.O_SHAPE,
+                  TetrominoShape.S_SHAPE, TetrominoShape.T_SHAPE, TetrominoShape.Z_SHAPE]
+
+        # act
+        number_of_placements = {}
+        for shape in shapes:
+            agent.falling_piece.set_new_falling_piece(shape)
+            number_of_placements[str(shape)] = len(agent.get_possible_placements())
+        agent.falling_piece.set_new_falling_piece(TetrominoShape.O_SHAPE)
+        first_o_shape_placements = [ ' '.join([str(movement) for movement in sequence]) for sequence, _, _ in agent.get_possible_placements()[:3] ]
+
+        # assert
+        # Out of the 44 sequences, the ones going through the walls and the ones ending in the same place are gone
+        self.assertDictEqual({'I': 17, 'J': 34, 'L': 34, 'O': 9, 'S': 17, 'T': 34, 'Z': 17}, number_of_placements)
+        self.assertEqual(['⟱', '🡰 ⟱', '🡲 ⟱'], first_o_shape_placements)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_11_numpy_evaluator_same_best_sequence(self):
+
+        # arrange
+        scenarios = [
+            playfield_test,
+            [['• • • • • S S • • I'], ['• • • Z S S • • • I']],
+            [['• • S S • • • • • I'], ['• S S Z • • • • • I']],
+            [['• • • S • • • • • I'], ['• • • S S • • • • I'], ['• • • Z S • • • • I']]
+        ]
+        agent = TetrisAgent()
+        numpy_agent = TetrisAgent(use_numpy=True)
+
+        shapes = [TetrominoShape.I_SHAPE, TetrominoShape.J_SHAPE, TetrominoShape.L_SHAPE, TetrominoShape.O_SHAPE,
+                  TetrominoShape.S_SHAPE, TetrominoShape.T_SHAPE, TetrominoShape.Z_SHAPE]
+
+        for scenario in scenarios:
+            for shape in shapes:
+                # act
+                best_sequences = []
+                for tetris_agent in (agent, numpy_agent):
+                    tetris_agent.playfield.set_all_rows(self.transform_debug_rows_to_playfield_rows(scenario))
+                    tetris_agent.falling_piece.set_new_falling_piece(shape)
+                    best_sequences.append(tetris_agent.get_best_sequence(tetris_agent.get_possible_placements(), weights))
+
+                # assert
+                self.assertEqual(best_sequences[0], best_sequences[1])
+
+        numpy_agent.playfield.set_all_rows(self.transform_debug_rows_to_playfield_rows(playfield_test))
+        row_masks = numpy.array([numpy_agent.playfield.get_all_row_masks()], dtype=numpy.uint16)
+        statistics = tetris_numpy.get_playfield_statistics(row_masks, 10)
+        self.assertEqual((46, 6, 9), (statistics["aggregated_height"][0], statistics["total_holes"][0], statistics["bumpiness"][0]))
+
+    def test_12_playfield_statistics_updated_incrementally(self):
+        """ After every placement, line cleared or block removed the statistics are the same as counting from scratch """
+
+        # arrange
+        agent = TetrisAgent()
+        playfield_from_scratch = Playfield(agent.playfield.columns, agent.playfield.rows, 2)
+        rng = random.Random(1)
+        placements_done = 0
+        total_lines_cleared = 0
+
+        # act
+        while placements_done < 300:
+            agent.falling_piece.set_new_falling_piece(rng.choice([shape for shape, _ in orientation_table]))
+            placements = agent.get_possible_placements()
+            if not placements:
+                agent.playfield.clear()
+                continue
+            if rng.random() < 0.8: # mostly the agent's choice so we also clear lines
+                best_sequence = agent.get_best_sequence(placements, weights)
+                _, angle, center_x = next(placement for placement in placements if placement[0] is best_sequence)
+            else:
+                _, angle, center_x = rng.choice(placements)
+            lines_cleared, is_game_over, _ = agent.place(agent.falling_piece.shape, angle, center_x)
+            total_lines_cleared += lines_cleared
+            if rng.random() < 0.2:
+                agent.playfield.set_block(rng.randint(1, 10), rng.randint(1, 5), TetrominoShape.NONE)
+            if is_game_over:
+                agent.playfield.clear()
+            placements_done += 1
+
+            # assert
+            playfield_from_scratch.set_all_rows(agent.playfield.get_all_rows())
+            self.assertEqual(playfield_from_scratch.column_heights, agent.playfield.column_heights)
+            self.assertEqual(playfield_from_scratch.column_holes, agent.playfield.column_holes)
+            self.assertEqual(playfield_from_scratch.row_fill_counts, agent.playfield.row_fill_counts)
+            column = [ row[0] for row in agent.playfield.get_all_rows() ]
+            self.assertEqual(agent.get_playfield_column_statistics(column, 1),
+                             (agent.playfield.column_heights[0], agent.playfield.column_holes[0]))
+
+        self.assertGreater(total_lines_cleared, 0)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_13_batch_simulator_plays_like_the_agent(self):
+
+        # arrange
+        rng = random.Random(2)
+        shapes = [ tetromino["shape"] for tetromino in config["tetrominoes"] ]
+        piece_streams = [ [ rng.randrange(len(shapes)) for _ in range(80) ] for _ in range(3) ]
+        weights_per_game = [
+            weights,
+            { "weight_aggregated_height": 3, "weight_total_holes": 1.1, "weight_bumpiness": 3,   "weight_lines_cleared": -10 },
+            { "weight_aggregated_height": 0, "weight_total_holes": 0,   "weight_bumpiness": 0,   "weight_lines_cleared":  10 } # it loses quickly
+        ]
+
+        # act
+        simulator = BatchTetrisSimulator(piece_streams, weights_per_game)
+        results = simulator.run()
+
+        # assert
+        for game, piece_stream in enumerate(piece_streams):
+            agent = TetrisAgent()
+            lines_cleared = 0
+            pieces_placed = 0
+            is_game_over = False
+            for index, shape_index in enumerate(piece_stream):
+                agent.falling_piece.set_new_falling_piece(shapes[shape_index])
+                placements = agent.get_possible_placements()
+                best_sequence = agent.get_best_sequence(placements, weights_per_game[game])
+                _, angle, center_x = next(placement for placement in placements if placement[0] is best_sequence)
+                next_shape = shapes[piece_stream[index + 1]] if index + 1 < len(piece_stream) else None
+                lines, is_game_over, _ = agent.place(shapes[shape_index], angle, center_x, next_shape)
+                lines_cleared += lines
+                pieces_placed += 1
+                if is_game_over and next_shape:
+                    break
+                is_game_over = False
+
+            self.assertEqual(lines_cleared, results["lines_cleared"][game])
+            self.assertEqual(pieces_placed, results["pieces_placed"][game])
+            self.assertEqual(is_game_over, results["is_game_over"][game])
+            self.assertEqual(agent.playfield.get_all_row_masks(), simulator.get_row_masks(game))
+
+        self.assertTrue(results["is_game_over"][2])
+
+    def test_14_genetic_algorithm_is_reproducible(self):
+
+        # arrange
+        genetic_algorithm_1 = GeneticAlgorithm(population_size=6, generations=2, games_per_individual=1,
+                                               max_number_of_movements=40, elitism=2, seed=3, processes=2)
+        genetic_algorithm_2 = GeneticAlgorithm(population_size=6, generations=2, games_per_individual=1,
+                                               max_number_of_movements=40, elitism=2, seed=3, processes=1)
+        genetic_algorithm_1.report = genetic_algorithm_2.report = lambda generation_statistics: None
+
+        # act
+        best_1 = genetic_algorithm_1.run()
+        best_2 = genetic_algorithm_2.run()
+
+        # assert
+        # Same seed, same results, no matter how many processes play the games
+        self.assertEqual(best_1, best_2)
+        self.assertEqual([ generation["mean_fitness"] for generation in genetic_algorithm_1.history ],
+                         [ generation["mean_fitness"] for generation in genetic_algorithm_2.history ])
+        self.assertEqual(2, len(genetic_algorithm_1.history))
+        self.assertGreaterEqual(genetic_algorithm_1.history[1]["best_fitness"], 0)
+        with self.assertRaises(ValueError):
+            GeneticAlgorithm(population_size=2, elitism=1, tournament_size=3) # it would fail after the first generation
+        with self.assertRaises(ValueError):
+            GeneticAlgorithm(population_size=4, elitism=4)
+
+    def test_15_frame_ring_buffer_keeps_the_last_frames(self):
+
+        # arrange
+        frames = []
+        frame_buffer = FrameRingBuffer.create(8, config["playfield"]["columns"], 20)
+        frame_buffer_reader = FrameRingBuffer.attach(frame_buffer.name)
+        agent = TetrisAgent()
+        agent.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, lambda data: (frames.append(data), frame_buffer.write_frame(data)))
+
+        # act
+        agent.play_game(weights, 20)
+        frames_read = []
+        while (frame := frame_buffer_reader.read_next_frame()):
+            frames_read.append(self.copy_frame(frame))
+        frame_buffer_reader.close()
+        frame_buffer.close()
+        frame_buffer.unlink()
+
+        # assert
+        # The reader was too slow (it started at the end) so only the last 8 frames are there
+        self.assertEqual(len(frames), frame_buffer_reader.frames_read)
+        self.assertEqual(len(frames) - 8, frame_buffer_reader.frames_dropped)
+        self.assertEqual(8, len(frames_read))
+        for frame, frame_read in zip(frames[-8:], frames_read):
+            self.assertEqual(frame["falling_piece_shape"], frame_read["falling_piece_shape"])
+            self.assertEqual(frame["falling_piece_coordinates"], frame_read["falling_piece_coordinates"])
+            self.assertEqual(frame["ghost_dropped_piece_coordinates"], frame_read["ghost_dropped_piece_coordinates"])
+            self.assertEqual([ "".join(row) for row in frame["rows_from_the_bottom_up"] ], frame_read["rows_from_the_bottom_up"])
+
+    def test_16_lookahead_clears_more_lines(self):
+
+        # arrange
+        agent = TetrisAgent(seed=4, lookahead=True)
+        playfield_snapshot = agent.playfield.get_snapshot()
+
+        # act
+        agent.get_best_sequence(agent.get_possible_placements(), weights)
+        playfield_after_search = agent.playfield.get_snapshot()
+        greedy_lines_cleared = sum([ TetrisAgent(seed=seed).play_game(weights, 400)[0] for seed in range(3) ])
+        lookahead_lines_cleared = sum([ TetrisAgent(seed=seed, lookahead=True).play_game(weights, 400)[0] for seed in range(3) ])
+
+        # assert
+        # The search leaves the playfield as it was, and knowing the next piece we clear more lines with the same pieces
+        self.assertEqual(playfield_snapshot, playfield_after_search)
+        self.assertEqual(agent.lookahead_width, agent.lookahead_statistics["cache_misses"])
+        self.assertGreater(lookahead_lines_cleared, greedy_lines_cleared)
+
+    def test_17_playfield_hash_is_updated(self):
+
+        # arrange
+        agent = TetrisAgent(seed=2)
+        playfield = Playfield(config["playfield"]["columns"], config["playfield"]["rows"], config["playfield"]["hidden_top_rows"])
+        empty_playfield_hash = agent.playfield.board_hash
+        total_lines_cleared = 0
+
+        # act
+        for _ in range(60):
+            best_sequence = agent.get_best_sequence(agent.get_possible_placements(), weights)
+            agent.lines_cleared = 0
+            agent.play_sequence(best_sequence)
+            total_lines_cleared += agent.lines_cleared
+
+            # assert
+            # Same as hashing all the rows from scratch, also when the rows come from set_all_rows
+            self.assertEqual(agent.playfield._get_hash(), agent.playfield.board_hash)
+            playfield.set_all_rows(agent.playfield.get_all_rows())
+            self.assertEqual(agent.playfield.board_hash, playfield.board_hash)
+            self.assertEqual(agent.playfield, playfield)
+
+        self.assertGreater(total_lines_cleared, 0)
+        playfield.set_block(1, 1, TetrominoShape.NONE if playfield.get_block(1, 1) != ' ' else TetrominoShape.I_SHAPE)
+        self.assertNotEqual(agent.playfield.board_hash, playfield.board_hash)
+        self.assertNotEqual(agent.playfield, playfield)
+        playfield.clear()
+        self.assertEqual(empty_playfield_hash, playfield.board_hash)
+
+    def test_18_beam_search_is_anytime(self):
+
+        # arrange
+        def play(agent :TetrisAgent) -> list:
+            sequences = []
+            for _ in range(20):
+                sequences.append(agent.get_best_sequence(agent.get_possible_placements(), weights))
+                agent.play_sequence(sequences[-1])
+            return sequences
+
+        # act
+        greedy_sequences = play(TetrisAgent(seed=1))
+        no_time_agent = TetrisAgent(seed=1, beam_search=True, beam_width=8, beam_depth=3, move_time_budget=0, preview_size=2)
+        no_time_sequences = play(no_time_agent)
+        agent = TetrisAgent(seed=1, beam_search=True, beam_width=4, beam_depth=3, move_time_budget=60) # the preview is 2 shapes
+        playfield_snapshot = agent.playfield.get_snapshot()
+        agent.get_best_sequence(agent.get_possible_placements(), weights)
+
+        # assert
+        # Without time only the first ply is done, which is the greedy agent, and the beam gets narrower
+        self.assertEqual(greedy_sequences, no_time_sequences)
+        self.assertEqual(1, no_time_agent.beam_search_statistics["depth_reached"])
+        self.assertEqual(1, no_time_agent.beam_width)
+        # With time all the plies are done: 1 board in the first one, 4 in the second one and 4 in the third one
+        self.assertEqual(playfield_snapshot, agent.playfield.get_snapshot())
+        self.assertEqual(3, agent.beam_search_statistics["depth_reached"])
+        self.assertEqual(9, agent.beam_search_statistics["nodes_expanded"])
+        self.assertEqual(4, agent.beam_search_statistics["beam_width"])
+        self.assertEqual(5, agent.beam_width)
+        self.assertEqual(2, len(agent.next_shapes))
+        with self.assertRaises(ValueError):
+            TetrisAgent(beam_search=True, beam_depth=3, preview_size=1) # it would never search the third ply
+
+    def test_19_piece_sources_do_not_interfere(self):
+
+        # arrange
+        random.seed(7)
+        shapes_with_global_seed = [ random.choice(PieceSource.shapes) for _ in range(50) ]
+        stream = PieceSource.get_stream(200, PieceSource.SEVEN_BAG, seed=5)
+
+        # act
+        agent_1 = TetrisAgent(seed=7)
+        agent_2 = TetrisAgent(seed=7)
+        shapes_1 = [ agent_1.get_next_shape() for _ in range(50) ]
+        random.seed(1) # nothing to do with the agents
+        shapes_2 = [ agent_2.get_next_shape() for _ in range(25) ] + [ agent_2.get_next_shape() for _ in range(25) ]
+        bag_source = PieceSource(PieceSource.SEVEN_BAG, seed=5)
+        bag_shapes = [ bag_source.get_next_shape() for _ in range(200) ]
+        result_1 = TetrisAgent(piece_source=PieceSource(PieceSource.STREAM, stream=stream)).play_game(weights, 300)
+        result_2 = TetrisAgent(piece_source=PieceSource(PieceSource.STREAM, stream=stream)).play_game(weights, 300)
+
+        # assert
+        # The first 2 shapes of every agent are the falling piece and the preview
+        self.assertEqual(shapes_with_global_seed[2:], shapes_1[:-2])
+        self.assertEqual(shapes_1, shapes_2)
+        self.assertEqual(bytes([ PieceSource.shapes.index(shape) for shape in bag_shapes ]), stream)
+        for bag in range(0, 196, 7):
+            self.assertEqual(set(PieceSource.shapes), set(bag_shapes[bag:bag + 7]))
+        self.assertEqual(result_1, result_2)
+        self.assertGreater(result_1[0], 0)
+
+    def test_20_benchmark_finds_regressions(self):
+
+        # arrange
+        baseline = { "workloads": {
+            "statistics": { "median": 1000 },
+            "placements": { "median": 1000 }
+        }}
+        results = { "workloads": {
+            "statistics": { "median": 950 },   # 5% slower
+            "placements": { "median": 850 },   # 15% slower
+            "greedy_games": { "median": 10 }    # not in the baseline
+        }}
+
+        # act
+        regressions = tetris_benchmark.compare_with_baseline(results, baseline, 0.1)
+        statistics_result = tetris_benchmark.run_workload("statistics", 2)
+
+        # assert
+        self.assertEqual(["placements"], regressions)
+        self.assertEqual("evaluations/s", statistics_result["unit"])
+        self.assertEqual(2, len(statistics_result["throughputs"]))
+        self.assertLessEqual(statistics_result["min"], statistics_result["median"])
+        self.assertLessEqual(statistics_result["median"], statistics_result["max"])
+
+    def test_21_profiler_counts_the_phases(self):
+
+        # arrange
+        events = []
+        profiler = AgentProfiler(callback=lambda event, statistics: events.append((event, statistics)))
+        agent = TetrisAgent(seed=3, profiler=profiler)
+        agent_without_profiler = TetrisAgent(seed=3)
+
+        # act
+        result = agent.play_game(weights, 200)
+        profiler.detach(agent)
+        result_without_profiler = agent_without_profiler.play_game(weights, 200)
+
+        # assert
+        # Without profiler (or after detaching it) the agent has only the methods of its class, and it plays the same
+        for attribute, method_name in AgentProfiler.phases.values():
+            self.assertNotIn(method_name, vars(profiler._get_owner(agent_without_profiler, attribute)))
+            self.assertNotIn(method_name, vars(profiler._get_owner(agent, attribute)))
+        self.assertEqual(result, result_without_profiler)
+
+        move_events = [ statistics for event, statistics in events if event == "move" ]
+        game_events = [ statistics for event, statistics in events if event == "game" ]
+        self.assertEqual(1, len(game_events))
+        self.assertEqual(len(move_events), game_events[0]["moves"])
+        for move in move_events:
+            self.assertEqual(1, move["sequence_generation"]["calls"])
+            self.assertEqual(1, move["sequence_playback"]["calls"])
+            self.assertGreater(move["placement"]["calls"], 0)
+            self.assertEqual(move["placement"]["calls"], move["statistics"]["calls"])
+            self.assertEqual(move["placement"]["calls"], move["heuristic_scoring"]["calls"])
+            self.assertEqual(move["placement"]["calls"] + 1, move["state_restore"]["calls"])
+        self.assertEqual(sum([ move["placement"]["calls"] for move in move_events ]), game_events[0]["placement"]["calls"])
+
+    def test_22_game_records_replay_the_same_games(self):
+
+        # arrange
+        file = io.BytesIO()
+        recorder = GameRecordWriter(file)
+        agent = TetrisAgent(seed=2, recorder=recorder)
+        results = [
+            agent.play_game(weights),
+            agent.play_game(weights, 300), # it goes on with the pieces of the same piece source
+            TetrisAgent(piece_source=PieceSource(PieceSource.SEVEN_BAG, seed=3), recorder=recorder).play_game(weights, 300)
+        ]
+
+        # act
+        records = read_records(file.getvalue())
+        replays = [ replay_record(record) for record in records ]
+        corrupted_data = bytearray(file.getvalue())
+        corrupted_data[55 + 2 * 6] ^= 0b00001000 # another rotation for a piece of the first game
+
+        # assert
+        self.assertEqual(3, recorder.games_written)
+        self.assertEqual([ 2, 2, 3 ], [ record.seed for record in records ])
+        self.assertEqual([ 0, records[0].trailer[0] ], [ record.shapes_skipped for record in records[:2] ])
+        self.assertEqual([ PieceSource.UNIFORM, PieceSource.UNIFORM, PieceSource.SEVEN_BAG ], [ record.piece_source_mode for record in records ])
+        self.assertEqual(weights, records[0].weights)
+        self.assertEqual([ result[0] for result in results ], [ replay["lines_cleared"] for replay in replays ])
+        self.assertEqual([ True, False, False ], [ replay["is_game_over"] for replay in replays ])
+        # 2 bytes per piece and a header, a trailer and a footer per game (the games are too short for keyframes)
+        self.assertEqual(2 * sum([ replay["pieces"] for replay in replays ]) + 3 * (55 + 1 + 18 + 8), len(file.getvalue()))
+        with self.assertRaises(ValueError):
+            replay_record(read_records(bytes(corrupted_data))[0])
+
+    def test_23_game_record_file_seeks_with_keyframes(self):
+
+        # arrange
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "games.ttrc")
+            with open(path, "wb") as file:
+                recorder = GameRecordWriter(file, keyframe_interval=50)
+                TetrisAgent(seed=2, recorder=recorder).play_game(weights)
+                TetrisAgent(seed=0, recorder=recorder).play_game(weights, 2000)
+                recorder.end_game = lambda *args: None # like a crash before the end of the game
+                TetrisAgent(seed=3, recorder=recorder).play_game(weights, 1000)
+                pieces_played = recorder.number_of_pieces
+                pieces_pending = len(recorder.pending) // 2
+
+            # act
+            with open(path, "rb") as file:
+                records_read = read_records(file.read())
+            empty_path = os.path.join(directory, "empty.ttrc")
+            open(empty_path, "wb").close()
+            empty_record_file = GameRecordFile(empty_path)
+            empty_records = len(empty_record_file)
+            empty_record_file.close()
+            record_file = GameRecordFile(path)
+            records = [ record_file.read_record(record_number) for record_number in range(len(record_file)) ]
+            keyframe_index = record_file.get_keyframe_index(1)
+            playfields = { piece_index: record_file.seek(1, piece_index).playfield for piece_index in (0, 49, 50, 51, 175) }
+            with self.assertRaises(IndexError): # after the last piece
+                record_file.seek(0, len(records[0].pieces) + 1)
+            cut_keyframe_index = record_file.get_keyframe_index(2)
+            cut_playfield = record_file.seek(2, 60).playfield
+            record_file.close()
+
+        # assert
+        self.assertEqual(3, len(records))
+        self.assertEqual(3, len(records_read))
+        self.assertEqual(0, empty_records)
+        # The pieces of the game that never ended were written with every keyframe, only the last ones were lost
+        self.assertIsNone(records[2].trailer)
+        self.assertGreater(pieces_played, 100)
+        self.assertEqual(pieces_played - pieces_pending, len(records[2].pieces))
+        self.assertEqual(0, len(records[2].pieces) % 50)
+        self.assertEqual(records[2].pieces, records_read[2].pieces)
+        self.assertEqual([ 50, 100 ], [ piece_index for piece_index, _ in cut_keyframe_index ][:2])
+        replay_record(records[2])
+        engine = TetrisEngine()
+        for shape, angle, center_x, _ in records[2].pieces[:60]:
+            engine.place(shape, angle, center_x)
+        self.assertEqual(engine.playfield.get_all_rows(), cut_playfield.get_all_rows())
+        self.assertEqual([ 50, 100, 150 ], list(records[1].keyframes)[:3])
+        self.assertEqual(list(records[1].keyframes), [ piece_index for piece_index, _ in keyframe_index ])
+        replay_record(records[1]) # it verifies the keyframes too
+        for piece_index, playfield in playfields.items():
+            engine = TetrisEngine()
+            for shape, angle, center_x, _ in records[1].pieces[:piece_index]:
+                engine.place(shape, angle, center_x)
+            self.assertEqual(engine.playfield.get_all_rows(), playfield.get_all_rows())
+            self.assertEqual(engine.playfield.board_hash, playfield.board_hash)
+
+    def test_24_delta_playfield_events_rebuild_the_full_ones(self):
+
+        # arrange
+        full_events = []
+        delta_events = []
+        full_agent = TetrisAgent(seed=5)
+        full_agent.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, full_events.append)
+        delta_agent = TetrisAgent(seed=5)
+        delta_agent.delta_on_playfield_updated_event = True
+        delta_agent.full_playfield_updated_event_interval = 40
+        delta_agent.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, delta_events.append)
+        frame_buffer = FrameRingBuffer.create(2048, config["playfield"]["columns"], 20)
+
+        # act
+        full_agent.play_game(weights, 400)
+        delta_agent.play_game(weights, 400)
+        playfield_data = None
+        rebuilt_events = []
+        for data in delta_events:
+            playfield_data = TetrisEngine.apply_playfield_updated_event(playfield_data, data)
+            rebuilt_event = { key: playfield_data[key] for key in full_events[0] if key != "type" }
+            rebuilt_event["rows_from_the_bottom_up"] = list(rebuilt_event["rows_from_the_bottom_up"]) # it keeps changing
+            rebuilt_events.append(rebuilt_event)
+            frame_buffer.write_frame(data)
+        frames = [ self.copy_frame(frame_buffer.read_frame(frame_number)) for frame_number in range(len(delta_events)) ]
+        frame = frame_buffer.read_frame(0)
+        rows_are_views = all(isinstance(row, memoryview) for row in frame["rows_from_the_bottom_up"])
+        same_frame = frame is frame_buffer.read_frame(1)
+        frame_buffer.close()
+        frame_buffer.unlink()
+
+        # assert
+        self.assertEqual(len(full_events), len(delta_events))
+        self.assertEqual([ { key: data[key] for key in data if key != "type" } for data in full_events ], rebuilt_events)
+        self.assertEqual([ [ "".join(row) for row in data["rows_from_the_bottom_up"] ] for data in full_events ],
+                         [ frame["rows_from_the_bottom_up"] for frame in frames ])
+        self.assertTrue(rows_are_views) # no rows are built for the UI
+        self.assertTrue(same_frame)
+        # Only the first event and one every 40 have all the rows, the others only the rows that changed (when a piece is locked)
+        self.assertEqual(list(range(0, len(delta_events), 40)), [ index for index, data in enumerate(delta_events) if data["type"] == "full" ])
+        rows_sent = sum([ len(data["changed_rows"] if data["type"] == "delta" else data["rows_from_the_bottom_up"]) for data in delta_events ])
+        self.assertLess(rows_sent, 20 * len(full_events) / 5)
+
+    def test_25_frame_ring_buffer_latest_frame_and_backpressure(self):
+
+        # arrange
+        frames = []
+        agent = TetrisAgent()
+        agent.bind_event(TetrisEngine.Events.ON_PLAYFIELD_UPDATED, frames.append)
+        agent.play_game(weights, 10)
+        stop_event = threading.Event()
+        frame_buffer = FrameRingBuffer.create(4, config["playfield"]["columns"], 20)
+        frame_buffer_writer = FrameRingBuffer.attach(frame_buffer.name, max_wait=0.02, stop_event=stop_event)
+
+        # act
+        for data in frames[:6]:
+            frame_buffer_writer.write_frame(data)
+        depth = frame_buffer.get_depth()
+        latest_frame = self.copy_frame(frame_buffer.read_latest_frame())
+        depth_after_reading = frame_buffer_writer.get_depth()
+        frames_waited = frame_buffer_writer.frames_waited
+        frames_dropped = frame_buffer.frames_dropped
+
+        stop_event.set()
+        for data in frames[6:12]:
+            frame_buffer_writer.write_frame(data)
+        next_frame = self.copy_frame(frame_buffer.read_next_frame())
+        frame_buffer_writer.close()
+        frame_buffer.close()
+        frame_buffer.unlink()
+
+        # assert
+        # The ring was full for the last 2 frames, the writer waited for them and then overwrote the oldest ones
+        self.assertEqual(6, depth)
+        self.assertEqual(2, frames_waited)
+        self.assertGreaterEqual(frame_buffer_writer.seconds_waited, 0.04)
+        # We jumped to the last frame, so nothing is waiting and the other 5 were dropped
+        self.assertEqual([ "".join(row) for row in frames[5]["rows_from_the_bottom_up"] ], latest_frame["rows_from_the_bottom_up"])
+        self.assertEqual(frames[5]["falling_piece_coordinates"], latest_frame["falling_piece_coordinates"])
+        self.assertEqual(0, depth_after_reading)
+        self.assertEqual(5, frames_dropped)
+        # With the stop event set the writer doesn't wait for us anymore
+        self.assertLess(frame_buffer_writer.seconds_waited, 0.04 + 2 * 0.02 + 0.02)
+        self.assertEqual(frames[8]["falling_piece_coordinates"], next_frame["falling_piece_coordinates"])
+        self.assertEqual(7, frame_buffer.frames_dropped)
+
+    def test_26_game_loop_drives_many_sessions_with_a_timer_wheel(self):
+
+        # arrange
+        timer_wheel = TimerWheel(slots=8)
+        fired = []
+        timer_wheel.schedule(3, lambda: fired.append((3, timer_wheel.current_tick)))
+        timer_wheel.schedule(20, lambda: fired.append((20, timer_wheel.current_tick))) # more than a round of the wheel
+        cancelled_timer = timer_wheel.schedule(3, lambda: fired.append(("cancelled", timer_wheel.current_tick)))
+        timer_wheel.cancel(cancelled_timer)
+
+        game_loop = GameLoop(tick_seconds=0.001, bot_action_seconds=0.001)
+        game_loop.max_catch_up_ticks = 1000 # all the ticks are played even in a slow computer
+        bots = [ game_loop.add_session(GameSession(f"bot {seed}", weights, seed=seed)) for seed in range(3) ]
+        human = game_loop.add_session(GameSession("human", seed=7, gravity_speed=5))
+        starting_y = human.engine.falling_piece.center_y
+
+        # act
+        for _ in range(25):
+            timer_wheel.advance()
+        game_loop.send_input("human", "left")
+        asyncio.run(game_loop.run(30))
+        human_y_after_gravity = human.engine.falling_piece.center_y
+        game_loop.send_input("human", "drop")
+        game_loop.tick()
+
+        games_over = []
+        short_game_loop = GameLoop(on_game_over=games_over.append)
+        loser = short_game_loop.add_session(GameSession("loser", seed=7))
+        for _ in range(40):
+            short_game_loop.send_input("loser", "drop") # in the same column it is game over before the 40th drop
+        for _ in range(5):
+            short_game_loop.tick()
+
+        late_bot = GameSession("late bot", weights, seed=1)
+        late_bot.plan_bot_inputs()
+        planned_for_the_spawned_piece = not late_bot.has_new_piece()
+        late_bot.engine.drop() # like the gravity locking the piece before the bot drops it
+
+        # assert
+        self.assertEqual([(3, 3), (20, 20)], fired)
+        self.assertEqual(31, game_loop.ticks)
+        for bot in bots:
+            self.assertGreater(bot.actions_played, 0)
+            self.assertFalse(bot.is_game_over)
+        self.assertLess(human_y_after_gravity, starting_y)
+        self.assertEqual(2, human.actions_played)
+        self.assertTrue(any(block != " " for row in human.engine.playfield.get_all_rows() for block in row)) # dropped
+        latency = game_loop.get_scheduling_latency()
+        self.assertGreater(latency["samples"], 0)
+        self.assertLessEqual(latency["median"], latency["p99"])
+        self.assertLessEqual(latency["p99"], latency["max"])
+        self.assertRaises(ValueError, game_loop.send_input, "human", "jump")
+        self.assertTrue(loser.is_game_over)
+        self.assertEqual([loser], games_over) # only once
+        self.assertEqual(0, len(loser.inputs))
+        self.assertRaises(ValueError, short_game_loop.send_input, "loser", "left")
+        self.assertTrue(planned_for_the_spawned_piece)
+        self.assertTrue(late_bot.has_new_piece()) # its inputs are planned again in its next action
+
+    def test_27_game_server_sends_the_changes_of_every_tick(self):
+
+        # arrange
+        game_server = GameServer()
+        local_client = LocalClient(game_server)
+        visible_rows = config["playfield"]["rows"] - config["playfield"]["hidden_top_rows"]
+
+        async def play() -> tuple:
+            session_id = local_client.create_session(seed=7, gravity_speed=60000)
+            engine = game_server.game_loop.sessions[session_id].engine
+            updates = []
+            states_match = []
+            for actions in [ ["left", "left", "drop"], ["rotate_left", "right", "drop"], ["down"], ["drop", "drop", "drop"] ]:
+                for action in actions:
+                    local_client.move(session_id, action)
+                game_server.game_loop.tick() # the moves of all the sessions are played in the tick
+                updates.append(await local_client.receive_update())
+                state = local_client.states[session_id]
+                states_match.append(state["rows"] == [ "".join(row) for row in engine.playfield.get_shared_rows()[:visible_rows] ]
+                                    and state["falling"] == engine.falling_piece.get_current_absolute_coordinates())
+
+            # The same through a socket
+            server = await asyncio.start_server(game_server.handle_connection, "127.0.0.1", 0)
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(b'{"id": 1, "command": "create", "seed": 3}\n')
+            await writer.drain()
+            created = json.loads(await reader.readline())
+            writer.write(json.dumps({ "id": 2, "command": "move", "session": created["session"], "action": "drop" }).encode() + b"\n")
+            writer.write(b'{"id": 3, "command": "move", "session": 1, "action": "drop"}\n') # not its session
+            writer.write(b'[1, 2]\n') # not an object
+            writer.write(b'{"id": 4, "command": "move", "session": [1], "action": "drop"}\n')
+            await writer.drain()
+            error = json.loads(await reader.readline())
+            malformed_errors = [ json.loads(await reader.readline()) for _ in range(2) ]
+            game_server.game_loop.tick()
+            socket_update = json.loads(await reader.readline())
+            writer.close()
+            await writer.wait_closed()
+            await asyncio.sleep(0.01) # the server sees the connection closed
+            sessions_after_closing = len(game_server.game_loop.sessions)
+            server.close()
+            await server.wait_closed()
+            return updates, states_match, created, error, malformed_errors, socket_update, sessions_after_closing
+
+        # act
+        updates, states_match, created, error, malformed_errors, socket_update, sessions_after_closing = asyncio.run(play())
+        sessions_before_bad_creates = len(game_server.game_loop.sessions)
+        bad_creates = 0
+        for parameters in [ { "weights": { "foo": 1 } }, { "weights": dict(weights, weight_bumpiness="0.8") }, { "seed": 1.5 },
+                            { "gravity_speed": "fast" }, { "ruleset": [20, 42] }, { "ruleset": { "rows": 500000 } },
+                            { "ruleset": { "gravity_speed": 0 } } ]:
+            try:
+                local_client.create_session(**parameters)
+            except ValueError:
+                bad_creates += 1
+        game_server.max_rulesets = 2
+        for columns in (11, 12, 13):
+            game_server.get_ruleset({ "columns": columns })
+        statistics = local_client.get_statistics()
+
+        # assert
+        self.assertEqual("full", updates[0]["type"]) # the first one of the game
+        self.assertEqual(["delta", "delta", "delta"], [ update["type"] for update in updates[1:] ])
+        self.assertEqual([3, 6, 7, 10], [ update["moves"] for update in updates ])
+        self.assertEqual([True] * 4, states_match)
+        self.assertEqual({}, updates[2]["rows"]) # moving down doesn't change any row
+        self.assertEqual(2, created["session"])
+        self.assertEqual(3, error["id"])
+        self.assertIn("error", error)
+        self.assertEqual([None, 4], [ malformed_error.get("id") for malformed_error in malformed_errors ])
+        self.assertTrue(all("error" in malformed_error for malformed_error in malformed_errors))
+        self.assertEqual(7, bad_creates)
+        self.assertEqual([ (("columns", 12),), (("columns", 13),) ], list(game_server.rulesets)) # the oldest one went
+        self.assertEqual(sessions_before_bad_creates, len(game_server.game_loop.sessions)) # nothing is created
+        self.assertEqual(created["session"], socket_update["session"])
+        self.assertEqual(1, socket_update["moves"])
+        self.assertEqual(1, sessions_after_closing) # the session of the socket was closed with it
+        self.assertEqual(11, statistics["moves"])
+        self.assertEqual(11, statistics["move_latency"]["samples"])
+        self.assertGreater(statistics["sessions_per_core"], 0)
+        self.assertRaises(ValueError, local_client.move, 99, "left")
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_28_vector_env_observations_are_views_of_the_engines(self):
+
+        # arrange
+        placements_env = TetrisVectorEnv(4, action_mode="placements", seed=7)
+        moves_env = TetrisVectorEnv(3, action_mode="moves", seed=7, gravity_interval=1, max_steps=6)
+        drop = TetrisVectorEnv.moves.index("drop")
+        noop = TetrisVectorEnv.moves.index("noop")
+
+        def board_matches(env :TetrisVectorEnv, index :int) -> bool:
+            rows = env.engines[index].playfield.get_all_rows()[:env.visible_rows]
+            occupancy = numpy.array([ [ block != " " for block in row ] for row in rows ], dtype=numpy.uint8)
+            return numpy.array_equal(occupancy, env.observations["board"][index])
+
+        # act
+        observations = placements_env.reset()
+        boards = observations["board"]
+        all_boards_match = True
+        for _ in range(30):
+            actions = observations["action_mask"].argmax(axis=1) # the first placement that the piece can reach
+            observations, rewards, terminated, truncated, infos = placements_env.step(actions)
+            all_boards_match = all_boards_match and all(board_matches(placements_env, index) for index in range(4))
+        invalid_action = int(numpy.flatnonzero(~observations["action_mask"][0])[0])
+        board_before = boards[0].copy()
+        placements_env.step([invalid_action] + [ int(action) for action in observations["action_mask"][1:].argmax(axis=1) ])
+
+        moves_env.reset()
+        y_before = moves_env.positions[:, 1].copy()
+        moves_env.step([noop, noop, drop])
+        y_after_gravity = moves_env.positions[:, 1].copy()
+        blocks_after_dropping = moves_env.boards.sum(axis=(1, 2)).tolist()
+        for _ in range(4):
+            moves_env.step([noop, noop, noop])
+        _, _, _, truncated_moves, moves_infos = moves_env.step([drop, drop, drop])
+
+        # assert
+        self.assertIs(boards, observations["board"]) # always the same arrays
+        self.assertTrue(all_boards_match)
+        self.assertEqual([1, 0, 0, 0], placements_env.infos["invalid_actions"].tolist())
+        self.assertTrue(numpy.array_equal(board_before, boards[0])) # an invalid placement does nothing
+        self.assertEqual([ placements_env.shape_indexes[engine.next_shape] for engine in placements_env.engines ], observations["next_piece"].tolist())
+        self.assertEqual([1, 1], (y_before - y_after_gravity)[:2].tolist())
+        self.assertEqual([0, 0, 4], blocks_after_dropping)
+        self.assertEqual([True] * 3, truncated_moves.tolist()) # 6 steps
+        self.assertEqual([1] * 3, moves_infos["games"].tolist())
+        self.assertEqual(0, moves_env.boards.sum()) # new games
+
+    def test_29_rulesets_side_by_side(self):
+
+        # arrange
+        wide = Ruleset(columns=20, rows=42)
+        tetrominoes = [ tetromino for tetromino in config["tetrominoes"] if tetromino["shape"] in (TetrominoShape.I_SHAPE, TetrominoShape.O_SHAPE) ]
+        only_i_and_o = Ruleset(tetrominoes=tetrominoes)
+        file = io.BytesIO()
+
+        # act
+        wide_agent = TetrisAgent(seed=2, ruleset=wide, recorder=GameRecordWriter(file))
+        default_agent = TetrisAgent(seed=2)
+        wide_lines_cleared, _ = wide_agent.play_game(weights, 300)
+        default_lines_cleared, _ = default_agent.play_game(weights, 300)
+        replay = replay_record(read_records(file.getvalue())[0])
+        engine = TetrisEngine(piece_source=PieceSource(seed=3, shapes=only_i_and_o.shapes), ruleset=only_i_and_o)
+        shapes = { engine.get_next_shape() for _ in range(50) }
+        only_i_and_o_agent = TetrisAgent(seed=2, ruleset=only_i_and_o, recorder=GameRecordWriter(io.BytesIO()))
+
+        # assert
+        self.assertEqual(20, len(wide_agent.playfield.get_all_rows()[0]))
+        self.assertEqual(42, len(wide_agent.playfield.get_all_rows()))
+        self.assertEqual((10, 40), (wide.starting_x, wide.starting_y))
+        self.assertEqual(10, len(default_agent.playfield.get_all_rows()[0])) # the default one is not affected
+        self.assertEqual((5, 20), (default_agent.starting_x, default_agent.starting_y))
+        self.assertEqual(wide_lines_cleared, replay["lines_cleared"])
+        self.assertEqual(wide_agent.playfield.board_hash, replay["board_hash"])
+        self.assertEqual(default_lines_cleared, TetrisAgent(seed=2).play_game(weights, 300)[0])
+        self.assertEqual({ TetrominoShape.I_SHAPE, TetrominoShape.O_SHAPE }, shapes)
+        with self.assertRaises(ValueError):
+            only_i_and_o_agent.play_game(weights, 300) # the records don't have the tetrominoes
+        with self.assertRaises(ValueError):
+            replay_record(read_records(file.getvalue())[0], Ruleset(columns=20, rows=42, tetrominoes=tetrominoes))
+        with self.assertRaises(ValueError):
+            Ruleset(columns=3)
+        with self.assertRaises(ValueError):
+            Ruleset(starting_x=0)
+        with self.assertRaises(ValueError):
+            Ruleset(tetrominoes=[]) # not the default ones
+        for relative_coordinates in ([ [0, 0], [1, 0], [2, 0] ], [ [0, 0], [1, 0], [2, 0], [3, 0] ]):
+            with self.assertRaises(ValueError):
+                Ruleset(tetrominoes=[ dict(tetrominoes[1], orientations=[ { "angles": [ 0, 90, 180, 270 ], "relative_coordinates": relative_coordinates } ]) ])
+        if numpy is not None:
+            self.assertEqual((2, 40, 20), TetrisVectorEnv(2, ruleset=wide).boards.shape)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""
+Gym-style vectorized environment: N TetrisEngine games stepped together, e.g. for reinforcement learning.
+
+    env = TetrisVectorEnv(8, action_mode="placements", seed=7)
+    observations = env.reset()
+    observations, rewards, terminated, truncated, infos = env.step(actions) # actions: one int per game
+
+The observations are always the same preallocated NumPy arrays, updated in place by reset and step
+(copy them if you want to keep them):
+
+    board        : (games, visible rows, columns) uint8, 1 where there is a block. Row 0 is the bottom row
+    piece        : (games,) int8, index of the shape of the falling piece in the ruleset (Ruleset.shapes)
+    next_piece   : (games,) int8, index of the next shape
+    position     : (games, 3) int16, center_x, center_y and angle / 90 of the falling piece
+    action_mask  : (games, actions) bool, the placements that the falling piece can reach (placements mode only)
+
+The actions are, depending on action_mode:
+    moves      : the primitive moves of moves (noop, left, right...), and every gravity_interval steps
+                 the falling piece also moves down, like the timer of the playable Tetris
+    placements : angle / 90 * columns + center_x - 1, the piece is rotated, moved sideways and dropped (TetrisEngine.place).
+                 A placement that the piece can't reach does nothing (see action_mask and infos["invalid_actions"])
+
+The reward is the lines cleared in the step. A game is terminated at game over and truncated after max_steps (if any),
+and in both cases it starts again straight away (the observation is already from the new game).
+
+In every step the engines play in plain Python, but nothing else is created per step: no event data dicts,
+no rows copied. A board is only converted again (all of them at once) when its playfield changed,
+which we know because its board_hash changed.
+
+NumPy is required for this module.
+"""
+
+import numpy as np
+from tetris_engine import PieceSource, Ruleset, TetrisEngine, default_ruleset
+import tetris_numpy
+
+class TetrisVectorEnv:
+
+    MOVES = "moves"
+    PLACEMENTS = "placements"
+
+    moves = [
+        # action: method of the engine
+        "noop",
+        "move_left",
+        "move_right",
+        "rotate_left",
+        "rotate_right",
+        "move_down",
+        "drop"
+    ]
+
+    def __init__(self, number_of_games :int, action_mode :str = PLACEMENTS, seed :int = None,
+        piece_source_mode :str = PieceSource.UNIFORM, gravity_interval :int = 5, max_steps :int = None, ruleset :Ruleset = None) -> None:
+        """
+        :param seed: the game i has the pieces of the seed seed + i, None for different games every time
+        :param gravity_interval: moves mode only, steps between the moves down of the falling piece (0 no gravity)
+        :param max_steps: steps of a game before it is truncated, None for no limit
+        :param ruleset: the same one for all the games, by default the one of the config
+        """
+        if action_mode not in (self.MOVES, self.PLACEMENTS):
+            raise ValueError(f"Unknown action mode {action_mode}")
+        self.number_of_games = number_of_games
+        self.action_mode = action_mode
+        self.piece_source_mode = piece_source_mode
+        self.gravity_interval = gravity_interval
+        self.max_steps = max_steps
+
+        self.ruleset = ruleset or default_ruleset
+        self.columns = self.ruleset.columns
+        self.visible_rows = self.ruleset.visible_rows
+        self.shape_indexes = self.ruleset.shape_indexes
+        self.placements = [ (angle, center_x) for angle in (0, 90, 180, 270) for center_x in range(1, self.columns + 1) ]
+        self.number_of_actions = len(self.moves) if action_mode == self.MOVES else len(self.placements)
+
+        # The observations and the results of the steps, always the same arrays
+        self.boards = np.zeros((number_of_games, self.visible_rows, self.columns), dtype=np.uint8)
+        self.pieces = np.zeros(number_of_games, dtype=np.int8)
+        self.next_pieces = np.zeros(number_of_games, dtype=np.int8)
+        self.positions = np.zeros((number_of_games, 3), dtype=np.int16)
+        self.action_masks = np.zeros((number_of_games, len(self.placements)), dtype=bool)
+        self.rewards = np.zeros(number_of_games, dtype=np.float32)
+        self.terminated = np.zeros(number_of_games, dtype=bool)
+        self.truncated = np.zeros(number_of_games, dtype=bool)
+        self.observations = {
+            "board":      self.boards,
+            "piece":      self.pieces,
+            "next_piece": self.next_pieces,
+            "position":   self.positions
+        }
+        if action_mode == self.PLACEMENTS:
+            self.observations["action_mask"] = self.action_masks
+
+        self.row_masks = np.zeros((number_of_games, self.visible_rows), dtype=tetris_numpy.get_row_mask_dtype(self.columns))
+        self.board_hashes = [None] * number_of_games # of the boards we have in the observations
+        self.steps = np.zeros(number_of_games, dtype=np.int64) # of the current game
+        self.lines_cleared = np.zeros(number_of_games, dtype=np.int64) # of the current game
+        self.infos = {
+            "steps":               self.steps,
+            "lines_cleared":       self.lines_cleared,
+            "games":               np.zeros(number_of_games, dtype=np.int64), # finished
+            "final_lines_cleared": np.zeros(number_of_games, dtype=np.int64), # of the last game finished
+            "invalid_actions":     np.zeros(number_of_games, dtype=np.int64)
+        }
+
+        self.engines = [ TetrisEngine(piece_source=self._get_piece_source(seed, index), ruleset=self.ruleset) for index in range(number_of_games) ]
+        self.move_methods = []
+        for index, engine in enumerate(self.engines):
+            engine.bind_event(TetrisEngine.Events.ON_LINES_CLEARED, self._get_lines_cleared_counter(index))
+            engine.bind_event(TetrisEngine.Events.ON_GAME_OVER, self._get_game_over(index))
+            self.move_methods.append([ getattr(engine, method_name) if method_name != "noop" else None for method_name in self.moves ])
+
+    def _get_game_over(self, index :int) -> object:
+        def game_over() -> None:
+            self.terminated[index] = True
+        return game_over
+
+    def _get_lines_cleared_counter(self, index :int) -> object:
+        def update_lines_cleared_counter(lines_cleared :int) -> None:
+            self.rewards[index] += lines_cleared
+        return update_lines_cleared_counter
+
+    def _get_piece_source(self, seed :int, index :int) -> PieceSource:
+        return PieceSource(self.piece_source_mode, None if seed is None else seed + index, shapes=self.ruleset.shapes)
+
+    def _new_game(self, index :int) -> None:
+        engine = self.engines[index]
+        engine.new_game()
+        engine.get_next_piece()
+        self.steps[index] = 0
+        self.lines_cleared[index] = 0
+
+    def _update_action_mask(self, index :int) -> None:
+        """ Like TetrisEngine.place: the placements reached moving sideways at the spawn height """
+        engine = self.engines[index]
+        starting_x = self.ruleset.starting_x
+        starting_y = self.ruleset.starting_y
+        action_mask = self.action_masks[index]
+        action_mask[:] = False
+        for angle_index, angle in enumerate((0, 90, 180, 270)):
+            orientation = self.ruleset.orientation_table[(engine.falling_piece.shape, angle)]
+            for step in (-1, 1):
+                center_x = starting_x
+                while 1 <= center_x + orientation.min_relative_x and center_x + orientation.max_relative_x <= self.columns \
+                    and engine.can_place(orientation, center_x, starting_y):
+                    action_mask[angle_index * self.columns + center_x - 1] = True
+                    center_x += step
+
+    def _update_observation(self, index :int) -> bool:
+        """ The observation of one game except its board, it returns True if the board has to be converted again """
+        engine = self.engines[index]
+        falling_piece = engine.falling_piece
+        self.pieces[index] = self.shape_indexes[falling_piece.shape]
+        self.next_pieces[index] = self.shape_indexes[engine.next_shape]
+        position = self.positions[index]
+        position[0] = falling_piece.center_x
+        position[1] = falling_piece.center_y
+        position[2] = falling_piece.angle // 90
+        if self.action_mode == self.PLACEMENTS:
+            self._update_action_mask(index)
+
+        if engine.playfield.board_hash == self.board_hashes[index]:
+            return False
+        self.board_hashes[index] = engine.playfield.board_hash
+        self.row_masks[index] = engine.playfield.get_all_row_masks()[:self.visible_rows]
+        return True
+
+    def _update_boards(self, indexes :list[int]) -> None:
+        """ Only the boards that changed, all of them at once """
+        if indexes:
+            self.boards[indexes] = tetris_numpy.get_cells(self.row_masks[indexes], self.columns).reshape(len(indexes), self.visible_rows, self.columns)
+
+    def reset(self, seed :int = None) -> dict:
+        """ New games in all the envs, with new piece sources if there is a seed (see __init__) """
+        for index, engine in enumerate(self.engines):
+            if seed is not None:
+                engine.piece_source = self._get_piece_source(seed, index)
+                engine.next_shapes = [ engine.get_next_shape() for _ in engine.next_shapes ]
+            self._new_game(index)
+        self.rewards[:] = 0
+        self.terminated[:] = False
+        self.truncated[:] = False
+        self.board_hashes = [None] * self.number_of_games
+        self._update_boards([ index for index in range(self.number_of_games) if self._update_observation(index) ])
+        return self.observations
+
+    def step(self, actions :any) -> tuple[dict, np.ndarray, np.ndarray, np.ndarray, dict]:
+        """ One action per game, it returns (observations, rewards, terminated, truncated, infos) """
+        self.rewards[:] = 0
+        self.terminated[:] = False
+        self.truncated[:] = False
+        invalid_actions = self.infos["invalid_actions"]
+        changed_boards = []
+
+        for index, action in enumerate(actions.tolist() if isinstance(actions, np.ndarray) else actions):
+            engine = self.engines[index]
+            if self.action_mode == self.MOVES:
+                move_method = self.move_methods[index][action]
+                if move_method:
+                    move_method()
+                if self.gravity_interval and (self.steps[index] + 1) % self.gravity_interval == 0 and not self.terminated[index]:
+                    engine.move_down()
+            else:
+                angle, center_x = self.placements[action]
+                if not self.action_masks[index, action]:
+                    invalid_actions[index] += 1
+                else:
+                    lines_cleared, is_game_over, _ = engine.place(engine.falling_piece.shape, angle, center_x, engine.next_shape)
+                    self.rewards[index] = lines_cleared
+                    self.terminated[index] = is_game_over
+                    engine.get_next_piece()
+
+            self.steps[index] += 1
+            self.lines_cleared[index] += int(self.rewards[index])
+            if not self.terminated[index] and self.max_steps and self.steps[index] >= self.max_steps:
+                self.truncated[index] = True
+            if self.terminated[index] or self.truncated[index]:
+                self.infos["games"][index] += 1
+                self.infos["final_lines_cleared"][index] = self.lines_cleared[index]
+                self._new_game(index)
+            if self._update_observation(index):
+                changed_boards.append(index)
+
+        self._update_boards(changed_boards)
+        return self.observations, self.rewards, self.terminated, self.truncated, self.infos